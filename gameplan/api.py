@@ -7,6 +7,7 @@ from frappe.query_builder.functions import Count
 from frappe.utils import cstr, split_emails, validate_email_address
 
 import gameplan
+from gameplan.search_cache import search_result_cache
 from gameplan.utils import validate_type
 
 
@@ -383,6 +384,16 @@ def search(query, start=0):
 	from gameplan.search import GameplanSearch
 
 	search = GameplanSearch()
+	return search_result_cache.get(
+		"redisearch",
+		query,
+		lambda: _search(search, query, start),
+		search.get_accessible_projects(),
+		start=cstr(start),
+	)
+
+
+def _search(search, query, start):
 	query = search.clean_query(query)
 
 	query_parts = query.split(" ")
@@ -460,8 +471,9 @@ def search2(query):
 	from gameplan.search2 import GameplanSearch
 
 	search = GameplanSearch()
-	result = search.search(query)
-	return result
+	return search_result_cache.get(
+		"search2", query, lambda: search.search(query), search.get_accessible_projects()
+	)
 
 
 @frappe.whitelist()
@@ -476,8 +488,31 @@ def search_sqlite(query, filters=None):
 
 		filters = json.loads(filters)
 
-	result = search.search(query, filters=filters)
-	return result
+	return search_result_cache.get(
+		"sqlite",
+		query,
+		lambda: search.search(query, filters=filters),
+		search._get_accessible_projects(),
+		filters=filters,
+	)
+
+
+@frappe.whitelist()
+def get_search_cache_stats():
+	"""Hit and miss counts of the search result cache, to help size it"""
+	from gameplan.search_cache import get_search_cache_stats
+
+	frappe.only_for("System Manager")
+	return get_search_cache_stats()
+
+
+@frappe.whitelist()
+def get_search_metrics():
+	"""Percentiles of the time spent in each phase of recent searches, per search backend"""
+	from gameplan.search_metrics import get_search_metrics
+
+	frappe.only_for("System Manager")
+	return get_search_metrics()
 
 
 @frappe.whitelist()
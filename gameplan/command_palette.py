@@ -4,12 +4,24 @@
 
 import frappe
 
+from gameplan.search_cache import search_result_cache
+
 
 @frappe.whitelist()
 def search(query):
 	from gameplan.search import GameplanSearch
 
 	search = GameplanSearch()
+	return search_result_cache.get(
+		"redisearch",
+		query,
+		lambda: _search(search, query),
+		search.get_accessible_projects(),
+		view="command_palette",
+	)
+
+
+def _search(search, query):
 	query = search.clean_query(query)
 
 	query_parts = query.split(" ")
@@ -45,6 +57,16 @@ def search2(query):
 	from gameplan.search2 import GameplanSearch
 
 	search = GameplanSearch()
+	return search_result_cache.get(
+		"search2",
+		query,
+		lambda: _search2(search, query),
+		search.get_accessible_projects(),
+		view="command_palette",
+	)
+
+
+def _search2(search, query):
 	result = search.search(query, title_only=True)
 
 	groups = {}
@@ -68,9 +90,20 @@ def search2(query):
 @frappe.whitelist()
 def search_sqlite(query):
 	"""Search using SQLite FTS for command palette"""
-	from gameplan.search_sqlite import GameplanSearch, GameplanSearchIndexMissingError
+	from gameplan.search_sqlite import GameplanSearch
 
 	search = GameplanSearch()
+	return search_result_cache.get(
+		"sqlite",
+		query,
+		lambda: _search_sqlite(search, query),
+		search._get_accessible_projects(),
+		view="command_palette",
+	)
+
+
+def _search_sqlite(search, query):
+	from gameplan.search_sqlite import GameplanSearchIndexMissingError
 
 	try:
 		result = search.search(query, title_only=True)
@@ -7,7 +7,7 @@ from frappe.query_builder.functions import Count
 from frappe.utils import cint
 from pypika.terms import ExistsCriterion
 
-import gameplan
+from gameplan.project_access import get_accessible_projects, get_member_projects, projects_condition
 from gameplan.utils import html_to_text_preview
 
 
@@ -25,16 +25,8 @@ def get_discussions(filters=None, order_by=None, start=None, limit=None):
 
 	Discussion = frappe.qb.DocType("GP Discussion")
 	Project = frappe.qb.DocType("GP Project")
-	Member = frappe.qb.DocType("GP Member")
 	UnreadRecord = frappe.qb.DocType("GP Unread Record")
 
-	member_exists = (
-		frappe.qb.from_(Member)
-		.select(Member.name)
-		.where(Member.parenttype == "GP Project")
-		.where(Member.parent == Project.name)
-		.where(Member.user == frappe.session.user)
-	)
 	query = (
 		frappe.qb.get_query(
 			Discussion,
@@ -43,7 +35,7 @@ def get_discussions(filters=None, order_by=None, start=None, limit=None):
 		)
 		.left_join(Project)
 		.on(Discussion.project == Project.name)
-		.where((Project.is_private == 0) | ((Project.is_private == 1) & ExistsCriterion(member_exists)))
+		.where(projects_condition(Discussion.project, get_accessible_projects()))
 		.limit(limit + 1)
 		.offset(start or 0)
 	)
@@ -67,7 +59,7 @@ def get_discussions(filters=None, order_by=None, start=None, limit=None):
 		query = query.where(ExistsCriterion(unread_record_exists))
 
 	if feed_type == "following":
-		query = query.where(ExistsCriterion(member_exists))
+		query = query.where(projects_condition(Discussion.project, get_member_projects()))
 
 	if feed_type == "participating":
 		query = query.where(
@@ -78,12 +70,6 @@ def get_discussions(filters=None, order_by=None, start=None, limit=None):
 	# default order by last_post_at desc
 	query = query.orderby(Discussion[order_field], order=frappe._dict(value=order_direction))
 
-	is_guest = gameplan.is_guest()
-	if is_guest:
-		GuestAccess = frappe.qb.DocType("GP Guest Access")
-		project_list = GuestAccess.select(GuestAccess.project).where(GuestAccess.user == frappe.session.user)
-		query = query.where(Discussion.project.isin(project_list))
-
 	discussions = query.run(as_dict=1)
 	has_next_page = len(discussions) > limit
 	discussions = discussions[:limit]
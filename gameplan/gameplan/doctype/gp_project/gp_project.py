@@ -7,14 +7,13 @@ import frappe
 import requests
 from bs4 import BeautifulSoup
 from frappe.model.document import Document
-from pypika.terms import ExistsCriterion
 
-import gameplan
 from gameplan.api import invite_by_email
 from gameplan.gameplan.doctype.gp_unread_record.gp_unread_record import GPUnreadRecord
 from gameplan.gemoji import get_random_gemoji
 from gameplan.mixins.archivable import Archivable
 from gameplan.mixins.manage_members import ManageMembersMixin
+from gameplan.project_access import get_accessible_projects, get_joined_projects, projects_condition
 
 
 class GPProject(ManageMembersMixin, Archivable, Document):
@@ -31,48 +30,12 @@ class GPProject(ManageMembersMixin, Archivable, Document):
 	@staticmethod
 	def get_list_query(query):
 		Project = frappe.qb.DocType("GP Project")
-		Member = frappe.qb.DocType("GP Member")
-		member_exists = (
-			frappe.qb.from_(Member)
-			.select(Member.name)
-			.where(Member.parenttype == "GP Project")
-			.where(Member.parent == Project.name)
-			.where(Member.user == frappe.session.user)
-		)
-		query = query.where(
-			(Project.is_private == 0) | ((Project.is_private == 1) & ExistsCriterion(member_exists))
-		)
-		if gameplan.is_guest():
-			GuestAccess = frappe.qb.DocType("GP Guest Access")
-			project_list = GuestAccess.select(GuestAccess.project).where(
-				GuestAccess.user == frappe.session.user
-			)
-			query = query.where(Project.name.isin(project_list))
-
-		return query
+		return query.where(projects_condition(Project.name, get_accessible_projects()))
 
 	@staticmethod
 	def get_list(query):
 		Project = frappe.qb.DocType("GP Project")
-		Member = frappe.qb.DocType("GP Member")
-		member_exists = (
-			frappe.qb.from_(Member)
-			.select(Member.name)
-			.where(Member.parenttype == "GP Project")
-			.where(Member.parent == Project.name)
-			.where(Member.user == frappe.session.user)
-		)
-		query = query.where(
-			(Project.is_private == 0) | ((Project.is_private == 1) & ExistsCriterion(member_exists))
-		)
-		if gameplan.is_guest():
-			GuestAccess = frappe.qb.DocType("GP Guest Access")
-			project_list = GuestAccess.select(GuestAccess.project).where(
-				GuestAccess.user == frappe.session.user
-			)
-			query = query.where(Project.name.isin(project_list))
-
-		return query
+		return query.where(projects_condition(Project.name, get_accessible_projects()))
 
 	def as_dict(self, *args, **kwargs) -> dict:
 		d = super().as_dict(*args, **kwargs)
@@ -223,17 +186,7 @@ def get_meta_tags(url):
 
 @frappe.whitelist()
 def get_joined_spaces():
-	user = frappe.session.user
-	projects = frappe.qb.get_query(
-		"GP Project",
-		filters={"members.user": user},
-		fields=["name"],
-	).run(as_dict=True, pluck="name")
-	guest_access_projects = frappe.qb.get_query(
-		"GP Guest Access", filters={"user": user}, fields=["project"]
-	).run(as_dict=True, pluck="project")
-
-	return list(map(str, set(projects + guest_access_projects)))
+	return get_joined_projects()
 
 
 @frappe.whitelist()
@@ -142,6 +142,19 @@ doc_events = {
 		],
 		"on_update": "gameplan.gameplan.doctype.gp_user_profile.gp_user_profile.on_user_update",
 	},
+	"GP Project": {
+		"on_update": "gameplan.project_access.on_access_change",
+		"after_delete": "gameplan.project_access.on_access_change",
+		"after_rename": "gameplan.project_access.on_access_change",
+	},
+	"GP Team": {
+		"on_update": "gameplan.project_access.on_access_change",
+		"after_delete": "gameplan.project_access.on_access_change",
+	},
+	"GP Guest Access": {
+		"on_update": "gameplan.project_access.on_access_change",
+		"after_delete": "gameplan.project_access.on_access_change",
+	},
 }
 
 on_login = "gameplan.www.g.on_login"
@@ -150,8 +163,15 @@ on_login = "gameplan.www.g.on_login"
 # ---------------
 
 scheduler_events = {
-	"hourly": ["gameplan.gameplan.doctype.gp_invitation.gp_invitation.expire_invitations"],
+	"hourly": [
+		"gameplan.gameplan.doctype.gp_invitation.gp_invitation.expire_invitations",
+		"gameplan.search2.compact_index",
+		"gameplan.search_verify.verify_indexes",
+	],
 	"daily": ["gameplan.demo.demo.generate_data_daily"],
+	"cron": {
+		"*/15 * * * *": ["gameplan.search_catchup.catch_up_indexes"],
+	},
 }
 
 # scheduler_events = {
@@ -0,0 +1,100 @@
+# Copyright (c) 2025, Frappe Technologies Pvt. Ltd. and Contributors
+# MIT License. See license.txt
+
+import frappe
+from frappe.utils import cstr
+
+import gameplan
+from gameplan.search_cache import TTLCache
+
+# Number of users whose projects are kept per worker process
+CACHE_SIZE = 1024
+
+# Role changes don't go through the hooks that change the version, so entries also expire
+CACHE_TTL = 300
+
+VERSION_KEY = "project_access_version"
+
+
+class ProjectAccessCache(TTLCache):
+	"""Projects each user can access and has joined, shared by search, listings and unread counts.
+
+	Entries are stored in Redis, with an LRU per worker process in front of it. Both are keyed by a
+	version that changes whenever a project's members or privacy, a team's members or a guest's
+	access changes, so that the entries computed before the change aren't used anymore.
+	"""
+
+	redis_prefix = "project_access"
+
+	def __init__(self, maxsize=CACHE_SIZE, ttl=CACHE_TTL):
+		super().__init__(maxsize, ttl)
+
+	def get(self, user=None):
+		"""Return a dict with the `accessible`, `member` and `guest` projects of the user."""
+		user = user or frappe.session.user
+		key = f"{frappe.local.site}:{get_access_version()}:{user}"
+		return self.get_value(key, lambda: compute_projects(user))[0]
+
+	def use_redis(self):
+		return True
+
+
+project_access_cache = ProjectAccessCache()
+
+
+def get_accessible_projects(user=None):
+	"""Names of the projects the user can see: public ones and private ones they are a member of.
+
+	Guests only see those of them they have been given access to.
+	"""
+	return project_access_cache.get(user)["accessible"]
+
+
+def get_joined_projects(user=None):
+	"""Names of the projects the user is a member of or has guest access to."""
+	projects = project_access_cache.get(user)
+	return sorted(set(projects["member"]) | set(projects["guest"]))
+
+
+def get_member_projects(user=None):
+	return project_access_cache.get(user)["member"]
+
+
+def projects_condition(field, projects):
+	"""Query condition that only matches rows whose project `field` is one of `projects`."""
+	# Project fields are never null, so no row matches if there are no projects
+	return field.isin(projects) if projects else field.isnull()
+
+
+def compute_projects(user):
+	member = frappe.qb.get_query(
+		"GP Member", fields=["parent"], filters={"parenttype": "GP Project", "user": user}
+	).run(pluck=True)
+	guest = frappe.qb.get_query("GP Guest Access", fields=["project"], filters={"user": user}).run(pluck=True)
+	public = frappe.qb.get_query("GP Project", fields=["name"], filters={"is_private": 0}).run(pluck=True)
+
+	member = {cstr(p) for p in member}
+	guest = {cstr(p) for p in guest if p}
+	accessible = {cstr(p) for p in public} | member
+	if gameplan.is_guest(user):
+		accessible &= guest
+
+	return {"accessible": sorted(accessible), "member": sorted(member), "guest": sorted(guest)}
+
+
+def get_access_version():
+	return frappe.cache().get_value(VERSION_KEY) or ""
+
+
+def update_access_version():
+	"""Make the cached projects of all users stale, so that they are computed again."""
+	frappe.cache().set_value(VERSION_KEY, frappe.generate_hash())
+
+
+def on_access_change(doc, method=None, *args):
+	"""Clear cached projects once the change to a project, team or guest access is committed.
+
+	The version is also changed right away, so that the rest of the request sees the change.
+	"""
+	update_access_version()
+	frappe.db.after_commit.add(update_access_version)
@@ -3,18 +3,43 @@
 
 
 import re
+import time
+from collections import defaultdict
 
 import frappe
 from frappe.core.utils import html2text
-from frappe.utils import cstr, update_progress_bar
+from frappe.utils import cstr, now_datetime, update_progress_bar
 
-import gameplan
+from gameplan.project_access import get_accessible_projects
+from gameplan.search_cache import update_index_version
+from gameplan.search_records import (
+	RECORDS_CHUNK_SIZE,
+	get_digest,
+	get_record_chunks,
+	get_records_by_name,
+	set_high_water_mark,
+)
 from gameplan.utils.search import Search
 
 UNSAFE_CHARS = re.compile(r"[\[\]{}<>+]")
 
 INDEX_BUILD_FLAG = "discussions_index_in_progress"
 
+# Number of documents sent to Redis in one pipeline when building the index
+INDEX_BATCH_SIZE = 500
+
+# Doctype, fields and filters of the records that are indexed
+RECORD_SOURCES = [
+	("GP Discussion", ["name", "title", "content", "last_post_at", "modified", "project", "team"], None),
+	("GP Task", ["name", "title", "description", "modified", "project", "team"], None),
+	("GP Page", ["name", "title", "content", "modified", "project", "team"], None),
+	(
+		"GP Comment",
+		["name", "content", "modified", "reference_doctype", "reference_name"],
+		{"deleted_at": ("is", "not set")},
+	),
+]
+
 
 class GameplanSearch(Search):
 	def __init__(self) -> None:
@@ -40,19 +65,75 @@ class GameplanSearch(Search):
 		query = query.strip()
 		return query
 
-	def build_index(self):
-		self.drop_index()
-		self.create_index()
-		records = self.get_records()
-		total = len(records)
-		for i, doc in enumerate(records):
-			self.index_doc(doc)
-			if not hasattr(frappe.local, "request"):
-				update_progress_bar("Indexing", i, total)
+	def build_index(self, batch_size=INDEX_BATCH_SIZE):
+		"""Index all records into a new generation of the index and switch searches to it.
+
+		Records are sent to Redis in pipelines of `batch_size` documents.
+
+		Returns the number of indexed documents and the throughput of the build.
+		"""
+		start = time.monotonic()
+		started_at = now_datetime()
+		# Searches keep using the current generation of the index until the new one is complete
+		generation = self.start_rebuild()
+
+		def get_documents():
+			total, done = self.count_records(), 0
+			for records in self.get_records():
+				for doc in records:
+					document = self.get_document(doc)
+					if document:
+						yield document
+				done += len(records)
+				self.refresh_rebuild_lock()
+				if not hasattr(frappe.local, "request"):
+					update_progress_bar("Indexing", done, total)
+
+		try:
+			count = self.add_documents(get_documents(), generation, chunk_size=batch_size)
+		except Exception:
+			self.abort_rebuild(generation)
+			raise
+		self.finish_rebuild(generation)
+
+		duration = time.monotonic() - start
+		stats = {
+			"documents": count,
+			"seconds": round(duration, 3),
+			"documents_per_second": round(count / duration) if duration else count,
+		}
 		if not hasattr(frappe.local, "request"):
 			print()
+			print(f"Indexed {count} documents in {duration:.1f}s ({stats['documents_per_second']} docs/s)")
+		update_index_version("redisearch")
+		set_high_water_mark("redisearch", started_at)
+		return stats
+
+	def catch_up(self, since):
+		"""Index the records modified at or after `since` and return how many were indexed."""
+		count = 0
+		for records in self.get_records(since=since):
+			documents = [document for document in map(self.get_document, records) if document]
+			for generation in self._get_write_generations():
+				self.add_documents(documents, generation)
+			count += len(documents)
+		if count:
+			update_index_version("redisearch")
+		return count
+
+	def remove_documents(self, doc_ids):
+		for doc_id in doc_ids:
+			self.remove_document(doc_id)
+		if doc_ids:
+			update_index_version("redisearch")
 
 	def index_doc(self, doc):
+		document = self.get_document(doc)
+		if document:
+			self.add_document(*document)
+
+	def get_document(self, doc):
+		"""Return the (id, fields, payload) of a record to index, or None if it isn't indexed."""
 		id, fields, payload = None, None, None
 		if doc.doctype == "GP Discussion":
 			id = f"GP Discussion:{doc.name}"
@@ -95,8 +176,14 @@ class GameplanSearch(Search):
 			}
 		elif doc.doctype == "GP Comment":
 			id = f"GP Comment:{doc.name}"
-			team = frappe.db.get_value(doc.reference_doctype, doc.reference_name, "team", cache=True)
-			project = frappe.db.get_value(doc.reference_doctype, doc.reference_name, "project", cache=True)
+			if "project" in doc:
+				# Set in bulk by _set_comment_references when building the index
+				team, project = doc.team, doc.project
+			else:
+				team = frappe.db.get_value(doc.reference_doctype, doc.reference_name, "team", cache=True)
+				project = frappe.db.get_value(
+					doc.reference_doctype, doc.reference_name, "project", cache=True
+				)
 
 			fields = {
 				"content": html2text(doc.content),
@@ -109,7 +196,27 @@ class GameplanSearch(Search):
 				"reference_name": doc.reference_name,
 			}
 		if id and fields and payload:
-			self.add_document(id, fields, payload=payload)
+			return id, fields, payload
+
+	def _set_comment_references(self, records):
+		"""Set the team and project of each comment to those of the document it was posted on."""
+		names_by_doctype = defaultdict(set)
+		for doc in records:
+			if doc.doctype == "GP Comment" and doc.reference_doctype and doc.reference_name:
+				names_by_doctype[doc.reference_doctype].add(doc.reference_name)
+
+		references = {}
+		for doctype, names in names_by_doctype.items():
+			for d in frappe.get_all(
+				doctype, filters={"name": ("in", list(names))}, fields=["name", "team", "project"]
+			):
+				references[(doctype, cstr(d.name))] = (d.team, d.project)
+
+		for doc in records:
+			if doc.doctype == "GP Comment":
+				doc.team, doc.project = references.get(
+					(doc.reference_doctype, cstr(doc.reference_name)), (None, None)
+				)
 
 	def remove_doc(self, doc):
 		id = None
@@ -124,68 +231,75 @@ class GameplanSearch(Search):
 		if id:
 			self.remove_document(id)
 
-	def get_records(self):
-		records = []
-		for d in frappe.db.get_all(
-			"GP Discussion",
-			fields=["name", "title", "content", "last_post_at", "modified", "project", "team"],
-		):
-			d.doctype = "GP Discussion"
-			d.modified = d.last_post_at or d.modified
-			records.append(d)
-
-		for d in frappe.db.get_all(
-			"GP Task", fields=["name", "title", "description", "modified", "project", "team"]
-		):
-			d.doctype = "GP Task"
-			records.append(d)
-
-		for d in frappe.db.get_all(
-			"GP Page", fields=["name", "title", "content", "modified", "project", "team"]
-		):
-			d.doctype = "GP Page"
-			records.append(d)
-
-		for d in frappe.db.get_all(
-			"GP Comment",
-			fields=["name", "content", "modified", "reference_doctype", "reference_name"],
-			filters={"deleted_at": ("is", "not set")},
-		):
-			d.doctype = "GP Comment"
-			records.append(d)
+	def get_records(self, chunk_size=RECORDS_CHUNK_SIZE, since=None):
+		"""Yield the records to index in chunks, with the team and project of comments set.
+
+		If `since` is given, only records modified at or after it are read.
+		"""
+		for doctype, fields, filters in RECORD_SOURCES:
+			since_fields = ["last_post_at", "modified"] if doctype == "GP Discussion" else ["modified"]
+			for records in get_record_chunks(
+				doctype,
+				fields,
+				filters=filters,
+				chunk_size=chunk_size,
+				since=since,
+				since_fields=since_fields,
+			):
+				self._prepare_records(doctype, records)
+				yield records
 
+	def _prepare_records(self, doctype, records):
+		if doctype == "GP Discussion":
+			for d in records:
+				d.modified = d.last_post_at or d.modified
+		elif doctype == "GP Comment":
+			self._set_comment_references(records)
+
+	def get_records_by_name(self, doctype, names):
+		_, fields, filters = next(source for source in RECORD_SOURCES if source[0] == doctype)
+		records = get_records_by_name(doctype, fields, names, filters)
+		self._prepare_records(doctype, records)
 		return records
 
+	def reindex_documents(self, doctype, names):
+		documents = [
+			document
+			for document in map(self.get_document, self.get_records_by_name(doctype, names))
+			if document
+		]
+		for generation in self._get_write_generations():
+			self.add_documents(documents, generation)
+		if documents:
+			update_index_version("redisearch")
+
+	def get_record_digests(self, doctype, names):
+		"""Digests of the documents the records with the given names should be indexed as."""
+		digests = {}
+		for doc in self.get_records_by_name(doctype, names):
+			document = self.get_document(doc)
+			if document:
+				id, fields, _ = document
+				digests[id] = self._get_digest(self.get_mapping(fields))
+		return digests
+
+	def count_documents(self):
+		"""Total number of indexed documents under None, as the index can't count them by doctype."""
+		return {None: super().count_documents()}
+
+	def get_index_digests(self, ids):
+		"""Digests of the documents with the given ids that are in the index."""
+		return {id: self._get_digest(fields) for id, fields in self.get_documents(ids).items()}
+
+	def _get_digest(self, fields):
+		values = [fields.get(field.name, "") for field in self.schema if field.name != "modified"]
+		return get_digest(fields.get("modified"), *values)
+
+	def count_records(self):
+		return sum(frappe.db.count(doctype, filters=filters) for doctype, _, filters in RECORD_SOURCES)
+
 	def get_accessible_projects(self):
-		from pypika.terms import ExistsCriterion
-
-		if gameplan.is_guest():
-			GuestAccess = frappe.qb.DocType("GP Guest Access")
-			return (
-				frappe.qb.from_(GuestAccess)
-				.select(GuestAccess.project)
-				.distinct()
-				.where(GuestAccess.user == frappe.session.user)
-				.run(pluck=True)
-			)
-
-		Project = frappe.qb.DocType("GP Project")
-		Member = frappe.qb.DocType("GP Member")
-		member_exists = (
-			frappe.qb.from_(Member)
-			.select(Member.name)
-			.where(Member.parenttype == "GP Team")
-			.where(Member.parent == Project.team)
-			.where(Member.user == frappe.session.user)
-		)
-		projects = (
-			frappe.qb.from_(Project)
-			.select(Project.name)
-			.distinct()
-			.where((Project.is_private == 0) | ((Project.is_private == 1) & ExistsCriterion(member_exists)))
-			.run(pluck=True)
-		)
-		return [cstr(p) for p in projects]
+		return get_accessible_projects()
 
 
 def build_index():
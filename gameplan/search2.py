@@ -3,12 +3,24 @@
 
 
 import datetime
+import json
+from collections import defaultdict
 
 import frappe
-from frappe.utils import cint, cstr
-
-import gameplan
-from gameplan.utils.fts import FullTextSearch
+from frappe.utils import cstr, now_datetime
+
+from gameplan.project_access import get_accessible_projects
+from gameplan.search_cache import update_index_version
+from gameplan.search_metrics import SearchMetrics, record_search_metrics
+from gameplan.search_records import (
+	INDEXED_DOCTYPES,
+	RECORDS_CHUNK_SIZE,
+	get_digest,
+	get_record_chunks,
+	get_records_by_name,
+	set_high_water_mark,
+)
+from gameplan.utils.fts import COMPACTION_THRESHOLD, FullTextSearch
 
 INDEX_BUILD_FLAG = "discussions_index_in_progress"
 
@@ -77,69 +89,37 @@ class GameplanSearch:
 		if not query:
 			return []
 
-		search_response = self.fts.search(query, title_only=title_only)
-		results = search_response["results"]
-		summary = search_response["summary"]
-
-		comment_refs = {}
-		doc_owners = {}
-		comment_names = [r["id"].split(":", 1)[1] for r in results if r["id"].startswith("GP Comment:")]
-		if comment_names:
-			refs = frappe.get_all(
-				"GP Comment",
-				filters={"name": ["in", comment_names]},
-				fields=["name", "reference_doctype", "reference_name", "owner"],
-			)
-			comment_refs = {r.name: r for r in refs}
-
-		# Get owners for other doctypes
-		for doctype in ["GP Discussion", "GP Task", "GP Page"]:
-			doc_names = [r["id"].split(":", 1)[1] for r in results if r["id"].startswith(f"{doctype}:")]
-			if doc_names:
-				owners = frappe.get_all(
-					doctype, filters={"name": ["in", doc_names]}, fields=["name", "owner"]
-				)
-				doc_owners.update({f"{doctype}:{o.name}": o.owner for o in owners})
-
-		# Filter results based on project access
-		accessible_projects = self.get_accessible_projects()
-		filtered_results = []
-
-		for result in results:
+		metrics = SearchMetrics()
+		with metrics.phase("permissions"):
+			projects = self.get_accessible_projects()
+		# Only documents in projects the user can access are matched, so every page of results is full
+		search_response = self.fts.search(query, title_only=title_only, projects=projects, metrics=metrics)
+		record_search_metrics("search2", metrics)
+		results = []
+		for result in search_response["results"]:
 			doctype, name = result["id"].split(":", 1)
-
-			if doctype == "GP Comment":
-				ref = comment_refs.get(cint(name), {})
-				ref_doctype = ref.get("reference_doctype")
-				ref_name = ref.get("reference_name")
-				project = frappe.db.get_value(ref_doctype, ref_name, "project") if ref_doctype else None
-				author = ref.get("owner")
-			else:
-				project = frappe.db.get_value(doctype, name, "project")
-				author = doc_owners.get(result["id"], "")
-
-			if project in accessible_projects:
-				filtered_results.append(
-					{
-						"id": result["id"],
-						"title": result.get("title"),
-						"content": result.get("content", ""),
-						"timestamp": result["timestamp"],
-						"score": result["score"],
-						"doctype": doctype,
-						"name": name,
-						"project": project,
-						"reference_doctype": ref_doctype if doctype == "GP Comment" else None,
-						"reference_name": ref_name if doctype == "GP Comment" else None,
-						"author": author,
-					}
-				)
+			attributes = result["attributes"]
+			results.append(
+				{
+					"id": result["id"],
+					"title": result.get("title"),
+					"content": result.get("content", ""),
+					"timestamp": result["timestamp"],
+					"score": result["score"],
+					"doctype": doctype,
+					"name": name,
+					"project": attributes.get("project"),
+					"reference_doctype": attributes.get("reference_doctype"),
+					"reference_name": attributes.get("reference_name"),
+					"author": attributes.get("owner"),
+				}
+			)
 
 		return {
-			"results": filtered_results,
+			"results": results,
 			"summary": {
-				**summary,
-				"filtered_matches": len(filtered_results),
+				**search_response["summary"],
+				"filtered_matches": len(results),
 			},
 		}
 
@@ -147,15 +127,38 @@ class GameplanSearch:
 		if not self.is_search_enabled():
 			return
 
-		records = self.get_records()
-		documents = []
+		started_at = now_datetime()
+		documents = (self._prepare_document(doc) for doc in self.get_records())
+		self.fts.index_documents((document for document in documents if document), total=self.count_records())
+		update_index_version("search2")
+		set_high_water_mark("search2", started_at)
 
-		for doc in records:
+	def catch_up(self, since):
+		"""Index the records modified at or after `since` and return how many were indexed."""
+		count = 0
+		for doc in self.get_records(since=since):
 			document = self._prepare_document(doc)
 			if document:
-				documents.append(document)
-
-		self.fts.index_documents(documents)
+				self.fts.index_document(document)
+				count += 1
+		if count:
+			update_index_version("search2")
+			self._compact_if_needed()
+		return count
+
+	def get_document_ids(self):
+		return self.fts.document_ids()
+
+	def count_documents(self):
+		"""Number of indexed documents of each doctype."""
+		return {doctype: self.fts.count_documents(f"{doctype}:") for doctype in INDEXED_DOCTYPES}
+
+	def remove_documents(self, doc_ids):
+		for doc_id in doc_ids:
+			self.fts.remove_document(doc_id)
+		if doc_ids:
+			update_index_version("search2")
+			self._compact_if_needed()
 
 	def index_doc(self, doc):
 		"""Index a single document in background"""
@@ -166,9 +169,13 @@ class GameplanSearch:
 	def _index_doc(self, doctype, docname):
 		doc = frappe.get_doc(doctype, docname)
 		self.raise_if_not_indexed()
+		if doctype == "GP Comment":
+			self._set_comment_projects([doc])
 		document = self._prepare_document(doc)
 		if document:
 			self.fts.index_document(document)
+			update_index_version("search2")
+			self._compact_if_needed()
 
 	def remove_doc(self, doc):
 		"""Remove a single document from the index"""
@@ -181,6 +188,17 @@ class GameplanSearch:
 		self.raise_if_not_indexed()
 		doc_id = f"{doctype}:{docname}"
 		self.fts.remove_document(doc_id)
+		update_index_version("search2")
+		self._compact_if_needed()
+
+	def _compact_if_needed(self):
+		if self.fts.pending_updates() >= COMPACTION_THRESHOLD:
+			frappe.enqueue(
+				"gameplan.search2.compact_index",
+				queue="long",
+				job_id="gameplan_search2_compact_index",
+				deduplicate=True,
+			)
 
 	def index_exists(self):
 		return self.fts.index_exists()
@@ -201,51 +219,104 @@ class GameplanSearch:
 			"title": getattr(doc, title_field, "") if title_field else "",
 			"content": getattr(doc, content_field, "") or "",
 			"timestamp": doc.modified.timestamp(),
+			"attributes": {
+				"project": cstr(doc.get("project")) or None,
+				"owner": doc.get("owner"),
+				"reference_doctype": doc.get("reference_doctype"),
+				"reference_name": doc.get("reference_name"),
+			},
 		}
 
-	def get_records(self):
-		records = []
+	def get_records(self, chunk_size=RECORDS_CHUNK_SIZE, since=None):
+		"""Yield the records to index, reading them in chunks paginated on name.
+
+		If `since` is given, only records modified at or after it are read.
+		"""
 		for doctype, config in self.doc_configs.items():
-			docs = frappe.db.get_all(doctype, fields=config["fields"], filters=config.get("filters", {}))
+			since_fields = {"modified", config["modified_field"]}
+			for docs in get_record_chunks(
+				doctype,
+				config["fields"],
+				filters=config.get("filters"),
+				chunk_size=chunk_size,
+				since=since,
+				since_fields=sorted(since_fields),
+			):
+				self._prepare_records(doctype, docs)
+				yield from docs
+
+	def _prepare_records(self, doctype, docs):
+		config = self.doc_configs[doctype]
+		if doctype == "GP Comment":
+			self._set_comment_projects(docs)
+
+		for doc in docs:
+			if config["modified_field"] != "modified":
+				doc.modified = getattr(doc, config["modified_field"], None) or doc.modified
+
+	def get_records_by_name(self, doctype, names):
+		config = self.doc_configs[doctype]
+		docs = get_records_by_name(doctype, config["fields"], names, config.get("filters"))
+		self._prepare_records(doctype, docs)
+		return docs
+
+	def reindex_documents(self, doctype, names):
+		count = 0
+		for doc in self.get_records_by_name(doctype, names):
+			document = self._prepare_document(doc)
+			if document:
+				self.fts.index_document(document)
+				count += 1
+		if count:
+			update_index_version("search2")
+			self._compact_if_needed()
+
+	def get_record_digests(self, doctype, names):
+		"""Digests of the documents the records with the given names should be indexed as."""
+		digests = {}
+		for doc in self.get_records_by_name(doctype, names):
+			document = self._prepare_document(doc)
+			if document:
+				# Contents are stored with their markup removed
+				document["content"] = self.fts._process_content(document["content"])
+				digests[document["id"]] = self._get_digest(document)
+		return digests
 
-			for doc in docs:
-				doc.doctype = doctype
-				if config["modified_field"] != "modified":
-					doc.modified = getattr(doc, config["modified_field"], None) or doc.modified
-				records.append(doc)
+	def get_index_digests(self, doc_ids):
+		"""Digests of the documents with the given ids that are in the index."""
+		return {
+			doc_id: self._get_digest(document) for doc_id, document in self.fts.get_documents(doc_ids).items()
+		}
 
-		return records
+	def _get_digest(self, document):
+		attributes = json.dumps(document["attributes"], sort_keys=True)
+		return get_digest(document["timestamp"], document["title"], document["content"], attributes)
+
+	def _set_comment_projects(self, comments):
+		"""Set the project of each comment to the one of the document it was posted on."""
+		names_by_doctype = defaultdict(set)
+		for comment in comments:
+			if comment.reference_doctype and comment.reference_name:
+				names_by_doctype[comment.reference_doctype].add(comment.reference_name)
+
+		projects = {}
+		for doctype, names in names_by_doctype.items():
+			for d in frappe.get_all(
+				doctype, filters={"name": ("in", list(names))}, fields=["name", "project"]
+			):
+				projects[(doctype, cstr(d.name))] = d.project
+
+		for comment in comments:
+			comment.project = projects.get((comment.reference_doctype, cstr(comment.reference_name)))
+
+	def count_records(self):
+		return sum(
+			frappe.db.count(doctype, filters=config.get("filters", {}))
+			for doctype, config in self.doc_configs.items()
+		)
 
 	def get_accessible_projects(self):
-		from pypika.terms import ExistsCriterion
-
-		if gameplan.is_guest():
-			GuestAccess = frappe.qb.DocType("GP Guest Access")
-			return (
-				frappe.qb.from_(GuestAccess)
-				.select(GuestAccess.project)
-				.distinct()
-				.where(GuestAccess.user == frappe.session.user)
-				.run(pluck=True)
-			)
-
-		Project = frappe.qb.DocType("GP Project")
-		Member = frappe.qb.DocType("GP Member")
-		member_exists = (
-			frappe.qb.from_(Member)
-			.select(Member.name)
-			.where(Member.parenttype == "GP Team")
-			.where(Member.parent == Project.team)
-			.where(Member.user == frappe.session.user)
-		)
-		projects = (
-			frappe.qb.from_(Project)
-			.select(Project.name)
-			.distinct()
-			.where((Project.is_private == 0) | ((Project.is_private == 1) & ExistsCriterion(member_exists)))
-			.run(pluck=True)
-		)
-		return [cstr(p) for p in projects]
+		return get_accessible_projects()
 
 
 def build_index():
@@ -285,3 +356,10 @@ def remove_document(doctype, docname):
 	if not search.is_search_enabled():
 		return
 	search._remove_doc(doctype, docname)
+
+
+def compact_index():
+	search = GameplanSearch()
+	if not search.is_search_enabled() or not search.index_exists():
+		return
+	search.fts.compact_change_log()
@@ -0,0 +1,533 @@
+# Copyright (c) 2025, Frappe Technologies Pvt. Ltd. and Contributors
+# MIT License. See license.txt
+
+"""Benchmark of the search backends over synthetic corpora.
+
+Corpora are generated from the demo discussion and comment templates, with the placeholders
+filled from a fixed pool of Faker values, so that a seed always gives the same documents and the
+vocabulary doesn't grow with the size of the corpus. Each corpus is inserted into the database,
+indexed by every backend and searched with a fixed mix of queries, then deleted again.
+
+Run it on a site that is only used for benchmarks, as the search indexes are rebuilt from it:
+
+	bench --site bench.localhost execute gameplan.search_benchmark.run --kwargs "{'sizes': [10000]}"
+"""
+
+import datetime
+import json
+import os
+import random
+import re
+import resource
+import shutil
+import threading
+import time
+from collections import Counter
+
+import frappe
+from faker import Faker
+from frappe.utils import cstr
+
+from gameplan.demo.demo import check_for_real_data
+from gameplan.demo.discussions_comments import get_comment_templates, get_discussion_templates
+from gameplan.project_access import update_access_version
+from gameplan.search_cache import update_index_version
+from gameplan.search_catchup import get_search
+from gameplan.search_metrics import _percentile
+from gameplan.search_records import get_high_water_mark, set_high_water_mark
+
+SIZES = (10_000, 100_000, 1_000_000)
+
+BACKENDS = ("redisearch", "search2", "sqlite")
+
+QUERY_KINDS = ("single_word", "multi_word", "typo", "title_only", "tag_filter")
+
+SEED = 42
+
+# Number of values generated for each template placeholder
+VOCABULARY_SIZE = 200
+
+TEAMS = 5
+PROJECTS = 20
+TAGS = 20
+
+# Share of discussions in the corpus, the demo data has 2 to 5 comments per discussion
+DISCUSSION_RATIO = 0.25
+
+# Share of discussions that have tags
+TAGGED_RATIO = 0.3
+
+INSERT_CHUNK_SIZE = 10_000
+
+# Prefix of the names of the teams and tag links of the corpus, to find them when it is deleted
+NAME_PREFIX = "search-benchmark"
+
+START_TIME = datetime.datetime(2025, 1, 1)
+
+WORD_PATTERN = re.compile(r"[a-z]{4,}")
+HTML_TAG_PATTERN = re.compile(r"<[^>]+>")
+
+
+class SearchBenchmark:
+	def __init__(self, seed=SEED, queries_per_kind=20, repeat=3):
+		self.seed = seed
+		self.queries_per_kind = queries_per_kind
+		self.repeat = repeat
+		self.rnd = random.Random(seed)
+		self.vocabulary = self.get_vocabulary()
+		self.discussion_templates = get_discussion_templates()
+		self.comment_templates = get_comment_templates()
+		self.names = {}
+
+	def run(self, sizes=SIZES, backends=BACKENDS):
+		report = {
+			"seed": self.seed,
+			"started_at": datetime.datetime.now().isoformat(),
+			"queries_per_kind": self.queries_per_kind,
+			"repeat": self.repeat,
+			"corpora": [],
+		}
+		indexed = {
+			backend
+			for backend in backends
+			if get_high_water_mark(backend) or get_search(backend).index_exists()
+		}
+		try:
+			for size in sizes:
+				self.rnd = random.Random(f"{self.seed}:{size}")
+				try:
+					start = time.perf_counter()
+					words = self.insert_corpus(size)
+					corpus = {"documents": size, "insert_seconds": round(time.perf_counter() - start, 3)}
+					queries = self.get_queries(words)
+					corpus["backends"] = {backend: self.run_backend(backend, queries) for backend in backends}
+					report["corpora"].append(corpus)
+				finally:
+					self.delete_corpus()
+		finally:
+			self.restore_indexes(backends, indexed)
+		return report
+
+	def restore_indexes(self, backends, indexed):
+		"""Take the corpus out of the indexes of the backends once it is deleted from the database.
+
+		Indexes that existed before the benchmark are built again from the remaining records, the
+		others are dropped along with the high-water mark the benchmark set for them.
+		"""
+		for backend in backends:
+			if backend in indexed:
+				getattr(self, f"build_{backend}")()
+			else:
+				getattr(self, f"drop_{backend}")()
+				set_high_water_mark(backend, None)
+				update_index_version(backend)
+		frappe.db.commit()
+
+	def get_vocabulary(self):
+		"""Values for each placeholder of the templates, drawn from a seeded Faker."""
+		fake = Faker()
+		fake.seed_instance(self.seed)
+		generators = {
+			"initiative": fake.catch_phrase,
+			"effort": fake.catch_phrase,
+			"idea": fake.catch_phrase,
+			"catch_phrase": fake.catch_phrase,
+			"catch_phrase2": fake.catch_phrase,
+			"word": lambda: fake.word().title(),
+			"word2": fake.word,
+			"user": fake.name,
+			"company": fake.company,
+			"sentence": fake.sentence,
+			"bs": lambda: fake.bs().title(),
+			"bs2": lambda: fake.bs().title(),
+			"bs3": lambda: fake.bs().title(),
+			"bs4": lambda: fake.bs().title(),
+			"day": fake.day_of_week,
+			"time": fake.time,
+			"mention": fake.name,
+			"owner": fake.email,
+			"tag": lambda: fake.word().lower(),
+		}
+		vocabulary = {
+			name: [generate() for _ in range(VOCABULARY_SIZE)] for name, generate in generators.items()
+		}
+		vocabulary["tag"] = sorted(set(vocabulary["tag"]))[:TAGS]
+		return vocabulary
+
+	def get_template_params(self, project_title):
+		rnd = self.rnd
+		params = {name: rnd.choice(values) for name, values in self.vocabulary.items()}
+		params["project"] = project_title
+		for i in (1, 2, 3):
+			name = rnd.choice(self.vocabulary["mention"])
+			params[f"mention{i}"] = (
+				f'<span class="mention" data-type="mention" data-id="{name}" data-label="{name}">'
+				f"@{name}</span>"
+			)
+		for image, (width, height) in {
+			"image_wide": (700, 350),
+			"image_square": (500, 500),
+			"image_tall": (350, 600),
+			"image_small": (250, 250),
+			"image_large": (900, 500),
+		}.items():
+			params[image] = f"https://picsum.photos/{width}/{height}"
+		return params
+
+	def insert_corpus(self, size):
+		"""Insert the teams, projects, discussions, comments and tags of a corpus of `size` documents.
+
+		Returns the count of each word in a sample of the titles and contents, to pick queries from.
+		"""
+		rnd = self.rnd
+		common = ["Administrator", "Administrator", 0, 0]
+		common_fields = ["modified_by", "owner", "docstatus", "idx"]
+		now = START_TIME
+
+		teams = [f"{NAME_PREFIX}-team-{i}" for i in range(TEAMS)]
+		frappe.db.bulk_insert(
+			"GP Team",
+			["name", "title", "creation", "modified", *common_fields],
+			[[team, team, now, now, *common] for team in teams],
+		)
+
+		projects = self.reserve_names("GP Project", PROJECTS)
+		project_titles = {project: self.vocabulary["bs"][i] for i, project in enumerate(projects)}
+		project_teams = {project: teams[i % TEAMS] for i, project in enumerate(projects)}
+		frappe.db.bulk_insert(
+			"GP Project",
+			["name", "title", "team", "is_private", "creation", "modified", *common_fields],
+			[
+				[project, project_titles[project], project_teams[project], 0, now, now, *common]
+				for project in projects
+			],
+		)
+
+		tags = self.reserve_names("GP Tag", len(self.vocabulary["tag"]))
+		tag_labels = dict(zip(tags, self.vocabulary["tag"], strict=True))
+		frappe.db.bulk_insert(
+			"GP Tag",
+			["name", "label", "creation", "modified", *common_fields],
+			[[tag, label, now, now, *common] for tag, label in tag_labels.items()],
+		)
+
+		discussion_count = max(1, int(size * DISCUSSION_RATIO))
+		discussions = self.reserve_names("GP Discussion", discussion_count)
+		comments = self.reserve_names("GP Comment", size - discussion_count)
+		words = Counter()
+
+		def get_modified():
+			return START_TIME + datetime.timedelta(seconds=rnd.randint(0, 365 * 24 * 3600))
+
+		def sample_words(*texts):
+			if len(words) < 100_000 and rnd.random() < 0.05:
+				for text in texts:
+					words.update(WORD_PATTERN.findall(HTML_TAG_PATTERN.sub(" ", text).lower()))
+
+		discussion_rows, tag_link_rows = [], []
+		discussion_projects = {}
+		for name in discussions:
+			project = rnd.choice(projects)
+			discussion_projects[name] = project
+			template = rnd.choice(self.discussion_templates)
+			params = self.get_template_params(project_titles[project])
+			title, content = template["title"].format(**params), template["content"].format(**params)
+			sample_words(title, content)
+			modified = get_modified()
+			discussion_rows.append(
+				[name, title, content, project, project_teams[project], modified, modified, modified]
+				+ [params["owner"], params["owner"], 0, 0]
+			)
+			if rnd.random() < TAGGED_RATIO:
+				for i, tag in enumerate(rnd.sample(tags, rnd.randint(1, 2))):
+					tag_link_rows.append(
+						[
+							f"{NAME_PREFIX}-{name}-{i}",
+							name,
+							"GP Discussion",
+							"tags",
+							i + 1,
+							tag,
+							tag_labels[tag],
+						]
+						+ [modified, modified, "Administrator", "Administrator", 0]
+					)
+			if len(discussion_rows) >= INSERT_CHUNK_SIZE:
+				self.insert_discussions(discussion_rows, tag_link_rows)
+				discussion_rows, tag_link_rows = [], []
+		self.insert_discussions(discussion_rows, tag_link_rows)
+
+		comment_rows = []
+		for name in comments:
+			discussion = rnd.choice(discussions)
+			template = rnd.choice(self.comment_templates)
+			params = self.get_template_params(project_titles[discussion_projects[discussion]])
+			content = template.format(**params)
+			sample_words(content)
+			modified = get_modified()
+			comment_rows.append(
+				[name, content, "GP Discussion", discussion, modified, modified]
+				+ [params["owner"], params["owner"], 0, 0]
+			)
+			if len(comment_rows) >= INSERT_CHUNK_SIZE:
+				self.insert_comments(comment_rows)
+				comment_rows = []
+		self.insert_comments(comment_rows)
+
+		frappe.db.commit()
+		# Projects were inserted without their hooks, which is what makes cached project access stale
+		update_access_version()
+		return words
+
+	def insert_discussions(self, rows, tag_link_rows):
+		frappe.db.bulk_insert(
+			"GP Discussion",
+			["name", "title", "content", "project", "team", "last_post_at", "creation", "modified"]
+			+ ["modified_by", "owner", "docstatus", "idx"],
+			rows,
+			chunk_size=INSERT_CHUNK_SIZE,
+		)
+		frappe.db.bulk_insert(
+			"GP Tag Link",
+			["name", "parent", "parenttype", "parentfield", "idx", "tag", "label", "creation", "modified"]
+			+ ["modified_by", "owner", "docstatus"],
+			tag_link_rows,
+			chunk_size=INSERT_CHUNK_SIZE,
+		)
+
+	def insert_comments(self, rows):
+		frappe.db.bulk_insert(
+			"GP Comment",
+			["name", "content", "reference_doctype", "reference_name", "creation", "modified"]
+			+ ["modified_by", "owner", "docstatus", "idx"],
+			rows,
+			chunk_size=INSERT_CHUNK_SIZE,
+		)
+
+	def reserve_names(self, doctype, count):
+		"""Names for `count` new documents of an autoincremented doctype, after the existing ones."""
+		start = cstr(frappe.db.sql(f"SELECT COALESCE(MAX(name), 0) FROM `tab{doctype}`")[0][0])
+		start = int(start) + 1
+		self.names[doctype] = (start, start + count - 1)
+		return list(range(start, start + count))
+
+	def delete_corpus(self):
+		for doctype, (start, end) in self.names.items():
+			frappe.db.sql(f"DELETE FROM `tab{doctype}` WHERE name BETWEEN %s AND %s", (start, end))
+		for doctype in ("GP Tag Link", "GP Team"):
+			frappe.db.sql(f"DELETE FROM `tab{doctype}` WHERE name LIKE %s", (f"{NAME_PREFIX}-%",))
+		self.names = {}
+		frappe.db.commit()
+		update_access_version()
+
+	def get_queries(self, words):
+		"""A fixed mix of queries of each kind, as (kind, query, tags) tuples.
+
+		Words are picked from the ones that occur in the sample of the corpus, so every query except
+		the misspelled ones has matches.
+		"""
+		rnd = self.rnd
+		words = sorted(word for word, count in words.items() if count > 1)
+		n = self.queries_per_kind
+		title_words = sorted(
+			{word for value in self.vocabulary["bs"] for word in WORD_PATTERN.findall(value.lower())}
+		)
+
+		queries = []
+		for word in rnd.sample(words, min(n, len(words))):
+			queries.append(("single_word", word, None))
+		for _ in range(n):
+			queries.append(("multi_word", " ".join(rnd.sample(words, rnd.randint(2, 3))), None))
+		long_words = [word for word in words if len(word) >= 5]
+		for word in rnd.sample(long_words, min(n, len(long_words))):
+			# Swap two different letters, so the misspelled word isn't the same one
+			i = rnd.choice([i for i in range(1, len(word) - 2) if word[i] != word[i + 1]] or [1])
+			queries.append(("typo", word[:i] + word[i + 1] + word[i] + word[i + 2 :], None))
+		for word in rnd.sample(title_words, min(n, len(title_words))):
+			queries.append(("title_only", word, None))
+		for word in rnd.sample(words, min(n, len(words))):
+			queries.append(("tag_filter", word, [rnd.choice(self.vocabulary["tag"])]))
+		return queries
+
+	def run_backend(self, backend, queries):
+		"""Build the index of a backend and replay the queries on it."""
+		search = getattr(self, f"search_{backend}")
+		supported = [query for query in queries if self.supports(backend, query[0])]
+
+		rss = get_rss()
+		peak_rss = PeakRSS()
+		peak_rss.start()
+		try:
+			start = time.perf_counter()
+			index_size = getattr(self, f"build_{backend}")()
+			build_seconds = time.perf_counter() - start
+
+			# The first search loads the index, which is not what is measured
+			for kind, query, tags in supported:
+				search(kind, query, tags)
+
+			latencies = {kind: [] for kind in QUERY_KINDS}
+			for _ in range(self.repeat):
+				for kind, query, tags in supported:
+					start = time.perf_counter()
+					search(kind, query, tags)
+					latencies[kind].append((time.perf_counter() - start) * 1000)
+		except Exception as e:
+			frappe.db.rollback()
+			return {"error": f"{type(e).__name__}: {e}"}
+		finally:
+			peak_rss.stop()
+
+		all_latencies = [ms for kind_latencies in latencies.values() for ms in kind_latencies]
+		return {
+			"build_seconds": round(build_seconds, 3),
+			"index_bytes": index_size,
+			"rss_bytes": get_rss(),
+			"rss_delta_bytes": get_rss() - rss,
+			"peak_rss_bytes": peak_rss.peak,
+			"peak_rss_delta_bytes": peak_rss.peak - rss,
+			"latency_ms": {
+				"all": summarize_latencies(all_latencies),
+				**{kind: summarize_latencies(values) for kind, values in latencies.items() if values},
+			},
+			"skipped": sorted({kind for kind in QUERY_KINDS if not latencies[kind]}),
+		}
+
+	def supports(self, backend, kind):
+		if kind == "tag_filter":
+			return backend == "sqlite"
+		return True
+
+	def build_redisearch(self):
+		from gameplan.search import build_index
+
+		memory = frappe.cache().info("memory")["used_memory"]
+		build_index()
+		return frappe.cache().info("memory")["used_memory"] - memory
+
+	def drop_redisearch(self):
+		from gameplan.search import GameplanSearch
+
+		GameplanSearch().drop_index()
+
+	def search_redisearch(self, kind, query, tags):
+		from gameplan.api import _search
+		from gameplan.search import GameplanSearch
+
+		search = GameplanSearch()
+		if kind == "title_only":
+			return search.search(f"@title:({search.clean_query(query)})", sort_by="modified desc")
+		return _search(search, query, 0)
+
+	def build_search2(self):
+		from gameplan.search2 import GameplanSearch
+
+		search = GameplanSearch()
+		search.build_index()
+		version = frappe.cache().mget(search.fts._key("version"))[0]
+		return os.path.getsize(search.fts._get_snapshot_path(version.decode()))
+
+	def drop_search2(self):
+		from gameplan.search2 import GameplanSearch
+
+		fts = GameplanSearch().fts
+		frappe.cache().delete_keys(fts.redis_prefix)
+		shutil.rmtree(fts._get_snapshot_dir(), ignore_errors=True)
+
+	def search_search2(self, kind, query, tags):
+		from gameplan.search2 import GameplanSearch
+
+		return GameplanSearch().search(query, title_only=kind == "title_only")
+
+	def build_sqlite(self):
+		from gameplan.search_sqlite import GameplanSearch
+
+		search = GameplanSearch()
+		search.build_index()
+		return os.path.getsize(search.db_path)
+
+	def drop_sqlite(self):
+		from gameplan.search_sqlite import GameplanSearch
+
+		search = GameplanSearch()
+		if os.path.exists(search.db_path):
+			os.remove(search.db_path)
+
+	def search_sqlite(self, kind, query, tags):
+		from gameplan.search_sqlite import GameplanSearch
+
+		filters = {"tags": tags} if tags else None
+		return GameplanSearch().search(query, title_only=kind == "title_only", filters=filters)
+
+
+def get_rss():
+	"""Resident set size of the current process in bytes."""
+	try:
+		with open("/proc/self/statm") as f:
+			return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+	except OSError:
+		return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class PeakRSS:
+	"""Highest resident set size of the current process between `start` and `stop`.
+
+	The size is sampled every `interval` seconds, so peaks shorter than that can be missed. Worker
+	processes, like those building the search2 index, aren't included.
+	"""
+
+	def __init__(self, interval=0.01):
+		self.interval = interval
+		self.peak = 0
+		self._stopped = threading.Event()
+		self._thread = threading.Thread(target=self._sample, daemon=True)
+
+	def start(self):
+		self.peak = get_rss()
+		self._thread.start()
+
+	def stop(self):
+		self._stopped.set()
+		self._thread.join()
+		self.peak = max(self.peak, get_rss())
+
+	def _sample(self):
+		while not self._stopped.wait(self.interval):
+			self.peak = max(self.peak, get_rss())
+
+
+def summarize_latencies(values):
+	values = sorted(values)
+	return {
+		"count": len(values),
+		"mean": round(sum(values) / len(values), 3),
+		"p50": round(_percentile(values, 50), 3),
+		"p95": round(_percentile(values, 95), 3),
+		"p99": round(_percentile(values, 99), 3),
+		"max": round(values[-1], 3),
+	}
+
+
+def run(sizes=SIZES, backends=BACKENDS, seed=SEED, queries_per_kind=20, repeat=3, output=None, force=False):
+	"""Benchmark the search backends and write the report as JSON to `output`.
+
+	Refuses to run on a site with real data unless `force` is set, as the corpus is inserted into
+	the database and the search indexes are rebuilt.
+	"""
+	warnings, _ = check_for_real_data()
+	if warnings and not force:
+		print("This site has data, run the benchmark on a site dedicated to it or pass force=True:")
+		for warning in warnings:
+			print(f"   {warning}")
+		return
+
+	frappe.set_user("Administrator")
+	report = SearchBenchmark(seed=seed, queries_per_kind=queries_per_kind, repeat=repeat).run(
+		sizes=sizes, backends=backends
+	)
+
+	output = output or frappe.get_site_path("search_benchmark.json")
+	with open(output, "w") as f:
+		json.dump(report, f, indent=2)
+	print(f"Search benchmark report written to {output}")
+	return report
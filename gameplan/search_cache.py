@@ -0,0 +1,139 @@
+# Copyright (c) 2025, Frappe Technologies Pvt. Ltd. and Contributors
+# MIT License. See license.txt
+
+import hashlib
+import json
+import time
+from collections import OrderedDict
+
+import frappe
+from frappe.utils import cstr
+
+# Number of results kept per worker process
+CACHE_SIZE = 512
+
+# Seconds after which a cached result is computed again, even if its index hasn't changed. This
+# bounds how long results can lag behind changes that don't go through the index, like a document
+# moving to another project.
+CACHE_TTL = 300
+
+STATS_KEY = "search_result_cache_stats"
+
+
+class TTLCache:
+	"""LRU of values per worker process, each computed again once it is older than `ttl` seconds.
+
+	If `use_redis` returns True, values are also stored in Redis under `redis_prefix`, so that
+	workers share them.
+	"""
+
+	redis_prefix = None
+
+	def __init__(self, maxsize, ttl):
+		self.maxsize = maxsize
+		self.ttl = ttl
+		self.entries = OrderedDict()
+
+	def get_value(self, key, compute):
+		"""Return the value cached under `key` and where it was found, calling `compute` on a miss.
+
+		The place is "hits" for this process, "redis_hits" for Redis and "misses" if it was computed.
+		"""
+		entry = self.entries.get(key)
+		if entry and entry[0] > time.monotonic():
+			self.entries.move_to_end(key)
+			return entry[1], "hits"
+
+		if self.use_redis():
+			value = frappe.cache().get_value(f"{self.redis_prefix}:{key}")
+			if value is not None:
+				self._store(key, value)
+				return value, "redis_hits"
+
+		value = compute()
+		self._store(key, value)
+		if self.use_redis():
+			frappe.cache().set_value(f"{self.redis_prefix}:{key}", value, expires_in_sec=self.ttl)
+		return value, "misses"
+
+	def use_redis(self):
+		return False
+
+	def clear(self):
+		self.entries.clear()
+
+	def _store(self, key, value):
+		self.entries[key] = (time.monotonic() + self.ttl, value)
+		self.entries.move_to_end(key)
+		while len(self.entries) > self.maxsize:
+			self.entries.popitem(last=False)
+
+
+class SearchResultCache(TTLCache):
+	"""Cache of search responses, shared by the search endpoints of all backends.
+
+	Results are keyed by index, normalized query, search parameters and the projects the user can
+	access, so users who see the same projects share entries. The key also contains the version of
+	the index, which changes whenever the index is updated, so updates make older entries
+	unreachable and they age out of the LRU.
+
+	Results are kept in an LRU per worker process. When `gameplan_search_cache_in_redis` is set in
+	site config they are also stored in Redis, so that workers share them.
+	"""
+
+	redis_prefix = "search_result_cache"
+
+	def __init__(self, maxsize=CACHE_SIZE, ttl=CACHE_TTL):
+		super().__init__(maxsize, ttl)
+		self.stats = {"hits": 0, "redis_hits": 0, "misses": 0}
+
+	def get(self, index, query, compute, projects, **params):
+		"""Return the cached result for the search, calling `compute` to get it on a miss."""
+		result, found = self.get_value(self.make_key(index, query, projects, params), compute)
+		self._count(index, found)
+		return result
+
+	def make_key(self, index, query, projects, params):
+		key = [
+			frappe.local.site,
+			index,
+			get_index_version(index),
+			" ".join(cstr(query).split()),
+			sorted(cstr(project) for project in projects or []),
+			params,
+		]
+		return hashlib.sha1(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()
+
+	def use_redis(self):
+		return bool(frappe.conf.get("gameplan_search_cache_in_redis"))
+
+	def _count(self, index, event):
+		self.stats[event] += 1
+		frappe.cache().hincrby(frappe.cache().make_key(STATS_KEY), f"{index}:{event}", 1)
+
+
+search_result_cache = SearchResultCache()
+
+
+def get_index_version(index):
+	return frappe.cache().get_value(f"search_index_version:{index}")
+
+
+def update_index_version(index):
+	"""Mark the search index as changed, so that results cached for it aren't used anymore."""
+	frappe.cache().set_value(f"search_index_version:{index}", frappe.generate_hash())
+
+
+def get_search_cache_stats():
+	"""Hit and miss counts of this worker process and of all workers of the site, per index."""
+	pipe = frappe.cache().pipeline()
+	pipe.hgetall(frappe.cache().make_key(STATS_KEY))
+	totals = {field.decode(): int(count) for field, count in pipe.execute()[0].items()}
+	return {
+		"process": {
+			**search_result_cache.stats,
+			"size": len(search_result_cache.entries),
+			"maxsize": search_result_cache.maxsize,
+		},
+		"site": totals,
+	}
@@ -0,0 +1,146 @@
+# Copyright (c) 2025, Frappe Technologies Pvt. Ltd. and Contributors
+# MIT License. See license.txt
+
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+import frappe
+from frappe.utils import cstr, now_datetime
+
+from gameplan.search_records import (
+	INDEXED_DOCTYPES,
+	RECORDS_CHUNK_SIZE,
+	get_high_water_mark,
+	set_high_water_mark,
+)
+
+# Search class of each index kept up to date by the scheduled catch up
+SEARCH_BACKENDS = {
+	"redisearch": "gameplan.search.GameplanSearch",
+	"search2": "gameplan.search2.GameplanSearch",
+	"sqlite": "gameplan.search_sqlite.GameplanSearch",
+}
+
+# Records are read from a bit before the high-water mark, so that those saved in transactions that
+# were still open when the previous catch up read them aren't missed
+CATCH_UP_OVERLAP = timedelta(minutes=5)
+
+
+def catch_up_indexes():
+	"""Queue a catch up of each search index, run by the scheduler."""
+	for index in SEARCH_BACKENDS:
+		frappe.enqueue(
+			"gameplan.search_catchup.catch_up",
+			queue="long",
+			job_id=f"gameplan_search_catch_up_{index}",
+			deduplicate=True,
+			index=index,
+		)
+
+
+def catch_up(index):
+	"""Bring a search index up to date with the database and return what was done.
+
+	Records modified since the high-water mark of the index are indexed again, and documents whose
+	records were deleted are found by comparing the indexed ids with the database in chunks. The
+	index is built from scratch instead if it is missing while it has a mark, like after a Redis
+	flush, or if it exists without one. Indexes that were never built are left alone.
+	"""
+	search = get_search(index)
+	if hasattr(search, "is_search_enabled") and not search.is_search_enabled():
+		return
+
+	start = time.monotonic()
+	started_at = now_datetime()
+	mark = get_high_water_mark(index)
+	index_exists = search.index_exists()
+	if mark is None and not index_exists:
+		return
+
+	if mark is None or not index_exists:
+		# Records the high-water mark when it completes
+		search.build_index()
+		stats = {"mode": "full"}
+	else:
+		since = mark - CATCH_UP_OVERLAP
+		stats = {
+			"mode": "incremental",
+			"since": str(since),
+			"indexed": search.catch_up(since),
+			"removed": remove_deleted_documents(search),
+		}
+		set_high_water_mark(index, started_at)
+
+	stats["seconds"] = round(time.monotonic() - start, 3)
+	return stats
+
+
+def get_search(index):
+	return frappe.get_attr(SEARCH_BACKENDS[index])()
+
+
+def repair(index, doc_ids):
+	"""Index the given documents again, removing those whose records don't exist anymore.
+
+	Takes the repair list of `gameplan.search_verify.verify`.
+	"""
+	search = get_search(index)
+	missing = set()
+	for chunk in get_chunks(doc_ids):
+		missing.update(get_missing_ids(chunk))
+
+	names_by_doctype = defaultdict(list)
+	for doc_id in doc_ids:
+		doctype, name = doc_id.split(":", 1)
+		if doctype in INDEXED_DOCTYPES and doc_id not in missing:
+			names_by_doctype[doctype].append(name)
+	for doctype, names in names_by_doctype.items():
+		for chunk in get_chunks(names):
+			search.reindex_documents(doctype, chunk)
+
+	search.remove_documents(sorted(missing))
+	return {"indexed": sum(map(len, names_by_doctype.values())), "removed": len(missing)}
+
+
+def remove_deleted_documents(search):
+	"""Remove the indexed documents whose records don't exist anymore and return how many there were."""
+	# Removed once all ids are read, as removing them can change the ids being iterated
+	missing = find_deleted_documents(search)
+	search.remove_documents(missing)
+	return len(missing)
+
+
+def find_deleted_documents(search):
+	"""Ids of the indexed documents whose records don't exist anymore, read in chunks."""
+	missing = []
+	for chunk in get_chunks(search.get_document_ids()):
+		missing.extend(get_missing_ids(chunk))
+	return missing
+
+
+def get_chunks(values, chunk_size=RECORDS_CHUNK_SIZE):
+	chunk = []
+	for value in values:
+		chunk.append(value)
+		if len(chunk) >= chunk_size:
+			yield chunk
+			chunk = []
+	if chunk:
+		yield chunk
+
+
+def get_missing_ids(doc_ids):
+	"""Ids among `doc_ids` whose records were deleted or aren't indexed anymore."""
+	names_by_doctype = defaultdict(list)
+	for doc_id in doc_ids:
+		doctype, name = doc_id.split(":", 1)
+		if doctype in INDEXED_DOCTYPES:
+			names_by_doctype[doctype].append(name)
+
+	missing = []
+	for doctype, names in names_by_doctype.items():
+		filters = {**(INDEXED_DOCTYPES[doctype] or {}), "name": ("in", names)}
+		existing = {cstr(name) for name in frappe.get_all(doctype, filters=filters, pluck="name")}
+		missing.extend(f"{doctype}:{name}" for name in names if name not in existing)
+	return missing
@@ -0,0 +1,97 @@
+# Copyright (c) 2025, Frappe Technologies Pvt. Ltd. and Contributors
+# MIT License. See license.txt
+
+import json
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import frappe
+
+# Number of recent searches kept per index to compute the aggregates from
+METRICS_SAMPLE_SIZE = 1000
+
+METRICS_KEY = "search_metrics"
+
+
+class SearchMetrics:
+	"""Time spent in each phase of a search and counts of the work done in it.
+
+	Timings are accumulated in milliseconds, so a phase that runs several times, like the
+	proximity boost of each scored document, adds up to its total time.
+	"""
+
+	def __init__(self):
+		self.timings = defaultdict(float)
+		self.counters = defaultdict(int)
+
+	@contextmanager
+	def phase(self, name):
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.add_time(name, time.perf_counter() - start)
+
+	def add_time(self, name, seconds):
+		self.timings[name] += seconds * 1000
+
+	def count(self, name, value=1):
+		self.counters[name] += value
+
+	def as_dict(self):
+		return {
+			"timings": {name: round(ms, 3) for name, ms in self.timings.items()},
+			"counters": dict(self.counters),
+		}
+
+
+def record_search_metrics(index, metrics):
+	"""Add the metrics of a search to the recent samples of the index."""
+	key = frappe.cache().make_key(f"{METRICS_KEY}:{index}")
+	pipe = frappe.cache().pipeline()
+	pipe.lpush(key, json.dumps(metrics.as_dict()))
+	pipe.ltrim(key, 0, METRICS_SAMPLE_SIZE - 1)
+	pipe.execute()
+
+
+def get_search_metrics(indexes=("search2", "sqlite")):
+	"""Percentiles of the phase timings and counters of recent searches, per index."""
+	pipe = frappe.cache().pipeline()
+	for index in indexes:
+		pipe.lrange(frappe.cache().make_key(f"{METRICS_KEY}:{index}"), 0, -1)
+
+	metrics = {}
+	for index, samples in zip(indexes, pipe.execute(), strict=True):
+		samples = [json.loads(sample) for sample in samples]
+		metrics[index] = {
+			"searches": len(samples),
+			"timings": _summarize(samples, "timings"),
+			"counters": _summarize(samples, "counters"),
+		}
+	return metrics
+
+
+def _summarize(samples, field):
+	values = defaultdict(list)
+	for sample in samples:
+		for name, value in sample[field].items():
+			values[name].append(value)
+
+	summary = {}
+	for name, name_values in values.items():
+		name_values.sort()
+		summary[name] = {
+			"mean": round(sum(name_values) / len(name_values), 3),
+			"p50": _percentile(name_values, 50),
+			"p95": _percentile(name_values, 95),
+			"p99": _percentile(name_values, 99),
+			"max": name_values[-1],
+		}
+	return summary
+
+
+def _percentile(sorted_values, percent):
+	"""Nearest-rank percentile of a sorted list."""
+	rank = max(1, -(-len(sorted_values) * percent // 100))
+	return sorted_values[rank - 1]
@@ -0,0 +1,97 @@
+# Copyright (c) 2025, Frappe Technologies Pvt. Ltd. and Contributors
+# MIT License. See license.txt
+
+import hashlib
+
+import frappe
+from frappe.utils import cstr, get_datetime
+
+# Number of records read per query when building or catching up a search index
+RECORDS_CHUNK_SIZE = 1000
+
+# Filters of the records each search index holds, by doctype
+INDEXED_DOCTYPES = {
+	"GP Discussion": None,
+	"GP Task": None,
+	"GP Page": None,
+	"GP Comment": {"deleted_at": ("is", "not set")},
+}
+
+
+def get_record_chunks(
+	doctype, fields, filters=None, chunk_size=RECORDS_CHUNK_SIZE, since=None, since_fields=None
+):
+	"""Yield the records of a doctype in lists of up to `chunk_size`, paginated on name.
+
+	Only `fields` are read, and `doctype` is set on every record. If `since` is given, only records
+	with any of `since_fields` (`modified` by default) at or after it are read. Each query continues
+	after the last name of the previous one, so it reads a bounded range of the primary key however
+	far into the table it is, and only one chunk is held in memory at a time.
+	"""
+	or_filters = None
+	if since:
+		or_filters = [[field, ">=", since] for field in since_fields or ["modified"]]
+
+	last_name = None
+	while True:
+		chunk_filters = dict(filters or {})
+		if last_name is not None:
+			chunk_filters["name"] = (">", last_name)
+		records = frappe.db.get_all(
+			doctype,
+			fields=fields,
+			filters=chunk_filters,
+			or_filters=or_filters,
+			order_by="name asc",
+			limit=chunk_size,
+		)
+
+		for record in records:
+			record.doctype = doctype
+		if records:
+			yield records
+
+		if len(records) < chunk_size:
+			break
+		last_name = records[-1].name
+
+
+def get_records(doctype, fields, **kwargs):
+	"""Yield the records of a doctype one by one, see `get_record_chunks`."""
+	for records in get_record_chunks(doctype, fields, **kwargs):
+		yield from records
+
+
+def get_records_by_name(doctype, fields, names, filters=None):
+	"""Records of a doctype with the given names that match `filters`, with `doctype` set."""
+	records = frappe.db.get_all(doctype, fields=fields, filters={**(filters or {}), "name": ("in", names)})
+	for record in records:
+		record.doctype = doctype
+	return records
+
+
+def get_digest(modified, *values):
+	"""Modified time in whole seconds and hash of the indexed values of a document.
+
+	Digests of the documents in an index are compared with those of their records, so `modified`
+	can be a datetime, a string or a timestamp, and values are compared as strings.
+	"""
+	if modified and not isinstance(modified, int | float):
+		modified = get_datetime(modified).timestamp()
+	content = "\x1f".join(cstr(value) for value in values)
+	return int(modified) if modified else None, hashlib.sha1(content.encode()).hexdigest()
+
+
+def get_high_water_mark(index):
+	"""Time up to which the records of a search index were last indexed, or None if never."""
+	mark = frappe.db.get_global(f"search_high_water_mark:{index}")
+	return get_datetime(mark) if mark else None
+
+
+def set_high_water_mark(index, mark):
+	"""Record that all records modified before `mark` are indexed, or clear the mark if it is None.
+
+	The mark is kept in the database rather than Redis, so that an index lost with a Redis flush
+	is noticed and rebuilt instead of being treated as never built.
+	"""
+	frappe.db.set_global(f"search_high_water_mark:{index}", str(mark) if mark else None)
@@ -1,13 +1,55 @@
 # Copyright (c) 2022, Frappe Technologies Pvt. Ltd. and Contributors
 # MIT License. See license.txt
+import time
+from collections import Counter
+
 import frappe
 from frappe.search.sqlite_search import SQLiteSearch, SQLiteSearchIndexMissingError
-from frappe.utils import cstr
+from frappe.utils import cstr, now_datetime
 
-import gameplan
+from gameplan.project_access import get_accessible_projects
+from gameplan.search_cache import search_result_cache, update_index_version
+from gameplan.search_metrics import SearchMetrics, record_search_metrics
+from gameplan.search_records import get_digest, get_record_chunks, get_records_by_name, set_high_water_mark
 
 INDEX_BUILD_FLAG = "discussions_index_in_progress"
 
+# Doctypes comments are posted on, whose project and team are loaded in bulk when building the index
+COMMENT_REFERENCE_DOCTYPES = ("GP Discussion", "GP Task")
+
+# Columns of the index compared with the documents of the records when verifying it
+DIGEST_FIELDS = (
+	"title",
+	"content",
+	"project",
+	"team",
+	"owner",
+	"tags",
+	"reference_doctype",
+	"reference_name",
+)
+
+# Tables kept next to the index, which FTS5 can only scan when looking rows up by a column.
+# `search_tags` has one row per tag of each indexed document, so tags can be counted and matched
+# exactly without scanning the space joined tags of the index rows. `search_docs` has one row per
+# indexed document with its digest, so documents can be verified and counted by key and doctype.
+SIDE_TABLES_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS search_tags (
+        doc_key TEXT NOT NULL,
+        tag TEXT NOT NULL,
+        project TEXT
+    );
+    CREATE INDEX IF NOT EXISTS search_tags_doc_key ON search_tags (doc_key);
+    CREATE INDEX IF NOT EXISTS search_tags_tag ON search_tags (tag, doc_key);
+    CREATE TABLE IF NOT EXISTS search_docs (
+        doc_key TEXT PRIMARY KEY,
+        doctype TEXT NOT NULL,
+        modified INTEGER,
+        hash TEXT NOT NULL
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS search_docs_doctype ON search_docs (doctype);
+"""
+
 
 class GameplanSearch(SQLiteSearch):
 	"""
@@ -23,7 +65,15 @@ class GameplanSearch(SQLiteSearch):
 	INDEX_NAME = "gameplan_search.db"
 
 	INDEX_SCHEMA = {
-		"metadata_fields": ["team", "project", "tags", "owner", "reference_doctype", "reference_name"],
+		"metadata_fields": [
+			"team",
+			"project",
+			"tags",
+			"owner",
+			"reference_doctype",
+			"reference_name",
+			"doc_key",
+		],
 		"tokenizer": "unicode61 remove_diacritics 2 tokenchars '-_'",
 	}
 
@@ -43,6 +93,10 @@ class GameplanSearch(SQLiteSearch):
 		},
 	}
 
+	def __init__(self, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		self.metrics = SearchMetrics()
+
 	def is_search_enabled(self):
 		"""Check if search functionality is disabled via site config."""
 		disabled = frappe.conf.get("disable_gameplan_search", False)
@@ -55,6 +109,9 @@ class GameplanSearch(SQLiteSearch):
 		if not document:
 			return None
 
+		# Key of the document in the tags table, to filter the index rows by tag
+		document["doc_key"] = f"{doc.doctype}:{doc.name}"
+
 		if doc.doctype == "GP Comment":
 			# For comments, we need to resolve the project from the reference
 			project, team = self._get_project_team_for_comment(doc)
@@ -65,6 +122,12 @@ class GameplanSearch(SQLiteSearch):
 			# Use cached tags lookup instead of individual queries
 			tags = self._get_tags_for_document(doc.doctype, doc.name)
 			document["tags"] = " ".join(tags) if tags else None
+			if hasattr(self, "_tag_rows"):
+				project = cstr(document.get("project")) or None
+				self._tag_rows.extend((document["doc_key"], tag, project) for tag in tags)
+
+		if hasattr(self, "_doc_rows"):
+			self._doc_rows.append((document["doc_key"], doc.doctype, *self._get_digest(document)))
 
 		return document
 
@@ -101,23 +164,231 @@ class GameplanSearch(SQLiteSearch):
 				self._tags_cache[cache_key] = []
 			self._tags_cache[cache_key].append(tag_link["label"])
 
+	def _load_all_project_teams(self):
+		"""Load the project and team of all documents comments can be posted on into memory."""
+		self._project_team_cache = {}
+
+		# One query per doctype instead of one per commented document
+		for doctype in COMMENT_REFERENCE_DOCTYPES:
+			for row in frappe.qb.get_query(doctype, fields=["name", "project", "team"]).run(as_dict=True):
+				self._project_team_cache[f"{doctype}:{row['name']}"] = (row["project"], row["team"])
+
 	def build_index(self):
-		"""Build search index with optimized tag loading."""
-		# Pre-load all tags for bulk indexing performance
+		"""Build search index with optimized tag and comment project loading."""
+		started_at = now_datetime()
+		# Pre-load all tags and comment projects for bulk indexing performance
 		self._load_all_tags()
+		self._load_all_project_teams()
+		self._tag_rows, self._doc_rows = [], []
 
 		try:
 			# Call parent build_index method
 			super().build_index()
+			self._write_side_rows(None, self._tag_rows, self._doc_rows)
 		finally:
-			# Clear tags cache after indexing to free memory
+			# Clear tags and projects cache after indexing to free memory
 			if hasattr(self, "_tags_cache"):
 				delattr(self, "_tags_cache")
+			if hasattr(self, "_project_team_cache"):
+				delattr(self, "_project_team_cache")
+			del self._tag_rows, self._doc_rows
+
+		update_index_version("sqlite")
+		set_high_water_mark("sqlite", started_at)
+
+	def catch_up(self, since):
+		"""Index the records modified at or after `since` and return how many were indexed."""
+		count = 0
+		for doctype, config in self.INDEXABLE_DOCTYPES.items():
+			since_fields = ["last_post_at", "modified"] if doctype == "GP Discussion" else ["modified"]
+			for records in get_record_chunks(
+				doctype, ["name"], filters=config.get("filters"), since=since, since_fields=since_fields
+			):
+				for record in records:
+					self.index_doc(doctype, record.name)
+				count += len(records)
+		return count
+
+	def get_document_ids(self, chunk_size=1000):
+		"""Yield the keys of all indexed documents."""
+		conn = self._get_connection(read_only=True)
+		try:
+			cursor = conn.execute("SELECT doc_key FROM search_fts")
+			while rows := cursor.fetchmany(chunk_size):
+				for row in rows:
+					yield row["doc_key"]
+		finally:
+			conn.close()
+
+	def count_documents(self):
+		"""Number of indexed documents of each doctype, counted on the doctype index of `search_docs`."""
+		conn = self._get_connection(read_only=True)
+		try:
+			rows = conn.execute(
+				"SELECT doctype, COUNT(*) AS count FROM search_docs GROUP BY doctype"
+			).fetchall()
+		finally:
+			conn.close()
+		return {row["doctype"]: row["count"] for row in rows}
+
+	def remove_documents(self, doc_ids):
+		for doc_id in doc_ids:
+			doctype, name = doc_id.split(":", 1)
+			self.remove_doc(doctype, name)
+
+	def reindex_documents(self, doctype, names):
+		for name in names:
+			self.index_doc(doctype, name)
+
+	def get_record_digests(self, doctype, names):
+		"""Digests of the documents the records with the given names should be indexed as."""
+		config = self.INDEXABLE_DOCTYPES[doctype]
+		fields = []
+		for field in config["fields"]:
+			if isinstance(field, dict):
+				fields.extend(f"{source} as {alias}" for alias, source in field.items())
+			else:
+				fields.append(field)
+
+		# Tags of the records are read in one query, like when building the index
+		self._tags_cache = {}
+		for tag_link in frappe.qb.get_query(
+			"GP Tag Link",
+			fields=["parent", "label"],
+			filters={"parenttype": doctype, "parent": ("in", names), "parentfield": "tags"},
+		).run(as_dict=True):
+			self._tags_cache.setdefault(f"{doctype}:{tag_link['parent']}", []).append(tag_link["label"])
+
+		digests = {}
+		try:
+			for doc in get_records_by_name(doctype, fields, names, config.get("filters")):
+				document = self.prepare_document(doc)
+				if document:
+					digests[document["doc_key"]] = self._get_digest(document)
+		finally:
+			del self._tags_cache
+		return digests
+
+	def get_index_digests(self, doc_keys):
+		"""Digests of the documents with the given keys that are in the index, recorded when indexing them."""
+		conn = self._get_connection(read_only=True)
+		try:
+			rows = conn.execute(
+				"SELECT doc_key, modified, hash FROM search_docs WHERE doc_key IN ({})".format(
+					",".join(["?"] * len(doc_keys))
+				),
+				doc_keys,
+			).fetchall()
+		finally:
+			conn.close()
+		return {row["doc_key"]: (row["modified"], row["hash"]) for row in rows}
+
+	def _get_digest(self, document):
+		modified = document.get("modified")
+		if isinstance(modified, str) and modified.replace(".", "", 1).isdigit():
+			# Stored as a timestamp
+			modified = float(modified)
+		return get_digest(modified, *(document.get(field) for field in DIGEST_FIELDS))
+
+	def index_doc(self, doctype, docname):
+		"""Index a single document and invalidate cached search results."""
+		self._tag_rows, self._doc_rows = [], []
+		try:
+			super().index_doc(doctype, docname)
+			self._write_side_rows([f"{doctype}:{docname}"], self._tag_rows, self._doc_rows)
+		finally:
+			del self._tag_rows, self._doc_rows
+		update_index_version("sqlite")
+
+	def remove_doc(self, doctype, docname):
+		"""Remove a single document from the index and invalidate cached search results."""
+		super().remove_doc(doctype, docname)
+		self._write_side_rows([f"{doctype}:{docname}"], [], [])
+		update_index_version("sqlite")
+
+	def index_exists(self):
+		"""Indexes built without the `doc_key` column or the side tables are reported as missing, so
+		they get rebuilt."""
+		if not getattr(self, "_schema_current", False):
+			if not super().index_exists():
+				return False
+			conn = self._get_connection(read_only=True)
+			try:
+				columns = {row["name"] for row in conn.execute("PRAGMA table_info(search_fts)")}
+				indexes = conn.execute(
+					"SELECT COUNT(*) FROM sqlite_master WHERE type = 'index' "
+					"AND name IN ('search_tags_tag', 'search_docs_doctype')"
+				).fetchone()[0]
+				self._schema_current = "doc_key" in columns and indexes == 2
+			finally:
+				conn.close()
+		return self._schema_current
+
+	def _has_side_tables(self, conn):
+		return (
+			conn.execute(
+				"SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' "
+				"AND name IN ('search_tags', 'search_docs')"
+			).fetchone()[0]
+			== 2
+		)
+
+	def _build_filter_conditions(self, filters):
+		"""Match tag filters through the indexed tags table, inside the search query itself."""
+		filters = dict(filters or {})
+		tags = filters.pop("tags", None)
+		conditions, params = super()._build_filter_conditions(filters)
+		if tags:
+			conditions = [*conditions, self._get_tags_condition(tags)]
+			params = [*params, *tags]
+		return conditions, params
+
+	def _get_tags_condition(self, tags):
+		"""Condition on the documents that have any of the tags, looked up through `search_tags_tag`.
+
+		SQLite evaluates the subquery once, so the matching documents never leave the database and
+		the number of bound parameters only grows with the number of tags.
+		"""
+		placeholders = ",".join(["?"] * len(tags))
+		return f"doc_key IN (SELECT doc_key FROM search_tags WHERE tag IN ({placeholders}))"
+
+	def _write_side_rows(self, doc_keys, tag_rows, doc_rows):
+		"""Replace the rows of the given documents in the side tables, or of all documents if
+		`doc_keys` is None.
+
+		The side tables are only created when the whole index is built. Indexes built before they
+		existed are left without them until they are rebuilt, so that `index_exists` keeps reporting
+		them.
+		"""
+		conn = self._get_connection()
+		try:
+			if doc_keys is None:
+				conn.executescript(SIDE_TABLES_SCHEMA)
+				conn.execute("DELETE FROM search_tags")
+				conn.execute("DELETE FROM search_docs")
+			elif not self._has_side_tables(conn):
+				return
+			else:
+				keys = [(key,) for key in doc_keys]
+				conn.executemany("DELETE FROM search_tags WHERE doc_key = ?", keys)
+				conn.executemany("DELETE FROM search_docs WHERE doc_key = ?", keys)
+			conn.executemany("INSERT INTO search_tags (doc_key, tag, project) VALUES (?, ?, ?)", tag_rows)
+			conn.executemany(
+				"INSERT OR REPLACE INTO search_docs (doc_key, doctype, modified, hash) VALUES (?, ?, ?, ?)",
+				doc_rows,
+			)
+			conn.commit()
+		finally:
+			conn.close()
 
 	def get_search_filters(self):
 		"""
 		Return permission filters based on accessible projects.
 		"""
+		with self.metrics.phase("permissions"):
+			return self._get_permission_filters()
+
+	def _get_permission_filters(self):
 		accessible_projects = self._get_accessible_projects()
 
 		if not accessible_projects:
@@ -137,42 +408,13 @@ class GameplanSearch(SQLiteSearch):
 
 	def _get_accessible_projects(self):
 		"""Get list of projects accessible to current user."""
-		from pypika.terms import ExistsCriterion
-
-		if gameplan.is_guest():
-			GuestAccess = frappe.qb.DocType("GP Guest Access")
-			projects = (
-				frappe.qb.from_(GuestAccess)
-				.select(GuestAccess.project)
-				.distinct()
-				.where(GuestAccess.user == frappe.session.user)
-				.run(pluck=True)
-			)
-			return [cstr(p) for p in projects] if projects else []
-
-		Project = frappe.qb.DocType("GP Project")
-
 		# Administrator has access to all projects
 		if frappe.session.user == "Administrator":
+			Project = frappe.qb.DocType("GP Project")
 			projects = frappe.qb.from_(Project).select(Project.name).distinct().run(pluck=True)
 			return [cstr(p) for p in projects]
 
-		Member = frappe.qb.DocType("GP Member")
-		member_exists = (
-			frappe.qb.from_(Member)
-			.select(Member.name)
-			.where(Member.parenttype == "GP Team")
-			.where(Member.parent == Project.team)
-			.where(Member.user == frappe.session.user)
-		)
-		projects = (
-			frappe.qb.from_(Project)
-			.select(Project.name)
-			.distinct()
-			.where((Project.is_private == 0) | ((Project.is_private == 1) & ExistsCriterion(member_exists)))
-			.run(pluck=True)
-		)
-		return [cstr(p) for p in projects]
+		return get_accessible_projects()
 
 	def _get_project_team_for_comment(self, doc):
 		"""Resolve project for a comment document with caching."""
@@ -183,6 +425,10 @@ class GameplanSearch(SQLiteSearch):
 
 			cache_key = f"{doc.reference_doctype}:{doc.reference_name}"
 
+			# If we have a projects cache (bulk indexing), use it
+			if hasattr(self, "_project_team_cache") and doc.reference_doctype in COMMENT_REFERENCE_DOCTYPES:
+				return self._project_team_cache.get(cache_key, (None, None))
+
 			if cache_key in self._comment_project_cache:
 				return self._comment_project_cache[cache_key]
 
@@ -208,17 +454,29 @@ class GameplanSearch(SQLiteSearch):
 
 	def search(self, query, title_only=False, filters=None):
 		"""
-		Enhanced search method that handles tag filtering using LIKE operations.
+		Enhanced search method that handles tag filtering through the tags table.
 		"""
-		# Convert tag filters to LIKE filters for the parent search
-		if filters and "tags" in filters:
-			tag_filters = filters.pop("tags")
-			if tag_filters and isinstance(tag_filters, list) and len(tag_filters) > 0:
-				# Convert to LIKE filter format for space-separated tag matching
-				filters["tags"] = ["LIKE", tag_filters]
+		# Tag filters are matched against the tags table by `_build_filter_conditions`, empty or
+		# malformed ones don't restrict the results
+		if filters and "tags" in filters and not (isinstance(filters["tags"], list) and filters["tags"]):
+			filters.pop("tags")
+
+		# Call parent search with the converted filters. Permission filters are timed separately, the
+		# rest of the time is spent in the FTS query and scoring.
+		self.metrics = SearchMetrics()
+		start_time = time.perf_counter()
+		result = super().search(query, title_only, filters)
+		self.metrics.add_time(
+			"query", time.perf_counter() - start_time - self.metrics.timings.get("permissions", 0) / 1000
+		)
 
-		# Call parent search with the converted filters
-		return super().search(query, title_only, filters)
+		summary = result.get("summary")
+		if summary is not None:
+			self.metrics.count("matches", summary.get("total_matches") or 0)
+			self.metrics.count("returned", len(result.get("results") or []))
+			summary.update(self.metrics.as_dict())
+		record_search_metrics("sqlite", self.metrics)
+		return result
 
 	def get_filter_options(self):
 		"""
@@ -231,6 +489,8 @@ class GameplanSearch(SQLiteSearch):
 				- teams: dict mapping team names to counts
 				- doctypes: dict mapping doctype names to counts
 				- tags: dict mapping tag names to counts
+
+		Options are cached for each set of accessible projects until the index changes.
 		"""
 		if not self.is_search_enabled() or not self.index_exists():
 			return {"authors": {}, "projects": {}, "teams": {}, "doctypes": {}, "tags": {}}
@@ -241,92 +501,61 @@ class GameplanSearch(SQLiteSearch):
 		if not accessible_projects:
 			return {"authors": {}, "projects": {}, "teams": {}, "doctypes": {}, "tags": {}}
 
+		return search_result_cache.get(
+			"sqlite",
+			"",
+			lambda: self._get_filter_options(accessible_projects),
+			accessible_projects,
+			filter_options=True,
+		)
+
+	def _get_filter_options(self, accessible_projects):
+		"""Count the documents of each facet value in one scan of the index."""
+		placeholders = ",".join(["?"] * len(accessible_projects))
 		conn = self._get_connection(read_only=True)
 		try:
-			# Get authors
-			authors_query = """
-                SELECT owner, COUNT(*) as count
-                FROM search_fts
-                WHERE project IN ({})
-                GROUP BY owner
-                ORDER BY count DESC
-                LIMIT 20
-            """.format(",".join(["?"] * len(accessible_projects)))
-			authors = conn.execute(authors_query, accessible_projects).fetchall()
-
-			# Get projects
-			projects_query = """
-                SELECT project, COUNT(*) as count
-                FROM search_fts
-                WHERE project IN ({})
-                GROUP BY project
-                ORDER BY count DESC
-            """.format(",".join(["?"] * len(accessible_projects)))
-
-			projects_with_count = conn.execute(projects_query, accessible_projects).fetchall()
-
-			# Get teams
-			teams_query = """
-                SELECT team, COUNT(*) as count
-                FROM search_fts
-                WHERE team IS NOT NULL AND project IN ({})
-                GROUP BY team
-                ORDER BY count DESC
-            """.format(",".join(["?"] * len(accessible_projects)))
-			teams = conn.execute(teams_query, accessible_projects).fetchall()
-
-			# Get doctypes
-			doctypes_query = """
-                SELECT doctype, COUNT(*) as count
+			groups = conn.execute(
+				f"""
+                SELECT owner, project, team, doctype, COUNT(*) as count
                 FROM search_fts
-                WHERE project IN ({})
-                GROUP BY doctype
-                ORDER BY count DESC
-            """.format(",".join(["?"] * len(accessible_projects)))
-			doctypes = conn.execute(doctypes_query, accessible_projects).fetchall()
-
-			# Get tags - split the tags field and count individual tags
-			tags_query = """
-                SELECT tags
-                FROM search_fts
-                WHERE tags IS NOT NULL AND tags != '' AND project IN ({})
-            """.format(",".join(["?"] * len(accessible_projects)))
-			tags_result = conn.execute(tags_query, accessible_projects).fetchall()
-
+                WHERE project IN ({placeholders})
+                GROUP BY owner, project, team, doctype
+            """,
+				accessible_projects,
+			).fetchall()
+
+			tags = conn.execute(
+				f"""
+                SELECT tag, COUNT(*) as count
+                FROM search_tags
+                WHERE project IN ({placeholders})
+                GROUP BY tag
+            """,
+				accessible_projects,
+			).fetchall()
 		finally:
 			conn.close()
 
-		# Process tags - count individual tags from space-separated strings
-		tag_counts = {}
-		for row in tags_result:
-			if row["tags"]:
-				individual_tags = row["tags"].split()
-				for tag in individual_tags:
-					tag_counts[tag] = tag_counts.get(tag, 0) + 1
-
-		# Get project names for accessible projects with counts
-		projects = []
-		if accessible_projects:
-			project_counts = {p["project"]: p["count"] for p in projects_with_count}
-			project_details = frappe.get_all(
-				"GP Project", filters={"name": ("in", accessible_projects)}, fields=["name", "title"]
-			)
-			for p in project_details:
-				if p.name in project_counts:
-					projects.append({"value": p.name, "label": p.title, "count": project_counts[p.name]})
-
-		# Create count dictionaries for authors, teams, projects, and doctypes (frontend has the full data)
-		author_counts = {a["owner"]: a["count"] for a in authors}
-		team_counts = {t["team"]: t["count"] for t in teams}
-		project_counts = {p["project"]: p["count"] for p in projects_with_count}
-		doctype_counts = {dt["doctype"]: dt["count"] for dt in doctypes}
-
+		author_counts, project_counts, team_counts, doctype_counts = (
+			Counter(),
+			Counter(),
+			Counter(),
+			Counter(),
+		)
+		for row in groups:
+			author_counts[row["owner"]] += row["count"]
+			project_counts[row["project"]] += row["count"]
+			if row["team"] is not None:
+				team_counts[row["team"]] += row["count"]
+			doctype_counts[row["doctype"]] += row["count"]
+
+		# Counts are sorted by descending count, like the frontend shows them
 		return {
-			"authors": author_counts,
-			"projects": project_counts,
-			"teams": team_counts,
-			"doctypes": doctype_counts,
-			"tags": tag_counts,
+			"authors": dict(author_counts.most_common(20)),
+			"projects": dict(project_counts.most_common()),
+			"teams": dict(team_counts.most_common()),
+			"doctypes": dict(doctype_counts.most_common()),
+			"tags": {row["tag"]: row["count"] for row in tags},
 		}
 
 
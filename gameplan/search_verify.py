@@ -0,0 +1,194 @@
+# Copyright (c) 2025, Frappe Technologies Pvt. Ltd. and Contributors
+# MIT License. See license.txt
+
+"""Check that a search index matches the records in the database.
+
+Indexes are compared with the database on the number of documents of each doctype, and on the
+modified time and a hash of the indexed values of each document. Numbers of documents are taken
+from each index's own counts, through `count_documents`, which returns the total under None for
+indexes that can't count documents by doctype. Sampled verification checks a random range of
+records of each doctype and is cheap enough to run on a schedule; full verification streams through
+all records and all indexed documents in chunks:
+
+	bench --site mysite execute gameplan.search_verify.verify --kwargs "{'index': 'sqlite', 'mode': 'full'}"
+
+Indexes are only expected to be up to date up to their high-water mark, so records changed since
+then aren't compared, and records created since then aren't counted on either side.
+
+The ids of the documents that are missing, outdated or shouldn't be indexed are returned as a
+repair list, which `gameplan.search_catchup.repair` indexes again or removes.
+"""
+
+import random
+import time
+
+import frappe
+from frappe.utils import now_datetime
+
+from gameplan.search_catchup import (
+	CATCH_UP_OVERLAP,
+	SEARCH_BACKENDS,
+	get_chunks,
+	get_missing_ids,
+	get_search,
+	repair,
+)
+from gameplan.search_records import INDEXED_DOCTYPES, get_high_water_mark, get_record_chunks
+
+# Number of records of each doctype checked by a sampled verification
+SAMPLE_SIZE = 200
+
+# Fields of the records whose changes are indexed, by doctype, `modified` for the others
+CHANGE_FIELDS = {"GP Discussion": ["modified", "last_post_at"]}
+
+# Seconds the doctypes whose counts differed are remembered for, long enough to reach the next run
+MISMATCH_TTL = 2 * 60 * 60
+
+
+def verify_indexes():
+	"""Verify a sample of each search index, run by the scheduler.
+
+	Documents found to differ are repaired right away. A difference in the number of documents
+	can't be traced back to documents from a sample, so it queues a full verification instead, once
+	the counts of a doctype differed in two runs in a row. Deletions that the index hasn't caught up
+	with yet only make them differ until the next catch up.
+	"""
+	for index in SEARCH_BACKENDS:
+		report = verify(index)
+		if not report or not report["exists"]:
+			continue
+
+		if report["repair"]:
+			repair(index, report["repair"])
+
+		key = f"search_verify_count_mismatch:{index}"
+		previous = frappe.cache().get_value(key) or []
+		mismatched = [
+			doctype for doctype, counts in report["counts"].items() if counts["database"] != counts["index"]
+		]
+		if mismatched:
+			frappe.cache().set_value(key, mismatched, expires_in_sec=MISMATCH_TTL)
+		else:
+			frappe.cache().delete_value(key)
+
+		if set(mismatched) & set(previous):
+			frappe.enqueue(
+				"gameplan.search_verify.verify",
+				queue="long",
+				job_id=f"gameplan_search_verify_{index}",
+				deduplicate=True,
+				index=index,
+				mode="full",
+				repair_index=True,
+			)
+
+
+def verify(index, mode="sampled", sample_size=SAMPLE_SIZE, repair_index=False):
+	"""Compare a search index with the database and return a report of the differences.
+
+	`mode` is either "sampled", which checks `sample_size` records of each doctype, or "full". If
+	`repair_index` is set, the documents in the repair list are indexed again or removed.
+	"""
+	if mode not in ("sampled", "full"):
+		frappe.throw(f"Invalid verification mode: {mode}")
+
+	search = get_search(index)
+	if hasattr(search, "is_search_enabled") and not search.is_search_enabled():
+		return
+	if not search.index_exists():
+		return {"index": index, "mode": mode, "exists": False}
+
+	start = time.monotonic()
+	# Records changed after this may not be indexed yet, like when catching up
+	before = (get_high_water_mark(index) or now_datetime()) - CATCH_UP_OVERLAP
+	report = {
+		"index": index,
+		"mode": mode,
+		"exists": True,
+		"before": str(before),
+		"counts": {},
+		"checked": 0,
+		# Records that aren't indexed
+		"missing": [],
+		# Documents whose modified time or indexed values differ from those of their record
+		"outdated": [],
+		# Documents whose records were deleted or shouldn't be indexed, only found in full mode
+		"extra": [],
+	}
+
+	if mode == "full":
+		for chunk in get_chunks(search.get_document_ids()):
+			report["extra"].extend(get_missing_ids(chunk))
+
+	index_counts = search.count_documents()
+	indexed_since = {}
+	for doctype, filters in INDEXED_DOCTYPES.items():
+		count = frappe.db.count(doctype, filters={**(filters or {}), "creation": ("<", before)})
+		indexed_since[doctype] = count_indexed_since(search, doctype, filters, before)
+		index_count = index_counts.get(doctype, 0) - indexed_since[doctype]
+		report["counts"][doctype] = {"database": count, "index": index_count}
+
+		# Only records that haven't changed since the index caught up are compared
+		unchanged = {
+			**(filters or {}),
+			**{field: ("<", before) for field in CHANGE_FIELDS.get(doctype, ["modified"])},
+		}
+		if mode == "full":
+			chunks = (
+				[record.name for record in records]
+				for records in get_record_chunks(doctype, ["name"], unchanged)
+			)
+		else:
+			chunks = [get_sample_names(doctype, unchanged, sample_size)]
+
+		for names in chunks:
+			if names:
+				compare_documents(search, doctype, names, report)
+
+	if None in index_counts:
+		# The index only counts its documents in total
+		report["counts"] = {
+			"total": {
+				"database": sum(counts["database"] for counts in report["counts"].values()),
+				"index": index_counts[None] - sum(indexed_since.values()),
+			}
+		}
+
+	report["repair"] = sorted({*report["missing"], *report["outdated"], *report["extra"]})
+	if repair_index and report["repair"]:
+		report["repaired"] = repair(index, report["repair"])
+
+	report["seconds"] = round(time.monotonic() - start, 3)
+	return report
+
+
+def count_indexed_since(search, doctype, filters, since):
+	"""Number of the records of a doctype created at or after `since` that are already indexed."""
+	names = frappe.get_all(doctype, filters={**(filters or {}), "creation": (">=", since)}, pluck="name")
+	return sum(
+		len(search.get_index_digests([f"{doctype}:{name}" for name in chunk])) for chunk in get_chunks(names)
+	)
+
+
+def get_sample_names(doctype, filters, sample_size):
+	"""Names of a range of `sample_size` records of a doctype, starting at a random one."""
+	count = frappe.db.count(doctype, filters=filters)
+	start = random.randrange(max(count - sample_size, 0) + 1)
+	return frappe.db.get_all(
+		doctype, filters=filters, order_by="name asc", start=start, limit=sample_size, pluck="name"
+	)
+
+
+def compare_documents(search, doctype, names, report):
+	"""Add the documents of the records with the given names that differ from them to the report."""
+	expected = search.get_record_digests(doctype, names)
+	if not expected:
+		return
+	indexed = search.get_index_digests(list(expected))
+	report["checked"] += len(expected)
+
+	for doc_id, digest in expected.items():
+		if doc_id not in indexed:
+			report["missing"].append(doc_id)
+		elif indexed[doc_id] != digest:
+			report["outdated"].append(doc_id)
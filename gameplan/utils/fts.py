@@ -1,14 +1,443 @@
+import heapq
 import json
 import math
 import os
 import re
+import struct
+import sys
+import threading
 import time
-from collections import defaultdict
+from array import array
+from bisect import bisect_left
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
+from itertools import groupby
 
 import frappe
 from bs4 import BeautifulSoup
-from frappe.utils import update_progress_bar
+from frappe.utils import cint, update_progress_bar
+
+from gameplan.search_metrics import SearchMetrics
+from gameplan.utils.fts_snapshot import OverlayList, OverlayMapping, Snapshot, SnapshotWriter
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+# Keys written by the previous layout, which kept the whole index in Redis, removed when a new
+# snapshot is published.
+LEGACY_KEYS = (
+	"inverted_index",
+	"trigram_index",
+	"doc_lengths",
+	"avg_doc_length",
+	"document_count",
+	"doc_timestamps",
+	"title_words",
+	"doc_contents",
+	"word_positions",
+)
+
+# Number of entries in the change log after which it should be compacted into a new snapshot.
+COMPACTION_THRESHOLD = 500
+
+# Number of documents whose contents are read at a time when writing a snapshot, and of change log
+# entries read per XRANGE.
+WRITE_BATCH_SIZE = 1000
+
+# Position before the first entry of a change log
+LOG_START = "0-0"
+
+# Number of documents processed by a worker at a time when building the index.
+INDEX_CHUNK_SIZE = 500
+
+# Relative slack applied to score upper bounds when pruning, so that floating point rounding in a
+# bound never prunes a document that would have made it into the results.
+SCORE_BOUND_TOLERANCE = 1 + 1e-9
+
+# The fuzzy dictionary maps every string obtained by deleting up to FUZZY_MAX_DISTANCE characters
+# from the first FUZZY_PREFIX_LENGTH characters of a term to the terms that produce it. Deletes
+# shorter than FUZZY_MIN_KEY_LENGTH are never looked up, as queries shorter than three characters
+# aren't corrected.
+FUZZY_MAX_DISTANCE = 2
+FUZZY_PREFIX_LENGTH = 7
+FUZZY_MIN_KEY_LENGTH = 2
+
+WORD_PATTERN = re.compile(r"\w+")
+
+# Punctuation following a word, which snippets ending at the word keep, like the "]" of "[link]"
+TRAILING_PUNCTUATION_PATTERN = re.compile(r"[^\w\s]*")
+
+# Query syntax: "exact phrases", NEAR/n between two terms and plain words
+QUERY_TOKEN_PATTERN = re.compile(r'"([^"]*)"|\bNEAR/(\d+)\b|(\w+)')
+
+# Attributes that hold the loaded index and are shared through `_index_cache`.
+INDEX_STATE = (
+	"snapshot",
+	"snapshot_size",
+	"log_position",
+	"pending_contents",
+	"inverted_index",
+	"title_index",
+	"doc_ids",
+	"doc_numbers",
+	"doc_lengths",
+	"title_lengths",
+	"doc_timestamps",
+	"max_timestamp",
+	"doc_projects",
+	"project_doc_counts",
+	"project_ids",
+	"project_numbers",
+	"doc_terms",
+	"title_words",
+	"document_count",
+	"total_length",
+	"total_title_length",
+	"avg_doc_length",
+	"avg_title_length",
+)
+
+# Loaded indexes kept per worker process, keyed by site and key prefix. Each entry records the
+# index version it was loaded at. The position in the change log up to which entries have been
+# applied is part of the state.
+_index_cache = {}
+
+
+class _IndexLock:
+	"""Lock of the indexes cached per worker process, held either exclusively or shared.
+
+	Loading an index and applying change log entries to it update the cached copy in place, and hold
+	the lock exclusively through `with`. Searches only read it, and hold it shared through `shared`,
+	so they run at the same time as each other while updates wait for them to finish. Threads that
+	hold the lock shared must not take it exclusively.
+	"""
+
+	def __init__(self):
+		self._lock = threading.RLock()
+		self._released = threading.Condition(self._lock)
+		self._readers = 0
+		# Threads holding or waiting for the lock exclusively, which new readers wait for
+		self._writers = 0
+
+	def __enter__(self):
+		self._lock.acquire()
+		self._writers += 1
+		while self._readers:
+			self._released.wait()
+		return self
+
+	def __exit__(self, *exc_info):
+		self._writers -= 1
+		self._released.notify_all()
+		self._lock.release()
+
+	@contextmanager
+	def shared(self):
+		with self._lock:
+			while self._writers:
+				self._released.wait()
+			self._readers += 1
+		try:
+			yield
+		finally:
+			with self._lock:
+				self._readers -= 1
+				self._released.notify_all()
+
+
+# Cached indexes are updated in place when change log entries are applied to them, so threads of a
+# worker load and update them one at a time, and only search them while no update is applied
+_index_lock = _IndexLock()
+
+
+class PostingList:
+	"""Postings of a single term, kept in parallel arrays sorted by document number.
+
+	The positions of all postings share one array. The slice of posting `i` starts at `offsets[i]`
+	and holds the number of title positions, followed by the delta-encoded title positions and the
+	delta-encoded content positions.
+
+	Postings read from a snapshot are memoryviews into the mapped file. They are copied into arrays
+	the first time postings are added to them.
+	"""
+
+	__slots__ = ("docs", "freqs", "offsets", "positions")
+
+	def __init__(self):
+		self.docs = array("I")
+		self.freqs = array("I")
+		self.offsets = array("I", [0])
+		self.positions = array("I")
+
+	def __len__(self):
+		return len(self.docs)
+
+	def extend(self, other, offset=0):
+		"""Append the postings of `other`, with its document numbers shifted by `offset`."""
+		if self.docs and other.docs and other.docs[0] + offset <= self.docs[-1]:
+			raise ValueError("Postings must be appended in increasing document order")
+
+		self._make_writable()
+		base = self.offsets[-1]
+		self.docs.extend(doc + offset for doc in other.docs)
+		self.freqs.extend(other.freqs)
+		self.offsets.extend(position + base for position in other.offsets[1:])
+		self.positions.extend(other.positions)
+
+	def append(self, doc, freq, title_positions, content_positions):
+		if self.docs and doc <= self.docs[-1]:
+			raise ValueError("Postings must be appended in increasing document order")
+
+		self._make_writable()
+		self.docs.append(doc)
+		self.freqs.append(freq)
+		self.positions.append(len(title_positions))
+		self.positions.extend(_delta_encode(title_positions))
+		self.positions.extend(_delta_encode(content_positions))
+		self.offsets.append(len(self.positions))
+
+	def _make_writable(self):
+		if not isinstance(self.docs, array):
+			self.docs, self.freqs, self.offsets, self.positions = (
+				array("I", field.tobytes()) for field in (self.docs, self.freqs, self.offsets, self.positions)
+			)
+
+	def find(self, doc):
+		"""Index of the posting for `doc`, or -1 if the term does not occur in it."""
+		i = bisect_left(self.docs, doc)
+		if i < len(self.docs) and self.docs[i] == doc:
+			return i
+		return -1
+
+	def get_positions(self, i):
+		"""Title and content positions of the posting at index `i`."""
+		start, end = self.offsets[i], self.offsets[i + 1]
+		title_end = start + 1 + self.positions[start]
+		return (
+			_delta_decode(self.positions[start + 1 : title_end]),
+			_delta_decode(self.positions[title_end:end]),
+		)
+
+	def remove(self, docs):
+		"""Remove the postings of the given document numbers."""
+		indexes = [i for i in (self.find(doc) for doc in docs) if i >= 0]
+		if not indexes:
+			return
+
+		kept = PostingList()
+		skip = set(indexes)
+		for i, doc in enumerate(self.docs):
+			if i not in skip:
+				kept.docs.append(doc)
+				kept.freqs.append(self.freqs[i])
+				kept.positions.extend(self.positions[self.offsets[i] : self.offsets[i + 1]])
+				kept.offsets.append(len(kept.positions))
+
+		self.docs, self.freqs, self.offsets, self.positions = (
+			kept.docs,
+			kept.freqs,
+			kept.offsets,
+			kept.positions,
+		)
+
+	def to_bytes(self):
+		return b"".join(
+			[
+				struct.pack("<II", len(self.docs), len(self.positions)),
+				self.docs.tobytes(),
+				self.freqs.tobytes(),
+				self.offsets.tobytes(),
+				self.positions.tobytes(),
+			]
+		)
+
+	@classmethod
+	def from_buffer(cls, data):
+		"""Postings over a buffer written by `to_bytes`, without copying it."""
+		postings = cls.__new__(cls)
+		count, positions_count = struct.unpack_from("<II", data)
+		fields = memoryview(data)[struct.calcsize("<II") :].cast("I")
+		postings.docs = fields[:count]
+		postings.freqs = fields[count : 2 * count]
+		postings.offsets = fields[2 * count : 3 * count + 1]
+		postings.positions = fields[3 * count + 1 : 3 * count + 1 + positions_count]
+		return postings
+
+
+class _SnapshotPostings:
+	"""Postings of the terms of a snapshot, aligned with its sorted term table."""
+
+	def __init__(self, terms, postings):
+		self.terms = terms
+		self.postings = postings
+
+	def get(self, word):
+		i = self.terms.find(word.encode())
+		if i < 0 or not self.postings[i]:
+			return None
+		return PostingList.from_buffer(self.postings[i])
+
+	def keys(self):
+		for term, postings in zip(self.terms, self.postings, strict=True):
+			if postings:
+				yield sys.intern(term.tobytes().decode())
+
+
+class _SnapshotDocIds:
+	"""Document ids of a snapshot by number, with None for removed documents."""
+
+	def __init__(self, doc_ids):
+		self.doc_ids = doc_ids
+
+	def __len__(self):
+		return len(self.doc_ids)
+
+	def __getitem__(self, number):
+		return self.doc_ids[number].tobytes().decode() or None
+
+
+class _SnapshotDocNumbers:
+	"""Document numbers of a snapshot by document id, found through the numbers sorted by id."""
+
+	def __init__(self, doc_ids, doc_order):
+		self.doc_ids = doc_ids
+		self.doc_order = doc_order
+
+	def get(self, doc_id):
+		key = doc_id.encode()
+		i = bisect_left(self.doc_order, key, key=lambda number: self.doc_ids[number].tobytes())
+		if i < len(self.doc_order) and self.doc_ids[self.doc_order[i]] == key:
+			return self.doc_order[i]
+		return None
+
+	def keys(self):
+		for number in self.doc_order:
+			yield self.doc_ids[number].tobytes().decode()
+
+	def count_prefix(self, prefix):
+		"""Number of document ids that start with `prefix`, found by bisecting the sorted numbers.
+
+		An empty prefix counts nothing.
+		"""
+		if not prefix:
+			return 0
+		start = prefix.encode()
+		# First id after those starting with the prefix, which differs from it in the last byte
+		end = start[:-1] + bytes([start[-1] + 1])
+		first = bisect_left(self.doc_order, start, key=lambda number: self.doc_ids[number].tobytes())
+		last = bisect_left(self.doc_order, end, key=lambda number: self.doc_ids[number].tobytes())
+		return last - first
+
+
+class _SnapshotDocWords:
+	"""Terms of each document of a snapshot, stored as term numbers and returned as `factory`."""
+
+	def __init__(self, doc_ids, terms, doc_words, factory):
+		self.doc_ids = doc_ids
+		self.terms = terms
+		self.doc_words = doc_words
+		self.factory = factory
+
+	def get(self, number):
+		if not 0 <= number < len(self.doc_ids) or not self.doc_ids[number]:
+			return None
+		return self.factory(
+			sys.intern(self.terms[term].tobytes().decode()) for term in self.doc_words[number].cast("I")
+		)
+
+	def keys(self):
+		for number, doc_id in enumerate(self.doc_ids):
+			if doc_id:
+				yield number
+
+
+def _delta_encode(values):
+	previous = 0
+	for value in values:
+		yield value - previous
+		previous = value
+
+
+def _get_deletes(word, max_distance):
+	"""Strings obtained by deleting up to `max_distance` characters from the prefix of `word`."""
+	edits = {word[:FUZZY_PREFIX_LENGTH]}
+	deletes = set(edits)
+	for _ in range(max_distance):
+		edits = {edit[:i] + edit[i + 1 :] for edit in edits for i in range(len(edit))}
+		deletes |= edits
+	return {delete for delete in deletes if len(delete) >= FUZZY_MIN_KEY_LENGTH}
+
+
+def _edit_distance(a, b, max_distance):
+	"""Optimal string alignment distance between `a` and `b`, capped at `max_distance + 1`."""
+	if abs(len(a) - len(b)) > max_distance:
+		return max_distance + 1
+
+	before_previous = None
+	previous = list(range(len(b) + 1))
+	for i in range(1, len(a) + 1):
+		current = [i] + [0] * len(b)
+		for j in range(1, len(b) + 1):
+			distance = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (a[i - 1] != b[j - 1]))
+			if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+				distance = min(distance, before_previous[j - 2] + 1)
+			current[j] = distance
+		if min(current) > max_distance:
+			return max_distance + 1
+		before_previous, previous = previous, current
+
+	return min(previous[-1], max_distance + 1)
+
+
+def _min_covering_window(position_lists):
+	"""Width of the smallest window holding a position from each of the sorted `position_lists`.
+
+	Sweeps the lists in merged order with a heap holding the current position of each list, so the
+	cost is O(P log k) for P positions over k lists.
+	"""
+	heap = [(positions[0], i, 0) for i, positions in enumerate(position_lists)]
+	heapq.heapify(heap)
+	highest = max(position for position, _i, _j in heap)
+	min_window = math.inf
+	while True:
+		lowest, i, j = heap[0]
+		min_window = min(min_window, highest - lowest)
+		j += 1
+		if j == len(position_lists[i]):
+			return min_window
+		highest = max(highest, position_lists[i][j])
+		heapq.heapreplace(heap, (position_lists[i][j], i, j))
+
+
+def _build_partial_index(documents):
+	"""Index a chunk of documents on its own, with document numbers starting from zero.
+
+	Runs in the worker processes of `FullTextSearch.index_documents`, so it doesn't touch the
+	site's connections. Returns the state of the partial index and the contents of the documents.
+	"""
+	partial = FullTextSearch.__new__(FullTextSearch)
+	partial._reset_index()
+	contents = []
+	for doc in documents:
+		doc_contents, record = partial._process_document_content(
+			doc["title"], doc["content"], doc["timestamp"], doc.get("attributes")
+		)
+		contents.append((doc["id"], doc_contents))
+		partial._add_document_record(doc["id"], record)
+	return partial._get_index_state(), contents
+
+
+def _delta_decode(values):
+	decoded = []
+	current = 0
+	for value in values:
+		current += value
+		decoded.append(current)
+	return decoded
 
 
 class FullTextSearch:
@@ -16,12 +445,12 @@ class FullTextSearch:
 		self.current_time = int(time.time())
 		self.redis = frappe.cache()
 		self._index_loaded = False
-		self.doc_timestamps = {}
-		self.doc_contents = {}
+		self._reset_index()
 		self.verbose = verbose
 		self.log_file = os.path.join(frappe.utils.get_site_path(), "logs", "search.log")
 		os.makedirs(os.path.dirname(self.log_file), exist_ok=True)
 		self.max_results = max_results
+		self.metrics = SearchMetrics()
 		self.matched_words = defaultdict(set)
 		self.matched_word_variations = defaultdict(set)  # Track variations per document
 		self.matched_positions = defaultdict(dict)  # Track positions of matched words
@@ -99,6 +528,42 @@ class FullTextSearch:
 		}
 		self.redis_prefix = "fts:"
 
+	def _reset_index(self):
+		self._cached_state = None
+		# Snapshot the index was loaded from. Documents numbered below its size have their contents
+		# stored in it, later ones were added from the change log and have them in `pending_contents`.
+		self.snapshot = None
+		self.snapshot_size = 0
+		# ID of the last change log entry applied to the index
+		self.log_position = LOG_START
+		self.pending_contents = {}
+		self.inverted_index = {}
+		# Title terms also get postings of their own, with title frequencies and positions only
+		self.title_index = {}
+		# Documents are interned as dense numbers, which index the per-document arrays below
+		self.doc_ids = []
+		self.doc_numbers = {}
+		self.doc_lengths = array("I")
+		self.title_lengths = array("I")
+		self.doc_timestamps = array("d")
+		# Newest timestamp of any document, which bounds the recency boost. It isn't lowered when
+		# documents are removed, as it only has to be an upper bound.
+		self.max_timestamp = 0
+		# Projects are interned as numbers too, with 0 standing for documents without a project
+		self.doc_projects = array("I")
+		# Number of documents in each project, by project number, to estimate matches in projects
+		self.project_doc_counts = Counter()
+		self.project_ids = [None]
+		self.project_numbers = {}
+		# Forward index from document number to the terms it contains
+		self.doc_terms = {}
+		self.title_words = {}
+		self.document_count = 0
+		self.total_length = 0
+		self.total_title_length = 0
+		self.avg_doc_length = 0
+		self.avg_title_length = 0
+
 	def _debug(self, *args):
 		"""Log debug messages to file if verbose mode is enabled"""
 		if self.verbose:
@@ -107,117 +572,357 @@ class FullTextSearch:
 			with open(self.log_file, "a") as f:
 				f.write(f"[{timestamp}] {message}\n")
 
-	def index_documents(self, documents):
-		"""Build the index from documents and save it to Redis."""
-		self._build_indexes(documents)
-		self._save_index_to_redis()
-		self._index_loaded = True
+	def index_documents(self, documents, total=None):
+		"""Build the index from documents and publish it as a new snapshot.
+
+		`documents` can be any iterable, like a generator that reads records in chunks. Documents are
+		processed in chunks by a pool of worker processes, and the partial indexes they build are
+		merged in order. Document contents are written to the snapshot as chunks come in, so apart
+		from the chunks in flight only the postings and per-document stats are held in memory.
+		`total` is only used to report progress.
+		"""
+		self._reset_index()
+		# Changes logged before the build started are in the documents being indexed
+		self.log_position = self._get_log_end()
+		show_progress = not hasattr(frappe.local, "request")
+
+		def get_contents():
+			for state, contents in self._build_partial_indexes(documents):
+				self._merge_partial_index(state)
+				for _doc_id, doc_contents in contents:
+					yield json.dumps(doc_contents).encode()
+				if show_progress:
+					update_progress_bar(
+						"Indexing documents", len(self.doc_ids), total or len(self.doc_ids), absolute=True
+					)
 
-	def index_exists(self):
-		required_keys = ["inverted_index", "doc_lengths", "document_count"]
+		version = self._write_snapshot(get_contents())
+		if show_progress:
+			print()
+
+		# A compaction running against the previous snapshot must not publish over the new one
+		with self.redis.lock(self._key("merge_lock"), timeout=600):
+			self._publish_snapshot(version)
+		# The index is read back from the snapshot before searching
+		self._index_loaded = False
 
-		for key in required_keys:
-			if not self.redis.get_value(self._get_redis_key(key)):
-				return False
+	def _build_partial_indexes(self, documents):
+		"""Yield the partial index of each chunk of documents, in order."""
+		chunks = self._batched(documents, INDEX_CHUNK_SIZE)
+		workers = cint(frappe.conf.get("gameplan_search_index_workers")) or os.cpu_count() or 1
+		if workers <= 1:
+			for chunk in chunks:
+				yield _build_partial_index(chunk)
+			return
+
+		with ProcessPoolExecutor(max_workers=workers) as executor:
+			# Only a few chunks are submitted ahead, so that reading records keeps pace with indexing
+			pending = deque()
+			for chunk in chunks:
+				pending.append(executor.submit(_build_partial_index, chunk))
+				if len(pending) >= workers * 2:
+					yield pending.popleft().result()
+			while pending:
+				yield pending.popleft().result()
+
+	def _merge_partial_index(self, state):
+		"""Append a partial index built by `_build_partial_index` to the index."""
+		offset = len(self.doc_ids)
+		for number, doc_id in enumerate(state["doc_ids"], start=offset):
+			self.doc_numbers[doc_id] = number
+		self.doc_ids.extend(state["doc_ids"])
+		self.doc_lengths.extend(state["doc_lengths"])
+		self.title_lengths.extend(state["title_lengths"])
+		self.doc_timestamps.extend(state["doc_timestamps"])
+		self.max_timestamp = max(self.max_timestamp, state["max_timestamp"])
+		project_numbers = [self._get_project_number(project) for project in state["project_ids"]]
+		doc_projects = [project_numbers[number] for number in state["doc_projects"]]
+		self.doc_projects.extend(doc_projects)
+		self.project_doc_counts.update(doc_projects)
+		for number, terms in state["doc_terms"].items():
+			self.doc_terms[number + offset] = tuple(sys.intern(word) for word in terms)
+		for number, title_words in state["title_words"].items():
+			self.title_words[number + offset] = title_words
+		self.total_length += state["total_length"]
+		self.total_title_length += state["total_title_length"]
+
+		for index, partial_index in (
+			(self.inverted_index, state["inverted_index"]),
+			(self.title_index, state["title_index"]),
+		):
+			for word, postings in partial_index.items():
+				word = sys.intern(word)
+				if word not in index:
+					index[word] = PostingList()
+				index[word].extend(postings, offset)
 
-		return True
+	def index_exists(self):
+		version = self.redis.mget(self._key("version"))[0]
+		return bool(version) and os.path.exists(self._get_snapshot_path(version.decode()))
 
 	def _get_redis_key(self, key):
 		return f"{self.redis_prefix}{key}"
 
-	def _process_document_content(self, doc_id, title, content, timestamp):
-		"""Process a document's content and prepare word frequencies for indexing."""
+	def _key(self, key):
+		"""Fully qualified key for use with raw Redis commands and pipelines."""
+		return self.redis.make_key(self._get_redis_key(key))
+
+	def _process_document_content(self, title, content, timestamp, attributes=None):
+		"""Process a document into its stored contents and the record that is added to the index.
+
+		`attributes` are returned with search results. Their "project" is also kept in the index,
+		so that searches can be restricted to a set of projects.
+		"""
+		attributes = attributes or {}
 		processed_content = self._process_content(content)
 
-		# Store document contents and timestamp
-		self.doc_timestamps[doc_id] = timestamp
-		self.doc_contents[doc_id] = {
+		# Index title and content words
+		title_matches = list(WORD_PATTERN.finditer(title))
+		content_matches = list(WORD_PATTERN.finditer(processed_content))
+		title_words = [match.group().lower() for match in title_matches]
+		content_words = [match.group().lower() for match in content_matches]
+
+		# The start offset of every word is stored with the text, so that snippets can be cut out
+		# around the positions of matched words
+		contents = {
 			"title": title,
 			"content": processed_content,
+			"attributes": attributes,
+			"offsets": {
+				"title": list(_delta_encode(match.start() for match in title_matches)),
+				"content": list(_delta_encode(match.start() for match in content_matches)),
+			},
 		}
 
-		# Index title and content words
-		title_words = re.findall(r"\w+", title.lower())
-		content_words = re.findall(r"\w+", processed_content.lower())
-
-		# Store title words
-		self.title_words = getattr(self, "title_words", {})
-		self.title_words[doc_id] = title_words
-
-		# Process word frequencies and positions
-		word_freq = defaultdict(lambda: {"title": 0, "content": 0})
-		word_positions = defaultdict(lambda: {"title": [], "content": []})
-
-		# Update trigrams, word frequencies and positions
-		title_pos = 0
-		for word in title_words:
-			word_freq[word]["title"] += 1
-			word_positions[word]["title"].append(title_pos)
-			title_pos += 1
-			for trigram in self._generate_trigrams(word):
-				self.trigram_index[trigram].add(word)
-
-		content_pos = 0
-		for word in content_words:
-			word_freq[word]["content"] += 1
-			word_positions[word]["content"].append(content_pos)
-			content_pos += 1
-			for trigram in self._generate_trigrams(word):
-				self.trigram_index[trigram].add(word)
-
-		# Calculate document length
-		total_words = len(title_words) * 3 + len(content_words)
-		self.doc_lengths[doc_id] = total_words
-
-		return word_freq, word_positions, total_words
-
-	def _save_index_to_redis(self):
-		"""Serialize and save the index to Redis with consistent key naming"""
-		data = {
-			"inverted_index": json.dumps(self.inverted_index),
-			"trigram_index": json.dumps({k: list(v) for k, v in self.trigram_index.items()}),
-			"doc_lengths": self.doc_lengths,
-			"avg_doc_length": self.avg_doc_length,
-			"document_count": self.document_count,
-			"doc_timestamps": self.doc_timestamps,
-			"title_words": {k: list(v) for k, v in self.title_words.items()},
-			"doc_contents": self.doc_contents,
-			"word_positions": json.dumps(self.word_positions),
+		# Collect title and content positions of every word
+		word_positions = defaultdict(lambda: ([], []))
+		for position, word in enumerate(title_words):
+			word_positions[word][0].append(position)
+		for position, word in enumerate(content_words):
+			word_positions[word][1].append(position)
+
+		# Title words count three times towards the term frequency and the document length
+		record = {
+			"timestamp": timestamp,
+			"project": attributes.get("project"),
+			"length": len(title_words) * 3 + len(content_words),
+			"title_words": title_words,
+			"postings": {
+				word: [len(title_positions) * 3 + len(content_positions), title_positions, content_positions]
+				for word, (title_positions, content_positions) in word_positions.items()
+			},
 		}
+		return contents, record
+
+	def _add_document_record(self, doc_id, record):
+		"""Intern a processed document and add its postings to the in-memory index."""
+		number = len(self.doc_ids)
+		self.doc_ids.append(doc_id)
+		self.doc_numbers[doc_id] = number
+		self.doc_lengths.append(record["length"])
+		self.title_lengths.append(len(record["title_words"]))
+		self.doc_timestamps.append(record["timestamp"])
+		self.max_timestamp = max(self.max_timestamp, record["timestamp"])
+		self.doc_projects.append(self._get_project_number(record.get("project")))
+		self.project_doc_counts[self.doc_projects[number]] += 1
+		self.title_words[number] = set(record["title_words"])
+		self.doc_terms[number] = tuple(sys.intern(word) for word in record["postings"])
+		self.total_length += record["length"]
+		self.total_title_length += len(record["title_words"])
+
+		# Postings are assigned back after changing them, as they may have been read from a snapshot
+		for word, (freq, title_positions, content_positions) in record["postings"].items():
+			word = sys.intern(word)
+			postings = self.inverted_index.get(word) or PostingList()
+			postings.append(number, freq, title_positions, content_positions)
+			self.inverted_index[word] = postings
+			if title_positions:
+				postings = self.title_index.get(word) or PostingList()
+				postings.append(number, len(title_positions), title_positions, [])
+				self.title_index[word] = postings
+
+		return number
+
+	def _get_project_number(self, project):
+		if project is None:
+			return 0
+		number = self.project_numbers.get(project)
+		if number is None:
+			number = self.project_numbers[project] = len(self.project_ids)
+			self.project_ids.append(project)
+		return number
+
+	def _get_project_filter(self, projects):
+		"""Flags indexed by project number, set for the given projects."""
+		allowed = bytearray(len(self.project_ids))
+		for project in projects:
+			number = self.project_numbers.get(str(project))
+			if number is not None:
+				allowed[number] = 1
+		return allowed
+
+	def _remove_documents_from_memory(self, doc_ids):
+		"""Remove documents from the in-memory index, visiting only the terms they contain."""
+		for doc_id in doc_ids:
+			number = self.doc_numbers.pop(doc_id, None)
+			if number is None:
+				continue
 
-		for key, value in data.items():
-			self.redis.set_value(self._get_redis_key(key), value)
-
-	def _build_indexes(self, documents):
-		"""Build inverted index for BM25 and trigram index for fuzzy matching."""
-		self.documents = documents
-		total_docs = len(documents)
-		self.document_count = total_docs
-		self.inverted_index = defaultdict(list)
-		self.trigram_index = defaultdict(set)
-		self.doc_lengths = {}
-		self.word_positions = defaultdict(lambda: defaultdict(dict))
-		total_length = 0
-
-		for i, doc in enumerate(self.documents):
-			doc_id = doc["id"]
-			word_freq, positions, doc_length = self._process_document_content(
-				doc_id, doc["title"], doc["content"], doc["timestamp"]
+			for index, words in (
+				(self.inverted_index, self.doc_terms.pop(number)),
+				(self.title_index, self.title_words.get(number, ())),
+			):
+				for word in words:
+					postings = index[word]
+					postings.remove([number])
+					if postings:
+						index[word] = postings
+					else:
+						del index[word]
+
+			self.total_length -= self.doc_lengths[number]
+			self.total_title_length -= self.title_lengths[number]
+			self.doc_ids[number] = None
+			self.doc_lengths[number] = 0
+			self.title_lengths[number] = 0
+			self.doc_timestamps[number] = 0
+			self.project_doc_counts[self.doc_projects[number]] -= 1
+			self.doc_projects[number] = 0
+			self.title_words.pop(number, None)
+
+	def _update_document_stats(self):
+		self.document_count = len(self.doc_numbers)
+		if self.document_count > 0:
+			self.avg_doc_length = self.total_length / self.document_count
+			self.avg_title_length = self.total_title_length / self.document_count
+		else:
+			self.avg_doc_length = 0
+			self.avg_title_length = 0
+
+		# The counters are plain values, so a cached copy of the index has to be updated explicitly
+		if self._cached_state is not None:
+			self._cached_state.update(self._get_index_state())
+
+	def _get_snapshot_dir(self):
+		return frappe.get_site_path("private", "fts", re.sub(r"\W+", "_", self.redis_prefix).strip("_"))
+
+	def _get_snapshot_path(self, version):
+		return os.path.join(self._get_snapshot_dir(), f"{version}.idx")
+
+	def _write_snapshot(self, contents, previous=None):
+		"""Write the index to a new snapshot file and return its version.
+
+		`contents` yields the stored contents of every document number, as JSON, and is consumed
+		before anything else is written. The fuzzy dictionary is carried over from the `previous`
+		snapshot, updated for the terms that were added and removed since.
+		"""
+		version = frappe.generate_hash()
+		with SnapshotWriter(self._get_snapshot_path(version)) as writer:
+			writer.add_strings("contents", contents)
+			self._update_document_stats()
+
+			# Terms are sorted by their encoded form, which is how they are looked up
+			terms = sorted(self.inverted_index, key=str.encode)
+			term_ids = {term: i for i, term in enumerate(terms)}
+			writer.add_strings("terms", (term.encode() for term in terms))
+			writer.add_strings("postings", (self.inverted_index[term].to_bytes() for term in terms))
+			writer.add_strings(
+				"title_postings",
+				(self.title_index[term].to_bytes() if term in self.title_index else b"" for term in terms),
 			)
-			total_length += doc_length
-
-			for word, freqs in word_freq.items():
-				total_freq = freqs["title"] * 3 + freqs["content"]
-				self.inverted_index[word].append((doc_id, total_freq))
-				self.word_positions[word][doc_id] = positions[word]
 
-			if not hasattr(frappe.local, "request"):
-				update_progress_bar("Indexing documents", i + 1, total_docs, absolute=True)
-
-		if not hasattr(frappe.local, "request"):
-			print()
+			# Numbers of removed documents are left empty, they are reused on the next full build
+			size = len(self.doc_ids)
+			writer.add_strings("doc_ids", ((self.doc_ids[number] or "").encode() for number in range(size)))
+			doc_order = sorted(self.doc_numbers.items(), key=lambda item: item[0].encode())
+			writer.add_array("doc_order", array("I", (number for _doc_id, number in doc_order)))
+			for name in ("doc_lengths", "title_lengths", "doc_timestamps", "doc_projects"):
+				writer.add_array(name, getattr(self, name))
+			writer.add_strings("projects", (project.encode() for project in self.project_ids[1:]))
+			for name in ("doc_terms", "title_words"):
+				words = getattr(self, name)
+				writer.add_strings(
+					name,
+					(
+						array("I", sorted(term_ids[word] for word in words[number])).tobytes()
+						if self.doc_ids[number] is not None
+						else b""
+						for number in range(size)
+					),
+				)
 
-		self.avg_doc_length = total_length / len(self.documents)
+			writer.add_strings("fuzzy", self._get_fuzzy_entries(terms, previous))
+			writer.meta = {
+				"document_count": self.document_count,
+				"total_length": self.total_length,
+				"total_title_length": self.total_title_length,
+				"title_term_count": len(self.title_index),
+				"log_position": self.log_position,
+			}
+
+		return version
+
+	def _publish_snapshot(self, version):
+		"""Point the index at the snapshot of the given version and drop the log entries folded into it.
+
+		Callers must hold the merge lock. The snapshot that is replaced is kept, so that workers
+		that have just read the old version can still open it, and older ones are removed.
+		"""
+		previous_version = self.redis.mget(self._key("version"))[0]
+		pipe = self.redis.pipeline()
+		pipe.set(self._key("version"), version)
+		pipe.delete(*[self._key(key) for key in LEGACY_KEYS])
+		pipe.execute()
+
+		while entries := self.redis.xrange(self._key("log"), "-", self.log_position, count=WRITE_BATCH_SIZE):
+			self.redis.xdel(self._key("log"), *[entry_id for entry_id, _fields in entries])
+
+		keep = {f"{version}.idx", f"{previous_version.decode()}.idx" if previous_version else None}
+		for filename in os.listdir(self._get_snapshot_dir()):
+			if filename.endswith(".idx") and filename not in keep:
+				os.remove(os.path.join(self._get_snapshot_dir(), filename))
+
+	def _get_fuzzy_entries(self, terms, previous=None):
+		"""Sorted entries of the fuzzy dictionary for `terms`.
+
+		The dictionary maps the deletes of each term to the terms that produce them. Each entry holds
+		a delete followed by its space separated terms. As a space sorts before any word character,
+		entries sort the same way as their deletes and can be looked up by prefix.
+		"""
+		previous_terms = set()
+		if previous is not None:
+			previous_terms = {term.tobytes().decode() for term in previous.strings("terms")}
+		current_terms = set(terms)
+
+		changes = defaultdict(lambda: (set(), set()))
+		for index, words in enumerate((current_terms - previous_terms, previous_terms - current_terms)):
+			for word in words:
+				if len(word) >= FUZZY_MIN_KEY_LENGTH:
+					for delete in _get_deletes(word, FUZZY_MAX_DISTANCE):
+						changes[delete][index].add(word)
+
+		previous_entries = (
+			entry.tobytes().decode().split(" ", 1)
+			for entry in (previous.strings("fuzzy") if previous is not None else ())
+		)
+		changed_entries = ([delete, ""] for delete in sorted(changes, key=str.encode))
+		entries = heapq.merge(previous_entries, changed_entries, key=lambda entry: entry[0].encode())
+		for delete, group in groupby(entries, key=lambda entry: entry[0]):
+			words = {word for _delete, words in group for word in words.split(" ") if word}
+			added, removed = changes.get(delete, ((), ()))
+			words = (words | set(added)) - set(removed)
+			if words:
+				yield f"{delete} {' '.join(sorted(words))}".encode()
+
+	def _batched(self, iterable, size):
+		batch = []
+		for item in iterable:
+			batch.append(item)
+			if len(batch) >= size:
+				yield batch
+				batch = []
+		if batch:
+			yield batch
 
 	def _process_content(self, content):
 		soup = BeautifulSoup(content, "html.parser")
@@ -227,125 +932,323 @@ class FullTextSearch:
 		return text
 
 	def _load_index_from_redis(self):
-		"""Load and deserialize the index from Redis with consistent key naming"""
-		if self._index_loaded:
-			return
-
-		data = {
-			key: self.redis.get_value(self._get_redis_key(key))
-			for key in [
-				"inverted_index",
-				"trigram_index",
-				"doc_lengths",
-				"avg_doc_length",
-				"document_count",
-				"doc_timestamps",
-				"title_words",
-				"doc_contents",
-				"word_positions",
-			]
+		"""Load the index, reusing the copy cached in this process when it is still current.
+
+		The version key points at the current snapshot. A full rebuild or compaction publishes a new
+		snapshot under a random version, so that a version can't repeat after the keys are deleted.
+		A cached index is reused as long as the version matches, with the change log entries added
+		since it was last used applied on top of it.
+		"""
+		with _index_lock:
+			if self._index_loaded:
+				return
+
+			version = self.redis.mget(self._key("version"))[0]
+			cache_key = (frappe.local.site, self.redis_prefix)
+			cached = _index_cache.get(cache_key)
+
+			if cached and version is not None and cached["version"] == version:
+				self._set_index_state(cached["state"])
+				self._cached_state = cached["state"]
+				self._apply_change_log()
+			else:
+				self._load_snapshot(version)
+				if self.snapshot is not None:
+					self._cached_state = self._get_index_state()
+					_index_cache[cache_key] = {"version": version, "state": self._cached_state}
+
+			self._index_loaded = True
+
+	def _get_index_state(self):
+		return {attr: getattr(self, attr) for attr in INDEX_STATE}
+
+	def _set_index_state(self, state):
+		for attr, value in state.items():
+			setattr(self, attr, value)
+
+	def _read_cached_state(self):
+		"""Read back the log position and counters of the cached index this instance shares.
+
+		Other instances of this process may have applied entries to it since this one last did.
+		Callers must hold `_index_lock`, shared or exclusively.
+		"""
+		if self._cached_state is not None:
+			self._set_index_state(self._cached_state)
+
+	def _load_snapshot(self, version):
+		"""Map the snapshot of the given version and apply the change log on top of it.
+
+		Postings, document terms and contents are read from the mapped file when they are used, so
+		loading doesn't parse the index. Only the per-document stats are copied into arrays.
+		"""
+		self._reset_index()
+		try:
+			snapshot = Snapshot(self._get_snapshot_path(version.decode())) if version else None
+		except FileNotFoundError:
+			self._debug(f"Snapshot {version} not found")
+			snapshot = None
+
+		if snapshot is not None:
+			meta = snapshot.meta
+			terms = snapshot.strings("terms")
+			doc_ids = snapshot.strings("doc_ids")
+			self.snapshot = snapshot
+			self.snapshot_size = len(doc_ids)
+			self.inverted_index = OverlayMapping(
+				_SnapshotPostings(terms, snapshot.strings("postings")), len(terms)
+			)
+			self.title_index = OverlayMapping(
+				_SnapshotPostings(terms, snapshot.strings("title_postings")), meta["title_term_count"]
+			)
+			self.doc_ids = OverlayList(_SnapshotDocIds(doc_ids))
+			self.doc_numbers = OverlayMapping(
+				_SnapshotDocNumbers(doc_ids, snapshot.array("doc_order")), meta["document_count"]
+			)
+			for name in ("doc_lengths", "title_lengths", "doc_timestamps", "doc_projects"):
+				values = snapshot.array(name)
+				stats = array(values.format)
+				stats.frombytes(values.cast("B"))
+				setattr(self, name, stats)
+			self.max_timestamp = max(self.doc_timestamps, default=0)
+			# Removed documents are counted under project 0, which is never searched on its own
+			self.project_doc_counts = Counter(self.doc_projects)
+			for project in snapshot.strings("projects"):
+				self._get_project_number(project.tobytes().decode())
+			self.doc_terms = OverlayMapping(
+				_SnapshotDocWords(doc_ids, terms, snapshot.strings("doc_terms"), tuple),
+				meta["document_count"],
+			)
+			self.title_words = OverlayMapping(
+				_SnapshotDocWords(doc_ids, terms, snapshot.strings("title_words"), set),
+				meta["document_count"],
+			)
+			self.total_length = meta["total_length"]
+			self.total_title_length = meta["total_title_length"]
+
+			self.log_position = meta["log_position"]
+
+		self._apply_change_log()
+
+	def _read_change_log(self):
+		"""Yield the change log entries after the current log position, reading them in batches."""
+		position = self.log_position
+		while True:
+			entries = self.redis.xrange(self._key("log"), position, "+", count=WRITE_BATCH_SIZE)
+			# The range includes the entry at the position itself, unless it was compacted already
+			entries = [entry for entry in entries if entry[0].decode() != position]
+			if not entries:
+				return
+			yield from entries
+			position = entries[-1][0].decode()
+
+	def _apply_change_log(self):
+		"""Apply the change log entries that were added since the index was loaded or last updated.
+
+		Each entry replaces or removes a whole document, so only the last entry of a document
+		matters. Contents of the documents are kept until they are folded into a snapshot.
+		"""
+		with _index_lock:
+			self._read_cached_state()
+			pending = {}
+			for entry_id, fields in self._read_change_log():
+				doc_id = fields[b"doc_id"].decode()
+				if fields[b"op"] == b"index":
+					pending[doc_id] = json.loads(fields[b"record"])
+					self.pending_contents[doc_id] = fields[b"contents"]
+				else:
+					pending[doc_id] = None
+					self.pending_contents.pop(doc_id, None)
+				self.log_position = entry_id.decode()
+
+			if pending:
+				self._remove_documents_from_memory(pending)
+				for doc_id, record in pending.items():
+					if record:
+						self._add_document_record(doc_id, record)
+			self._update_document_stats()
+
+	def _get_log_end(self):
+		"""ID of the last entry in the change log."""
+		entries = self.redis.xrevrange(self._key("log"), count=1)
+		return entries[0][0].decode() if entries else LOG_START
+
+	def _get_contents(self, doc_ids):
+		"""Stored contents of the given documents. Missing documents give None."""
+		numbers = [self.doc_numbers.get(doc_id) for doc_id in doc_ids]
+		return [json.loads(contents) if contents else None for contents in self._get_raw_contents(numbers)]
+
+	def _get_raw_contents(self, numbers):
+		"""Stored contents of the given document numbers as JSON, or None for missing documents."""
+		contents = [None] * len(numbers)
+		stored = self.snapshot.strings("contents") if self.snapshot is not None else None
+		for i, number in enumerate(numbers):
+			if number is None or self.doc_ids[number] is None:
+				continue
+			if number < self.snapshot_size:
+				contents[i] = stored[number].tobytes()
+			else:
+				contents[i] = self.pending_contents.get(self.doc_ids[number])
+		return contents
+
+	def _get_max_edit_distance(self, word):
+		if len(word) < 3:
+			return 0
+		return 1 if len(word) <= 4 else FUZZY_MAX_DISTANCE
+
+	def _correct_query_words(self, query_words):
+		"""Replace query words missing from the index with their closest indexed term.
+
+		Words found in the index are kept as they are. The rest are looked up in the fuzzy
+		dictionary of the snapshot, and corrected to the candidate with the
+		smallest edit distance, preferring terms found in more documents.
+		"""
+		lookups = {
+			word: _get_deletes(word, self._get_max_edit_distance(word))
+			for word in set(query_words)
+			if word not in self.inverted_index and self._get_max_edit_distance(word)
 		}
 
-		if data["inverted_index"]:
-			self.inverted_index = defaultdict(list, json.loads(data["inverted_index"]))
-		if data["trigram_index"]:
-			trigram_dict = json.loads(data["trigram_index"])
-			self.trigram_index = defaultdict(set, {k: set(v) for k, v in trigram_dict.items()})
-		if data["doc_lengths"]:
-			self.doc_lengths = data["doc_lengths"]
-		if data["avg_doc_length"]:
-			self.avg_doc_length = data["avg_doc_length"]
-		if data["document_count"]:
-			self.document_count = data["document_count"]
-		if data["doc_timestamps"]:
-			self.doc_timestamps = data["doc_timestamps"]
-		if data["title_words"]:
-			self.title_words = {k: set(v) for k, v in data["title_words"].items()}
-		if data["doc_contents"]:
-			self.doc_contents = data["doc_contents"]
-		if data["word_positions"]:
-			self.word_positions = defaultdict(lambda: defaultdict(dict), json.loads(data["word_positions"]))
-
-		self._index_loaded = True
-
-	def _generate_trigrams(self, word):
-		"""Generate trigrams for a given word."""
-		word = f"  {word}  "
-		return [word[i : i + 3] for i in range(len(word) - 2)]
-
-	def _find_fuzzy_matches(self, query_word, threshold=0.4):
-		"""Find words with similar trigrams to the query word."""
-		query_trigrams = set(self._generate_trigrams(query_word))
-		candidate_words = defaultdict(int)
-
-		for trigram in query_trigrams:
-			if trigram in self.trigram_index:
-				for word in self.trigram_index[trigram]:
-					candidate_words[word] += 1
-
+		corrections = {}
+		for word, deletes in lookups.items():
+			candidates = set()
+			for delete in deletes:
+				candidates.update(self._get_fuzzy_candidates(delete))
+			matches = self._find_fuzzy_matches(word, candidates)
+			if matches:
+				corrections[word] = matches[0][0]
+
+		corrected_query_words = [corrections.get(word, word) for word in query_words]
+		for word, corrected in zip(query_words, corrected_query_words, strict=True):
+			if corrected != word:
+				self._debug(f"Corrected '{word}' to '{corrected}'")
+		return corrected_query_words
+
+	def _get_fuzzy_candidates(self, delete):
+		"""Terms that produce `delete`, looked up in the fuzzy dictionary of the snapshot."""
+		if self.snapshot is None:
+			return []
+		fuzzy = self.snapshot.strings("fuzzy")
+		prefix = f"{delete} ".encode()
+		i = fuzzy.find_prefix(prefix)
+		return fuzzy[i][len(prefix) :].tobytes().decode().split(" ") if i >= 0 else []
+
+	def _find_fuzzy_matches(self, query_word, candidates):
+		"""Rank the `candidates` within edit distance of the query word, closest and most frequent first."""
+		max_distance = self._get_max_edit_distance(query_word)
 		results = []
-		for word, overlap in candidate_words.items():
-			jaccard_similarity = overlap / (
-				len(query_trigrams) + len(self._generate_trigrams(word)) - overlap
-			)
-			if jaccard_similarity >= threshold:
-				results.append((word, jaccard_similarity))
+		for word in candidates:
+			# The dictionary is only updated on merges, so it can refer to terms that are gone
+			postings = self.inverted_index.get(word)
+			if not postings:
+				continue
+			distance = _edit_distance(query_word, word, max_distance)
+			if distance <= max_distance:
+				results.append((word, distance, len(postings)))
 
-		results = sorted(results, key=lambda x: x[1], reverse=True)
+		results.sort(key=lambda x: (x[1], -x[2], x[0]))
 		self._debug(f"Fuzzy matches for '{query_word}': {results[:3]}")
 		return results
 
-	def _calculate_proximity_score(self, doc_id, query_words):
+	def _get_positions(self, word, doc):
+		"""Title and content positions of `word` in the document, or None if it doesn't contain it."""
+		postings = self.inverted_index.get(word)
+		i = postings.find(doc) if postings is not None else -1
+		return postings.get_positions(i) if i >= 0 else None
+
+	def _parse_query(self, query):
+		"""Split a query into its words and the phrase and NEAR/n constraints between them.
+
+		`"release notes"` only matches documents with the words next to each other in that order and
+		`deploy NEAR/5 server` documents with the two words at most five words apart. Words in
+		constraints are also scored like any other query word.
+		"""
+		query_words, constraints = [], []
+		near_distance = None
+		for phrase, distance, word in QUERY_TOKEN_PATTERN.findall(query):
+			if distance:
+				near_distance = int(distance)
+				continue
+
+			words = re.findall(r"\w+", phrase.lower()) if phrase else [word.lower()]
+			if not words:
+				continue
+			if near_distance is not None and query_words:
+				constraints.append(("near", [query_words[-1], words[0]], near_distance))
+			if len(words) > 1:
+				constraints.append(("phrase", words, None))
+			query_words.extend(words)
+			near_distance = None
+
+		return query_words, constraints
+
+	def _get_constrained_documents(self, constraints, title_only=False):
+		"""Documents that satisfy every phrase and NEAR/n constraint of the query."""
+		documents = None
+		for constraint in constraints:
+			_kind, words, _distance = constraint
+			postings = [self.inverted_index.get(word) for word in words]
+			if not all(postings):
+				return set()
+
+			candidates = set(min(postings, key=len).docs)
+			for posting_list in postings:
+				candidates.intersection_update(posting_list.docs)
+			if documents is not None:
+				candidates &= documents
+			documents = {doc for doc in candidates if self._matches_constraint(doc, constraint, title_only)}
+
+		return documents
+
+	def _matches_constraint(self, doc, constraint, title_only=False):
+		kind, words, distance = constraint
+		positions = [self._get_positions(word, doc) for word in words]
+		# Words have to be matched within the same field
+		for field in (0,) if title_only else (0, 1):
+			field_positions = [word_positions[field] for word_positions in positions]
+			if not all(field_positions):
+				continue
+
+			if kind == "near":
+				if _min_covering_window(field_positions) <= distance:
+					return True
+			else:
+				following = [set(word_positions) for word_positions in field_positions[1:]]
+				for start in field_positions[0]:
+					if all(start + i in word_positions for i, word_positions in enumerate(following, 1)):
+						return True
+
+		return False
+
+	def _calculate_proximity_score(self, doc, query_words):
 		"""Calculate proximity score based on the closeness of query terms in the document."""
 		if len(query_words) < 2:
 			return 1.0  # No proximity boost for single word queries
 
-		# Filter to words that actually appear in the document
-		filtered_words = [
-			w for w in query_words if w in self.word_positions and doc_id in self.word_positions[w]
-		]
-		if len(filtered_words) < 2:
-			return 1.0  # Need at least 2 words to calculate proximity
-
-		# Get all positions for each word
+		# Get all positions for each word that actually appears in the document
 		all_positions = []
-		for word in filtered_words:
-			word_pos = []
-			if "title" in self.word_positions[word][doc_id]:
+		for word in query_words:
+			positions = self._get_positions(word, doc)
+			if positions is not None:
+				title_positions, content_positions = positions
 				# Title positions get a bonus by multiplying by 0.5
-				word_pos.extend([p * 0.5 for p in self.word_positions[word][doc_id]["title"]])
-			if "content" in self.word_positions[word][doc_id]:
-				word_pos.extend(self.word_positions[word][doc_id]["content"])
-			all_positions.append(word_pos)
+				all_positions.append(sorted([p * 0.5 for p in title_positions] + content_positions))
+
+		if len(all_positions) < 2:
+			return 1.0  # Need at least 2 words to calculate proximity
 
 		# Calculate minimum span covering all query terms
-		min_span = float("inf")
-
-		# Only calculate spans if we have positions for all words
-		if all(pos for pos in all_positions):
-			# For each position of the first word
-			for pos1 in all_positions[0]:
-				# Find closest positions of other words
-				max_distance = 0
-				for positions in all_positions[1:]:
-					# Find the closest position
-					closest = min(positions, key=lambda x: abs(x - pos1))
-					distance = abs(closest - pos1)
-					max_distance = max(max_distance, distance)
-
-				# Update minimum span
-				min_span = min(min_span, max_distance)
-
-		# Convert span to score (smaller spans get higher scores)
-		if min_span == float("inf"):
-			return 1.0
+		min_span = _min_covering_window(all_positions)
 
 		# Logarithmic scaling to prevent excessive influence
 		proximity_score = 1.0 + 0.25 * math.log(1.0 + 10.0 / max(1, min_span))
 		return proximity_score
 
-	def _bm25_score(self, query_words, title_only=False):
-		"""Calculate BM25 scores for documents given the query words."""
+	def _get_query_terms(self, query_words, title_only=False):
+		"""Resolve the query words to the postings that are scored for them.
+
+		Returns a (word, original word, document numbers, frequencies, idf) tuple for every query
+		word that matches at least one document, in query order.
+		"""
 		# Filter out stop words but keep track of original words
 		filtered_map = [(w, orig) for orig in query_words if (w := orig.lower()) not in self.stop_words]
 
@@ -354,32 +1257,19 @@ class FullTextSearch:
 			filtered_map = [(w.lower(), w) for w in query_words]
 
 		self._debug(f"\nCalculating BM25 scores for words: {[w for w, _ in filtered_map]}")
-		doc_scores = defaultdict(float)
-		self.matched_words.clear()  # Reset matched words for new search
-		self.matched_word_variations.clear()  # Reset variations
-		self.matched_positions.clear()  # Reset positions
 		num_docs = self.document_count
-		k1, b = 1.2, 0.75  # BM25 parameters
-		self.score_components = defaultdict(lambda: {"bm25": 0})
-
+		terms = []
+		# For title_only search, only the title postings are scored
+		index = self.title_index if title_only else self.inverted_index
 		for filtered, original in filtered_map:
-			if filtered not in self.inverted_index:
+			postings = index.get(filtered)
+			if postings is None:
 				self._debug(f"Word '{filtered}' not found in index")
 				continue
 
-			# For title_only search, only consider documents where the word appears in title
-			docs_with_word = []
-			if title_only:
-				docs_with_word = [
-					(doc_id, freq)
-					for doc_id, freq in self.inverted_index[filtered]
-					if doc_id in self.title_words
-					and filtered in set(w.lower() for w in self.title_words[doc_id])
-				]
-			else:
-				docs_with_word = self.inverted_index[filtered]
-
-			num_docs_with_word = len(docs_with_word)
+			docs, freqs = postings.docs, postings.freqs
+			num_docs_with_word = len(docs)
+			self.metrics.count("postings", num_docs_with_word)
 			if num_docs_with_word == 0:
 				continue
 
@@ -387,32 +1277,61 @@ class FullTextSearch:
 			self._debug(f"\nWord: '{filtered}'")
 			self._debug(f"Found in {num_docs_with_word} documents")
 			self._debug(f"IDF score: {idf:.4f}")
+			terms.append((filtered, original, docs, freqs, idf))
 
-			for doc_id, freq in docs_with_word:
-				doc_len = self.doc_lengths[doc_id]
-				tf = freq
-				score = idf * ((tf * (k1 + 1)) / (tf + k1 * (1 - b + b * (doc_len / self.avg_doc_length))))
-				doc_scores[doc_id] += score
-				self.matched_words[doc_id].add(filtered)
-				self.matched_word_variations[doc_id].update([filtered, original])
+		return terms
 
-				# Store positions for proximity scoring
-				if doc_id in self.word_positions.get(filtered, {}):
-					self.matched_positions[doc_id][filtered] = self.word_positions[filtered][doc_id]
+	def _bm25_score(self, query_words, title_only=False):
+		"""Calculate BM25 scores for documents given the query words."""
+		doc_scores = defaultdict(float)
+		self.matched_words.clear()  # Reset matched words for new search
+		self.matched_word_variations.clear()  # Reset variations
+		self.score_components = defaultdict(lambda: {"bm25": 0})
 
-				self.score_components[doc_id]["bm25"] += score
+		for filtered, original, docs, freqs, idf in self._get_query_terms(query_words, title_only):
+			for doc, score in zip(docs, self._term_scores(idf, docs, freqs, title_only), strict=True):
+				doc_scores[doc] += score
+				self.matched_words[doc].add(filtered)
+				self.matched_word_variations[doc].update([filtered, original])
+				self.score_components[doc]["bm25"] += score
 
 		return doc_scores
 
-	def _boost_proximity(self, doc_scores, query_words):
-		"""Apply boost based on proximity of query terms in documents."""
-		self._debug("\nApplying proximity boost:")
+	def _get_length_norms(self, title_only=False):
+		"""Per-document field lengths and their average, for the field that is scored."""
+		if title_only:
+			return self.title_lengths, self.avg_title_length
+		return self.doc_lengths, self.avg_doc_length
+
+	def _term_scores(self, idf, docs, freqs, title_only=False, k1=1.2, b=0.75):
+		"""BM25 score of one term for each of its postings, computed over the posting arrays."""
+		doc_lengths, avg_doc_length = self._get_length_norms(title_only)
+		if numpy is not None:
+			tf = numpy.frombuffer(freqs, dtype=numpy.uintc).astype(float)
+			doc_len = numpy.frombuffer(doc_lengths, dtype=numpy.uintc)[
+				numpy.frombuffer(docs, dtype=numpy.uintc)
+			]
+			return (idf * ((tf * (k1 + 1)) / (tf + k1 * (1 - b + b * (doc_len / avg_doc_length))))).tolist()
+
+		return [
+			idf * ((tf * (k1 + 1)) / (tf + k1 * (1 - b + b * (doc_lengths[doc] / avg_doc_length))))
+			for doc, tf in zip(docs, freqs, strict=True)
+		]
+
+	def _get_proximity_words(self, query_words):
 		# Filter out stop words but keep track of original words
 		filtered_words = [w.lower() for w in query_words if w.lower() not in self.stop_words]
 
 		if not filtered_words:
 			filtered_words = [w.lower() for w in query_words]
 
+		return filtered_words
+
+	def _boost_proximity(self, doc_scores, query_words):
+		"""Apply boost based on proximity of query terms in documents."""
+		self._debug("\nApplying proximity boost:")
+		filtered_words = self._get_proximity_words(query_words)
+
 		if len(filtered_words) < 2:
 			self._debug("Skipping proximity boost for single-word query")
 			return doc_scores
@@ -428,266 +1347,589 @@ class FullTextSearch:
 			)
 		return boosted_scores
 
+	def _get_recency_boost(self, timestamp, alpha=0.005):
+		age = self.current_time - timestamp
+		return 1 / (1 + alpha * age)  # The more recent, the higher the boost
+
 	def _boost_recency(self, doc_scores, alpha=0.001):
 		"""Boost scores based on recency (documents with newer timestamps get a slight boost)."""
 		self._debug("\nApplying recency boost:")
-		alpha = 0.005
 		boosted_scores = {}
 		for doc_id, score in doc_scores.items():
-			age = self.current_time - self.doc_timestamps.get(doc_id, 0)
-			recency_boost = 1 / (1 + alpha * age)  # The more recent, the higher the boost
+			recency_boost = self._get_recency_boost(self.doc_timestamps[doc_id])
 			boosted_scores[doc_id] = score * recency_boost
 			self.score_components[doc_id]["recency_boost"] = recency_boost
-			self._debug(f"Doc {doc_id}: age={age / 86400:.1f} days")
+			self._debug(
+				f"Doc {doc_id}: age={(self.current_time - self.doc_timestamps[doc_id]) / 86400:.1f} days"
+			)
 			self._debug(f"  Score: {score:.4f} -> {boosted_scores[doc_id]:.4f} (boost={recency_boost:.3f}x)")
 		return boosted_scores
 
-	def _boost_title_matches(self, query_words, doc_scores):
-		"""Apply additional boost for documents with exact or partial title matches"""
-		self._debug("\nApplying title boost:")
+	def _get_title_query_words(self, query_words):
 		# Use non-stop words for title matching
 		filtered_words = [w for w in query_words if w not in self.stop_words]
 		if not filtered_words:
 			filtered_words = query_words
+		return filtered_words
 
-		for doc_id in doc_scores:
-			if doc_id in self.title_words:
-				title_words = self.title_words[doc_id]
-
-				# Calculate what portion of query matches the title
-				matching_words = sum(1 for qw in filtered_words if qw in title_words)
-				if matching_words > 0:
-					match_ratio = matching_words / len(filtered_words)
-					# Apply exponential boost for better title matches
-					title_boost = 1 + (match_ratio**2) * 2
-					old_score = doc_scores[doc_id]
-					doc_scores[doc_id] *= title_boost
-					self.score_components[doc_id]["title_boost"] = title_boost
-					self._debug(
-						f"""Doc {doc_id} ({title_words}): """
-						"""{matching_words}/{len(filtered_words)} words match title"""
-					)
-					self._debug(
-						f"  Score: {old_score:.4f} -> {doc_scores[doc_id]:.4f} (boost={title_boost:.2f}x)"
-					)
+	def _get_title_boost(self, doc, filtered_words):
+		"""Boost for the portion of `filtered_words` found in the title, or None if none of them are."""
+		if doc not in self.title_words:
+			return None
 
-		return doc_scores
+		# Calculate what portion of query matches the title
+		title_words = self.title_words[doc]
+		matching_words = sum(1 for qw in filtered_words if qw in title_words)
+		if matching_words == 0:
+			return None
 
-	def _highlight_text(self, text, doc_id):
-		"""Wrap matching words in <mark> tags, but only those that contributed to scoring"""
-		if doc_id not in self.matched_word_variations:
-			return text
-
-		text_words = re.findall(r"[\w]+|[^\w]+", text)  # Split keeping separators
-		result = []
-		matched_variations = self.matched_word_variations[doc_id]
-
-		for word in text_words:
-			if word.lower() in matched_variations:
-				result.append(f"<mark>{word}</mark>")
-			else:
-				result.append(word)
-		return "".join(result)
-
-	def _create_preview(self, text, doc_id, context_chars=50):
-		"""Create a preview of text showing context around matched words with highlighting"""
-		if doc_id not in self.matched_word_variations:
-			preview = " ".join(text.split()[:10])
-			return preview + "..." if len(text.split()) > 10 else preview
-
-		text = text.replace("\n", " ")
-		words = text.split(" ")
-		matches = []
-		matched_variations = self.matched_word_variations[doc_id]
-
-		# Find all occurrences of matched words
-		for i, word in enumerate(words):
-			if word.lower() in matched_variations:
-				start = max(0, i - 5)
-				end = min(len(words), i + 6)
-				matches.append((start, end, i))
-
-		if not matches:
-			# If no matches, return first few words
-			preview = " ".join(words[:10])
-			return preview + "..." if len(words) > 10 else preview
-
-		# Merge overlapping ranges
-		matches.sort()
-		merged = []
-		current_start, current_end, _ = matches[0]
-
-		for start, end, _ in matches[1:]:
-			if start <= current_end:
-				current_end = max(current_end, end)
-			else:
-				merged.append((current_start, current_end))
-				current_start, current_end = start, end
-
-		merged.append((current_start, current_end))
-
-		# Create preview text with highlighting
-		preview = []
-		for start, end in merged:
-			snippet = []
-			for i in range(start, end):
-				word = words[i]
-				if any(qw in word.lower() for qw in matched_variations):
-					snippet.append(f"<mark>{word}</mark>")
-				else:
-					snippet.append(word)
-			preview.append(" ".join(snippet))
+		match_ratio = matching_words / len(filtered_words)
+		# Apply exponential boost for better title matches
+		return 1 + (match_ratio**2) * 2
 
-		return "..." + "...".join(preview) + "..."
+	def _boost_title_matches(self, query_words, doc_scores):
+		"""Apply additional boost for documents with exact or partial title matches"""
+		self._debug("\nApplying title boost:")
+		filtered_words = self._get_title_query_words(query_words)
 
-	def search(self, query, title_only=False):
-		"""Main search function with improved title matching and content highlighting."""
-		start_time = time.time()
-		self._debug(f"\n=== Search Query: '{query}' (title_only: {title_only}) ===")
-		self._load_index_from_redis()
+		for doc_id in doc_scores:
+			title_boost = self._get_title_boost(doc_id, filtered_words)
+			if title_boost:
+				old_score = doc_scores[doc_id]
+				doc_scores[doc_id] *= title_boost
+				self.score_components[doc_id]["title_boost"] = title_boost
+				self._debug(f"Doc {doc_id} ({self.title_words[doc_id]}): title boost {title_boost:.2f}x")
+				self._debug(
+					f"  Score: {old_score:.4f} -> {doc_scores[doc_id]:.4f} (boost={title_boost:.2f}x)"
+				)
 
-		query_words = re.findall(r"\w+", query.lower())
-		self._debug(f"Query words: {query_words}")
+		return doc_scores
 
-		corrected_query_words = []
-		self._debug("\nFuzzy matching:")
-		for word in query_words:
-			matches = self._find_fuzzy_matches(word)
-			corrected = matches[0][0] if matches else word
-			corrected_query_words.append(corrected)
-			if corrected != word:
-				self._debug(f"Corrected '{word}' to '{corrected}'")
+	def _rank_exhaustive(
+		self, corrected_query_words, query_words, title_only=False, documents=None, allowed_projects=None
+	):
+		"""Score every matching document with each boost applied as a separate pass.
 
+		Slower than `_rank_top_k`, but logs the intermediate scores, so it is used in verbose mode.
+		Returns the ranked (document, score) pairs and the number of matching documents. If
+		`documents` is given, only those documents are matched, and if `allowed_projects` is given,
+		only documents in the projects it flags.
+		"""
 		# Calculate base BM25 scores
-		doc_scores = self._bm25_score(corrected_query_words, title_only)
+		with self.metrics.phase("bm25"):
+			doc_scores = self._bm25_score(corrected_query_words, title_only)
+		self.metrics.count("candidates", len(doc_scores))
+		if documents is not None:
+			doc_scores = {doc: score for doc, score in doc_scores.items() if doc in documents}
+		if allowed_projects is not None:
+			doc_projects = self.doc_projects
+			doc_scores = {
+				doc: score for doc, score in doc_scores.items() if allowed_projects[doc_projects[doc]]
+			}
 		self._debug("\nInitial BM25 scores:")
-		for doc_id, score in sorted(doc_scores.items(), key=lambda x: x[1], reverse=True)[:3]:
-			title = self.doc_contents[doc_id]["title"]
-			content = self.doc_contents[doc_id]["content"]
-			self._debug(f"Doc {doc_id}: {score:.4f}")
-			self._debug(f"  Title: {title[:50]}")
-			self._debug(f"  Content: {content[:100]}")
+		self._debug_top_scores(doc_scores)
 
 		# Apply proximity boost as a separate step
-		doc_scores = self._boost_proximity(doc_scores, corrected_query_words)
+		with self.metrics.phase("proximity"):
+			doc_scores = self._boost_proximity(doc_scores, corrected_query_words)
 		self._debug("\nScores after proximity boost:")
-		for doc_id, score in sorted(doc_scores.items(), key=lambda x: x[1], reverse=True)[:3]:
-			title = self.doc_contents[doc_id]["title"]
-			content = self.doc_contents[doc_id]["content"]
-			self._debug(f"Doc {doc_id}: {score:.4f}")
-			self._debug(f"  Title: {title[:50]}")
-			self._debug(f"  Content: {content[:100]}")
-
-		doc_scores = self._boost_title_matches(query_words, doc_scores)
-		final_scores = self._boost_recency(doc_scores)
-		total_matches = len(final_scores)
+		self._debug_top_scores(doc_scores)
+
+		with self.metrics.phase("title_boost"):
+			doc_scores = self._boost_title_matches(query_words, doc_scores)
+		with self.metrics.phase("recency"):
+			final_scores = self._boost_recency(doc_scores)
+		self.metrics.count("scored", len(final_scores))
+		ranked = sorted(final_scores.items(), key=lambda x: (-x[1], x[0]))[: self.max_results]
+		return ranked, len(final_scores)
+
+	def _debug_top_scores(self, doc_scores):
+		if not self.verbose:
+			return
 
-		self._debug("\nSearch results summary:")
-		results = []
-		for doc_id, score in sorted(final_scores.items(), key=lambda x: x[1], reverse=True)[
-			: self.max_results
-		]:
-			if doc_id in self.doc_contents:
-				doc_content = self.doc_contents[doc_id]
-				components = self.score_components[doc_id]
-				self._debug(
-					f"Doc {doc_id}: {doc_content['title'][:50]}\n"
-					f"  Final score: {score:.4f}\n"
-					f"  BM25 score: {components['bm25']:.4f}\n"
-					f"  Proximity boost: {components.get('proximity', 1.0):.2f}x\n"
-					f"  Title boost: {components.get('title_boost', 1.0):.2f}x\n"
-					f"  Recency boost: {components.get('recency_boost', 1.0):.3f}x\n"
-					f"  Matched words: {sorted(self.matched_words[doc_id])}\n"
-					f"  Word variations: {sorted(self.matched_word_variations[doc_id])}\n"
+		top_scores = sorted(doc_scores.items(), key=lambda x: x[1], reverse=True)[:3]
+		doc_ids = [self.doc_ids[doc] for doc, _score in top_scores]
+		for (_doc, score), doc_id, contents in zip(
+			top_scores, doc_ids, self._get_contents(doc_ids), strict=True
+		):
+			self._debug(f"Doc {doc_id}: {score:.4f}")
+			if contents:
+				self._debug(f"  Title: {contents['title'][:50]}")
+				self._debug(f"  Content: {contents['content'][:100]}")
+
+	def _rank_top_k(
+		self,
+		corrected_query_words,
+		query_words,
+		title_only=False,
+		documents=None,
+		allowed_projects=None,
+		count_matches=False,
+		k1=1.2,
+		b=0.75,
+	):
+		"""Return the `max_results` best (document, score) pairs and the number of matching documents.
+
+		Produces the same ranking as `_rank_exhaustive` without scoring every matching document.
+		Documents are visited in document order using MaxScore pruning: query terms are ordered by
+		the highest score they can contribute, and terms that cannot lift a document into the
+		current top results on their own are only probed for documents that are still competitive.
+		The proximity, title and recency boosts are folded into the bounds, so proximity is only
+		computed for documents that can still make it into the results. Ties are broken by document
+		number. If `documents` is given, only those documents are matched, and if `allowed_projects`
+		is given, only documents in the projects it flags.
+
+		Counting the matching documents visits every posting of every term, so unless `count_matches`
+		is set, an estimate is returned instead: the length of the longest posting list, scaled down to
+		the share of the documents that are in the allowed projects, and at most the number of them.
+
+		The time spent on the boosts is measured separately from the BM25 scoring they are
+		interleaved with.
+		"""
+		start_time = time.perf_counter()
+		boost_times = {"proximity": 0.0, "title_boost": 0.0, "recency": 0.0}
+		candidates, scored = 0, 0
+		self.matched_words.clear()
+		self.matched_word_variations.clear()
+		self.score_components = defaultdict(lambda: {"bm25": 0})
+		k = self.max_results
+		terms = self._get_query_terms(corrected_query_words, title_only)
+		if not terms:
+			return [], 0
+
+		doc_projects = self.doc_projects
+		if count_matches:
+			matches = set().union(*(docs for _word, _original, docs, _freqs, _idf in terms))
+			if documents is not None:
+				matches &= documents
+			if allowed_projects is not None:
+				matches = {doc for doc in matches if allowed_projects[doc_projects[doc]]}
+			total_matches = len(matches)
+		else:
+			total_matches = max(len(docs) for _word, _original, docs, _freqs, _idf in terms)
+			if allowed_projects is not None:
+				# Matches are assumed to be spread over the projects like all documents are
+				allowed = sum(
+					count for project, count in self.project_doc_counts.items() if allowed_projects[project]
 				)
-				result = {
-					"id": doc_id,
-					"title": self._highlight_text(doc_content["title"], doc_id),
-					"score": score,
-					"timestamp": self.doc_timestamps[doc_id],
-				}
-				if not title_only:
-					result["content"] = self._create_preview(doc_content["content"], doc_id)
-				results.append(result)
-
-		duration = time.time() - start_time
-		corrected_words = (
-			dict(zip(query_words, corrected_query_words, strict=True))
-			if any(w != c for w, c in zip(query_words, corrected_query_words, strict=True))
-			else None
+				total_matches = min(round(total_matches * allowed / max(self.document_count, 1)), allowed)
+			if documents is not None:
+				total_matches = min(total_matches, len(documents))
+		if k <= 0:
+			return [], total_matches
+
+		doc_lengths, avg_doc_length = self._get_length_norms(title_only)
+		term_docs = [docs for _word, _original, docs, _freqs, _idf in terms]
+		term_freqs = [freqs for _word, _original, _docs, freqs, _idf in terms]
+		idfs = [idf for _word, _original, _docs, _freqs, idf in terms]
+
+		# Highest BM25 score each term can contribute, reached by its largest term frequency
+		upper_bounds = []
+		for freqs, idf in zip(term_freqs, idfs, strict=True):
+			tf = max(freqs)
+			upper_bounds.append(idf * ((tf * (k1 + 1)) / (tf + k1 * (1 - b))))
+
+		# Terms sorted by bound, with the combined bound of each prefix of that order
+		order = sorted(range(len(terms)), key=lambda i: upper_bounds[i])
+		prefix_bounds = []
+		for i in order:
+			prefix_bounds.append((prefix_bounds[-1] if prefix_bounds else 0.0) + upper_bounds[i])
+
+		proximity_words = self._get_proximity_words(corrected_query_words)
+		title_query_words = self._get_title_query_words(query_words)
+		proximity_ceiling = 1.0 + 0.25 * math.log(11.0) if len(proximity_words) >= 2 else 1.0
+		max_multiplier = (
+			proximity_ceiling
+			* (3.0 if title_query_words else 1.0)
+			* self._get_recency_boost(self.max_timestamp)
 		)
-		summary = {
-			"duration": round(duration, 3),
-			"total_matches": total_matches,
-			"returned_matches": len(results),
-			"corrected_words": corrected_words,
-			"title_only": title_only,
-		}
 
-		self._debug(f"\nReturning top {len(results)} results out of {len(final_scores)} matches")
-		return {"results": results, "summary": summary}
+		heap = []
+		threshold = 0.0
+		# Terms in order[:essential] can't make a document competitive without an essential term
+		essential = 0
+		cursors = [0] * len(terms)
+
+		while True:
+			doc = None
+			for i in order[essential:]:
+				c = cursors[i]
+				if c < len(term_docs[i]) and (doc is None or term_docs[i][c] < doc):
+					doc = term_docs[i][c]
+			if doc is None:
+				break
+
+			term_scores = [None] * len(terms)
+			partial = 0.0
+			for i in order[essential:]:
+				c = cursors[i]
+				if c < len(term_docs[i]) and term_docs[i][c] == doc:
+					tf = term_freqs[i][c]
+					term_scores[i] = idfs[i] * (
+						(tf * (k1 + 1)) / (tf + k1 * (1 - b + b * (doc_lengths[doc] / avg_doc_length)))
+					)
+					partial += term_scores[i]
+					cursors[i] = c + 1
 
-	def index_document(self, document):
-		"""Add a single document to the index."""
-		self._load_index_from_redis()
-		doc_id = document["id"]
+			candidates += 1
+			if documents is not None and doc not in documents:
+				continue
+			if allowed_projects is not None and not allowed_projects[doc_projects[doc]]:
+				continue
+
+			boost_start = time.perf_counter()
+			title_boost = self._get_title_boost(doc, title_query_words)
+			title_end = time.perf_counter()
+			recency_boost = self._get_recency_boost(self.doc_timestamps[doc])
+			boost_times["title_boost"] += title_end - boost_start
+			boost_times["recency"] += time.perf_counter() - title_end
+			multiplier = proximity_ceiling * (title_boost or 1.0) * recency_boost
+			full = len(heap) == k
+
+			competitive = True
+			for j in range(essential - 1, -1, -1):
+				if full and (partial + prefix_bounds[j]) * multiplier * SCORE_BOUND_TOLERANCE <= threshold:
+					competitive = False
+					break
+				i = order[j]
+				c = cursors[i] = bisect_left(term_docs[i], doc, cursors[i])
+				if c < len(term_docs[i]) and term_docs[i][c] == doc:
+					tf = term_freqs[i][c]
+					term_scores[i] = idfs[i] * (
+						(tf * (k1 + 1)) / (tf + k1 * (1 - b + b * (doc_lengths[doc] / avg_doc_length)))
+					)
+					partial += term_scores[i]
+
+			if not competitive or (full and partial * multiplier * SCORE_BOUND_TOLERANCE <= threshold):
+				continue
+
+			# Combine the scores in the same order as the exhaustive passes, so both rank identically
+			scored += 1
+			score = 0.0
+			for term_score in term_scores:
+				if term_score is not None:
+					score += term_score
+			if len(proximity_words) >= 2:
+				boost_start = time.perf_counter()
+				score *= self._calculate_proximity_score(doc, proximity_words)
+				boost_times["proximity"] += time.perf_counter() - boost_start
+			if title_boost:
+				score *= title_boost
+			score *= recency_boost
+
+			entry = (score, -doc)
+			if not full:
+				heapq.heappush(heap, entry)
+			elif entry > heap[0]:
+				heapq.heapreplace(heap, entry)
+			else:
+				continue
+
+			if len(heap) == k:
+				threshold = heap[0][0]
+				while (
+					essential < len(order)
+					and prefix_bounds[essential] * max_multiplier * SCORE_BOUND_TOLERANCE <= threshold
+				):
+					essential += 1
+
+		ranked = [(-negative_doc, score) for score, negative_doc in sorted(heap, reverse=True)]
+
+		# Matched words are only needed to highlight the returned documents
+		for doc, _score in ranked:
+			for (filtered, original, _docs, _freqs, _idf), docs in zip(terms, term_docs, strict=True):
+				i = bisect_left(docs, doc)
+				if i < len(docs) and docs[i] == doc:
+					self.matched_words[doc].add(filtered)
+					self.matched_word_variations[doc].update([filtered, original])
+
+		for name, seconds in boost_times.items():
+			self.metrics.add_time(name, seconds)
+		self.metrics.add_time("bm25", time.perf_counter() - start_time - sum(boost_times.values()))
+		self.metrics.count("candidates", candidates)
+		self.metrics.count("scored", scored)
+		return ranked, total_matches
+
+	def _get_matched_positions(self, doc):
+		"""Sorted title and content positions of the words that matched in the document."""
+		title_positions, content_positions = set(), set()
+		for word in self.matched_words.get(doc, ()):
+			positions = self._get_positions(word, doc)
+			if positions:
+				title_positions.update(positions[0])
+				content_positions.update(positions[1])
+		return sorted(title_positions), sorted(content_positions)
+
+	def _get_word_end(self, text, offsets, position):
+		return WORD_PATTERN.match(text, offsets[position]).end()
+
+	def _get_snippet_end(self, text, offsets, position):
+		"""End of a snippet whose last word is at `position`, after the punctuation that follows it."""
+		return TRAILING_PUNCTUATION_PATTERN.match(text, self._get_word_end(text, offsets, position)).end()
+
+	def _mark_words(self, text, offsets, positions, start, end):
+		"""Text from word `start` up to word `end`, with the words at `positions` in <mark> tags."""
+		parts = []
+		cursor = offsets[start]
+		for position in positions:
+			if start <= position < end:
+				word_end = self._get_word_end(text, offsets, position)
+				parts.append(text[cursor : offsets[position]])
+				parts.append(f"<mark>{text[offsets[position] : word_end]}</mark>")
+				cursor = word_end
+		parts.append(text[cursor : self._get_snippet_end(text, offsets, end - 1)])
+		return "".join(parts)
+
+	def _highlight_text(self, text, offsets, positions):
+		"""Wrap the words at the matched `positions` in <mark> tags"""
+		offsets = _delta_decode(offsets)
+		# Contents can be newer than the loaded postings while an update is being applied
+		positions = [position for position in positions if position < len(offsets)]
+		if not positions:
+			return text
 
-		# Use helper method to process document content
-		word_freq, word_positions, total_words = self._process_document_content(
-			doc_id, document["title"], document["content"], document["timestamp"]
+		return (
+			text[: offsets[0]]
+			+ self._mark_words(text, offsets, positions, 0, len(offsets))
+			+ text[self._get_snippet_end(text, offsets, len(offsets) - 1) :]
 		)
 
-		# Update inverted index
-		for word, freqs in word_freq.items():
-			total_freq = freqs["title"] * 3 + freqs["content"]
-			if word in self.inverted_index:
-				self.inverted_index[word] = [(d, f) for d, f in self.inverted_index[word] if d != doc_id]
-			self.inverted_index[word].append((doc_id, total_freq))
-			# Update word positions
-			self.word_positions[word][doc_id] = word_positions[word]
+	def _create_preview(self, text, offsets, positions, context_words=5):
+		"""Create a preview of text showing context around matched words with highlighting.
 
-		# Update document count and average length
-		self.document_count = len(self.doc_lengths)
-		self.avg_doc_length = sum(self.doc_lengths.values()) / self.document_count
+		Snippets are cut out of the text using the stored word offsets, so the text isn't split.
+		"""
+		offsets = _delta_decode(offsets)
+		positions = [position for position in positions if position < len(offsets)]
+		if not positions:
+			# If no matches, return first few words
+			if len(offsets) > 10:
+				return text[: offsets[10]].rstrip() + "..."
+			return text
 
-		self._save_index_to_redis()
+		# Merge overlapping ranges around the matched words
+		merged = []
+		for position in positions:
+			start = max(0, position - context_words)
+			end = min(len(offsets), position + context_words + 1)
+			if merged and start <= merged[-1][1]:
+				merged[-1][1] = max(merged[-1][1], end)
+			else:
+				merged.append([start, end])
 
-	def remove_document(self, doc_id):
-		"""Remove a document from the index."""
-		self._load_index_from_redis()
+		preview = [self._mark_words(text, offsets, positions, start, end) for start, end in merged]
+		return "..." + "...".join(preview) + "..."
 
-		if doc_id not in self.doc_lengths:
-			return
+	def search(self, query, title_only=False, projects=None, metrics=None, count_matches=False):
+		"""Main search function with improved title matching and content highlighting.
+
+		If `projects` is given, only documents in those projects are matched. The time spent in each
+		phase is added to `metrics` and returned in the summary, along with counts of the postings
+		and documents that were looked at. The total number of matches in the summary is an estimate
+		unless `count_matches` is set, see `_rank_top_k`.
+		"""
+		start_time = time.time()
+		self.metrics = metrics or SearchMetrics()
+		self._debug(f"\n=== Search Query: '{query}' (title_only: {title_only}) ===")
+		with self.metrics.phase("load"):
+			self._load_index_from_redis()
+
+		# Scoring and building snippets only read the cached index, so searches don't wait for each other
+		with _index_lock.shared():
+			self._read_cached_state()
+
+			query_words, constraints = self._parse_query(query)
+			self._debug(f"Query words: {query_words}")
+			documents = None
+			if constraints:
+				with self.metrics.phase("constraints"):
+					documents = self._get_constrained_documents(constraints, title_only)
+			allowed_projects = None
+			if projects is not None:
+				with self.metrics.phase("permissions"):
+					allowed_projects = self._get_project_filter(projects)
+
+			self._debug("\nFuzzy matching:")
+			with self.metrics.phase("fuzzy"):
+				corrected_query_words = self._correct_query_words(query_words)
+
+			if self.verbose:
+				ranked, total_matches = self._rank_exhaustive(
+					corrected_query_words, query_words, title_only, documents, allowed_projects
+				)
+			else:
+				ranked, total_matches = self._rank_top_k(
+					corrected_query_words,
+					query_words,
+					title_only,
+					documents,
+					allowed_projects,
+					count_matches=count_matches,
+				)
+
+			self._debug("\nSearch results summary:")
+			snippets_start = time.perf_counter()
+			results = []
+			doc_ids = [self.doc_ids[doc] for doc, _score in ranked]
+			for (doc, score), doc_id, doc_content in zip(
+				ranked, doc_ids, self._get_contents(doc_ids), strict=True
+			):
+				if doc_content:
+					components = self.score_components[doc]
+					self._debug(
+						f"Doc {doc_id}: {doc_content['title'][:50]}\n"
+						f"  Final score: {score:.4f}\n"
+						f"  BM25 score: {components['bm25']:.4f}\n"
+						f"  Proximity boost: {components.get('proximity', 1.0):.2f}x\n"
+						f"  Title boost: {components.get('title_boost', 1.0):.2f}x\n"
+						f"  Recency boost: {components.get('recency_boost', 1.0):.3f}x\n"
+						f"  Matched words: {sorted(self.matched_words[doc])}\n"
+						f"  Word variations: {sorted(self.matched_word_variations[doc])}\n"
+					)
+					offsets = doc_content["offsets"]
+					title_positions, content_positions = self._get_matched_positions(doc)
+					result = {
+						"id": doc_id,
+						"title": self._highlight_text(
+							doc_content["title"], offsets["title"], title_positions
+						),
+						"score": score,
+						"timestamp": self.doc_timestamps[doc],
+						"attributes": doc_content["attributes"],
+					}
+					if not title_only:
+						result["content"] = self._create_preview(
+							doc_content["content"], offsets["content"], content_positions
+						)
+					results.append(result)
+			self.metrics.add_time("snippets", time.perf_counter() - snippets_start)
+			self.metrics.count("matches", total_matches)
+
+			duration = time.time() - start_time
+			corrected_words = (
+				dict(zip(query_words, corrected_query_words, strict=True))
+				if any(w != c for w, c in zip(query_words, corrected_query_words, strict=True))
+				else None
+			)
+			summary = {
+				"duration": round(duration, 3),
+				"total_matches": total_matches,
+				"total_matches_estimated": not (self.verbose or count_matches),
+				"returned_matches": len(results),
+				"corrected_words": corrected_words,
+				"title_only": title_only,
+				**self.metrics.as_dict(),
+			}
+
+			self._debug(f"\nReturning top {len(results)} results out of {total_matches} matches")
+			return {"results": results, "summary": summary}
+
+	def index_document(self, document):
+		"""Add or replace a single document.
+
+		The processed document is appended to the change log, so concurrent updates never overwrite
+		each other and the cost of an update is proportional to the size of the document rather
+		than the size of the index. Readers apply new log entries when they load the index, and
+		`compact_change_log` folds them into a new snapshot.
+		"""
+		contents, record = self._process_document_content(
+			document["title"], document["content"], document["timestamp"], document.get("attributes")
+		)
+		self._log_change(document["id"], "index", record=json.dumps(record), contents=json.dumps(contents))
 
-		# Remove from doc_timestamps and doc_contents
-		self.doc_timestamps.pop(doc_id, None)
-		self.doc_contents.pop(doc_id, None)
+	def remove_document(self, doc_id):
+		"""Remove a document from the index by appending a removal to the change log."""
+		self._log_change(doc_id, "remove")
 
-		# Remove from title_words
-		self.title_words.pop(doc_id, None)
+	def _log_change(self, doc_id, op, **payload):
+		self.redis.xadd(self._key("log"), {"doc_id": doc_id, "op": op, **payload})
+		if self._index_loaded:
+			self._apply_change_log()
 
-		# Remove document from inverted index
-		for word in list(self.inverted_index.keys()):
-			self.inverted_index[word] = [(d, f) for d, f in self.inverted_index[word] if d != doc_id]
-			if not self.inverted_index[word]:
-				del self.inverted_index[word]
+	def document_ids(self):
+		"""Yield the ids of all documents in the index, including those in the change log."""
+		self._index_loaded = False
+		self._load_index_from_redis()
+		yield from self.doc_numbers.keys()
 
-		# Remove from word_positions
-		for word in list(self.word_positions.keys()):
-			if doc_id in self.word_positions[word]:
-				del self.word_positions[word][doc_id]
-			if not self.word_positions[word]:
-				del self.word_positions[word]
+	def count_documents(self, prefix):
+		"""Number of documents in the index, including those in the change log, whose ids start with
+		`prefix`.
 
-		# Remove from doc_lengths
-		self.doc_lengths.pop(doc_id, None)
+		Documents of the snapshot are counted from its ids sorted by id, so only the documents changed
+		since are gone through.
+		"""
+		self._index_loaded = False
+		self._load_index_from_redis()
+		with _index_lock.shared():
+			doc_numbers = self.doc_numbers
+			if not isinstance(doc_numbers, OverlayMapping):
+				return sum(1 for doc_id in doc_numbers if doc_id.startswith(prefix))
+
+			base = doc_numbers.base
+			count = base.count_prefix(prefix)
+			count -= sum(
+				1
+				for doc_id in doc_numbers.deleted
+				if doc_id.startswith(prefix) and base.get(doc_id) is not None
+			)
+			count += sum(
+				1 for doc_id in doc_numbers.changed if doc_id.startswith(prefix) and base.get(doc_id) is None
+			)
+			return count
 
-		# Update document count and average length
-		self.document_count = len(self.doc_lengths)
-		if self.document_count > 0:
-			total_length = sum(self.doc_lengths.values())
-			self.avg_doc_length = total_length / self.document_count
-		else:
-			self.avg_doc_length = 0
+	def get_documents(self, doc_ids):
+		"""Stored title, content, attributes and timestamp of the given documents that are indexed."""
+		self._load_index_from_redis()
+		numbers = [self.doc_numbers.get(doc_id) for doc_id in doc_ids]
+		documents = {}
+		for doc_id, number, contents in zip(doc_ids, numbers, self._get_raw_contents(numbers), strict=True):
+			if contents:
+				contents = json.loads(contents)
+				documents[doc_id] = {
+					"title": contents["title"],
+					"content": contents["content"],
+					"attributes": contents["attributes"],
+					"timestamp": self.doc_timestamps[number],
+				}
+		return documents
+
+	def pending_updates(self):
+		"""Number of entries in the change log that haven't been compacted yet."""
+		return self.redis.xlen(self._key("log"))
+
+	def compact_change_log(self):
+		"""Fold the change log into a new snapshot.
+
+		Only one compaction runs at a time. The current snapshot is loaded with the change log
+		applied and written out again; postings that didn't change are copied from the mapped file.
+		Entries are removed from the log once the snapshot they were folded into is published, and
+		entries logged while the compaction runs are left for readers and the next compaction.
+		"""
+		lock = self.redis.lock(self._key("merge_lock"), timeout=600)
+		if not lock.acquire(blocking=False):
+			return
 
-		self._save_index_to_redis()
+		try:
+			self._index_loaded = False
+			self._load_index_from_redis()
+
+			def get_contents():
+				for numbers in self._batched(range(len(self.doc_ids)), WRITE_BATCH_SIZE):
+					for contents in self._get_raw_contents(numbers):
+						yield contents or b""
+
+			# Other threads wait to apply entries until the snapshot is written, so none are left out
+			with _index_lock.shared():
+				self._read_cached_state()
+				if self.log_position == self._get_snapshot_log_position():
+					# nothing to compact
+					return
+				version = self._write_snapshot(get_contents(), previous=self.snapshot)
+			self._publish_snapshot(version)
+			self._index_loaded = False
+		finally:
+			lock.release()
+
+	def _get_snapshot_log_position(self):
+		return self.snapshot.meta["log_position"] if self.snapshot is not None else LOG_START
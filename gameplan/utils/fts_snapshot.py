@@ -0,0 +1,241 @@
+# Copyright (c) 2025, Frappe Technologies Pvt. Ltd. and Contributors
+# MIT License. See license.txt
+
+"""Read-only snapshot files for the full text search index.
+
+A snapshot is a sequence of sections followed by a JSON footer that records where each section
+starts, how long it is and how its items are typed. Sections are either flat arrays or string
+tables, which are a blob of strings stored back to back with an array of offsets into it.
+
+Snapshots are memory-mapped and their sections are used as memoryviews, so opening one doesn't
+read it into memory and the pages are shared by all worker processes that map the same file.
+"""
+
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from collections.abc import MutableMapping, Sequence
+
+SNAPSHOT_MAGIC = b"GPFTSIDX"
+SNAPSHOT_FORMAT = 1
+
+# Length of the JSON footer followed by the magic bytes
+TRAILER = struct.Struct("<Q8s")
+
+# Sections are aligned so that they can be cast to arrays of any item size
+SECTION_ALIGNMENT = 8
+
+
+class SnapshotWriter:
+	"""Write a snapshot to a temporary file and move it into place once it is complete.
+
+	Sections are written in the order they are added, so string tables can be streamed from
+	generators without holding them in memory.
+	"""
+
+	def __init__(self, path):
+		self.path = path
+		self.sections = {}
+		self.meta = {}
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		self.file = open(f"{path}.tmp", "wb")
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		if exc_type is None:
+			self.close()
+		else:
+			self.file.close()
+			os.remove(f"{self.path}.tmp")
+
+	def add_array(self, name, values):
+		"""Add a section holding `values`, an array or a memoryview cast to the item type."""
+		values = memoryview(values)
+		self._align()
+		self.sections[name] = [self.file.tell(), values.nbytes, values.format]
+		self.file.write(values)
+
+	def add_strings(self, name, values):
+		"""Add a string table holding each of the bytes-like `values`."""
+		offsets = array("Q", [0])
+		self._align()
+		start = self.file.tell()
+		for value in values:
+			self.file.write(value)
+			offsets.append(offsets[-1] + len(value))
+		self.sections[name] = [start, offsets[-1], "B"]
+		self.add_array(f"{name}.offsets", offsets)
+
+	def close(self):
+		footer = json.dumps(
+			{
+				"format": SNAPSHOT_FORMAT,
+				"byteorder": sys.byteorder,
+				"sections": self.sections,
+				"meta": self.meta,
+			}
+		).encode()
+		self.file.write(footer)
+		self.file.write(TRAILER.pack(len(footer), SNAPSHOT_MAGIC))
+		self.file.flush()
+		os.fsync(self.file.fileno())
+		self.file.close()
+		os.replace(f"{self.path}.tmp", self.path)
+
+	def _align(self):
+		padding = -self.file.tell() % SECTION_ALIGNMENT
+		if padding:
+			self.file.write(bytes(padding))
+
+
+class Snapshot:
+	"""A memory-mapped snapshot. Raises FileNotFoundError if there is no file at `path`."""
+
+	def __init__(self, path):
+		self.path = path
+		with open(path, "rb") as f:
+			self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+		footer_length, magic = TRAILER.unpack_from(self.buffer, len(self.buffer) - TRAILER.size)
+		if magic != SNAPSHOT_MAGIC:
+			raise ValueError(f"{path} is not a search index snapshot")
+
+		footer_end = len(self.buffer) - TRAILER.size
+		footer = json.loads(self.buffer[footer_end - footer_length : footer_end])
+		if footer["format"] != SNAPSHOT_FORMAT or footer["byteorder"] != sys.byteorder:
+			raise ValueError(f"{path} was written in an incompatible format")
+
+		self.sections = footer["sections"]
+		self.meta = footer["meta"]
+		self.view = memoryview(self.buffer)
+
+	def array(self, name):
+		start, length, typecode = self.sections[name]
+		return self.view[start : start + length].cast(typecode)
+
+	def strings(self, name):
+		return StringTable(self.array(name), self.array(f"{name}.offsets"))
+
+
+class StringTable(Sequence):
+	"""Strings of a snapshot section. Items are memoryviews into the mapped file."""
+
+	def __init__(self, data, offsets):
+		self.data = data
+		self.offsets = offsets
+
+	def __len__(self):
+		return len(self.offsets) - 1
+
+	def __getitem__(self, i):
+		if not 0 <= i < len(self):
+			raise IndexError(i)
+		return self.data[self.offsets[i] : self.offsets[i + 1]]
+
+	def find(self, value):
+		"""Index of `value` in a sorted table, or -1 if it isn't in it."""
+		i = self._bisect(value)
+		return i if i < len(self) and self[i] == value else -1
+
+	def find_prefix(self, prefix):
+		"""Index of the first string that starts with `prefix` in a sorted table, or -1."""
+		i = self._bisect(prefix)
+		return i if i < len(self) and self[i][: len(prefix)] == prefix else -1
+
+	def _bisect(self, value):
+		return bisect_left(range(len(self)), value, key=lambda i: self[i].tobytes())
+
+
+class OverlayMapping(MutableMapping):
+	"""Mapping over a read-only table of a snapshot, with changes kept in memory.
+
+	`base` provides `get(key)`, returning None for missing keys, and `keys()`. Values read from it
+	are kept in a bounded cache, as decoding them repeatedly would be slower than a dict lookup.
+	Values are not written back to the base when they are mutated, they have to be assigned again.
+	"""
+
+	CACHE_SIZE = 4096
+
+	def __init__(self, base, size):
+		self.base = base
+		self.size = size
+		self.changed = {}
+		self.deleted = set()
+		self.cache = {}
+
+	def __getitem__(self, key):
+		if key in self.changed:
+			return self.changed[key]
+		if key in self.deleted:
+			raise KeyError(key)
+
+		value = self.cache.get(key)
+		if value is None:
+			value = self.base.get(key)
+			if value is None:
+				raise KeyError(key)
+			if len(self.cache) >= self.CACHE_SIZE:
+				self.cache.clear()
+			self.cache[key] = value
+		return value
+
+	def __setitem__(self, key, value):
+		if key not in self:
+			self.size += 1
+		self.changed[key] = value
+		self.deleted.discard(key)
+
+	def __delitem__(self, key):
+		if key not in self:
+			raise KeyError(key)
+		self.changed.pop(key, None)
+		self.cache.pop(key, None)
+		self.deleted.add(key)
+		self.size -= 1
+
+	def __iter__(self):
+		for key in self.base.keys():
+			if key not in self.changed and key not in self.deleted:
+				yield key
+		yield from list(self.changed)
+
+	def __len__(self):
+		return self.size
+
+
+class OverlayList:
+	"""List over a read-only sequence of a snapshot. Items can be replaced and appended."""
+
+	def __init__(self, base):
+		self.base = base
+		self.changed = {}
+		self.appended = []
+
+	def __len__(self):
+		return len(self.base) + len(self.appended)
+
+	def __getitem__(self, i):
+		if i >= len(self.base):
+			return self.appended[i - len(self.base)]
+		if i in self.changed:
+			return self.changed[i]
+		return self.base[i]
+
+	def __setitem__(self, i, value):
+		if i >= len(self.base):
+			self.appended[i - len(self.base)] = value
+		else:
+			self.changed[i] = value
+
+	def __iter__(self):
+		for i in range(len(self)):
+			yield self[i]
+
+	def append(self, value):
+		self.appended.append(value)
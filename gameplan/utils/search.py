@@ -9,10 +9,29 @@ from frappe.utils import cstr
 from redis.commands.search.field import TagField, TextField
 from redis.commands.search.indexDefinition import IndexDefinition
 from redis.commands.search.query import Query
-from redis.exceptions import ResponseError
+from redis.exceptions import LockError, ResponseError
+
+# Seconds a rebuild holds its lock for without refreshing it, after which another rebuild can start
+# and drop the generation it was building
+REBUILD_LOCK_TIMEOUT = 600
+
+
+class RebuildInProgressError(frappe.ValidationError):
+	pass
 
 
 class Search:
+	"""Redis search index that is rebuilt without downtime.
+
+	Each rebuild creates a new generation of the index, `{index_name}_v{n}`, whose documents are
+	stored under their own key prefix, `{prefix}_v{n}`. Queries go through an alias named
+	`index_name`, which is switched to the new generation once it is complete, after which the
+	previous generation is dropped. Documents updated during a rebuild are written to both.
+
+	Only one rebuild runs at a time. It holds a lock in Redis until it finishes, which it has to
+	refresh with `refresh_rebuild_lock` at least every `REBUILD_LOCK_TIMEOUT` seconds.
+	"""
+
 	def __init__(self, index_name, prefix, schema) -> None:
 		self.redis = frappe.cache()
 		self.index_name = index_name
@@ -21,9 +40,9 @@ class Search:
 		for field in schema:
 			self.schema.append(frappe._dict(field))
 
-	def create_index(self):
+	def create_index(self, generation=None):
 		index_def = IndexDefinition(
-			prefix=[f"{self.redis.make_key(self.prefix).decode()}:"],
+			prefix=[f"{self.redis.make_key(self.get_prefix(generation)).decode()}:"],
 		)
 		schema = []
 		for field in self.schema:
@@ -33,25 +52,147 @@ class Search:
 			else:
 				schema.append(TextField(field.name, **kwargs))
 
-		self.redis.ft(self.index_name).create_index(schema, definition=index_def)
+		self.redis.ft(self.get_index_name(generation)).create_index(schema, definition=index_def)
+
+	def start_rebuild(self):
+		"""Create the next generation of the index and return it.
+
+		Documents have to be added to it with `add_documents`, after which `finish_rebuild` makes
+		searches use it. Raises `RebuildInProgressError` if another rebuild is running.
+		"""
+		lock = self.redis.lock(
+			self.redis.make_key(f"{self.index_name}:rebuild_lock"), timeout=REBUILD_LOCK_TIMEOUT
+		)
+		if not lock.acquire(blocking=False):
+			frappe.throw(f"The {self.index_name} index is already being rebuilt", RebuildInProgressError)
+		self._rebuild_lock = lock
+
+		building = self.get_building_generation()
+		if building:
+			# Left over by a rebuild that stopped without releasing its lock
+			self._drop_generation(building)
+
+		generation = max(self.get_generation() or 0, building or 0) + 1
+		self.create_index(generation)
+		self.redis.set_value(f"{self.index_name}:building", generation)
+		return generation
+
+	def finish_rebuild(self, generation):
+		"""Point the alias at the given generation and drop the previous one."""
+		previous = self.get_generation()
+		if previous is None and self.index_exists():
+			# The index was created before it was versioned, under the name of the alias
+			self._drop_generation(None)
+
+		self.redis.ft(self.get_index_name(generation)).aliasupdate(self.index_name)
+		self.redis.set_value(f"{self.index_name}:generation", generation)
+		self.redis.delete_value(f"{self.index_name}:building")
 		self._index_exists = True
 
+		if previous is not None:
+			self._drop_generation(previous)
+		self._release_rebuild_lock()
+
+	def abort_rebuild(self, generation):
+		"""Drop a generation that failed to build, searches keep using the current one."""
+		self._drop_generation(generation)
+		self.redis.delete_value(f"{self.index_name}:building")
+		self._release_rebuild_lock()
+
+	def refresh_rebuild_lock(self):
+		"""Keep holding the rebuild lock for another `REBUILD_LOCK_TIMEOUT` seconds."""
+		self._rebuild_lock.reacquire()
+
+	def _release_rebuild_lock(self):
+		lock, self._rebuild_lock = getattr(self, "_rebuild_lock", None), None
+		if lock:
+			try:
+				lock.release()
+			except LockError:
+				# Expired, another rebuild may hold it by now
+				pass
+
+	def get_generation(self):
+		"""Generation the alias points at, or None if the index isn't versioned yet."""
+		return self.redis.get_value(f"{self.index_name}:generation")
+
+	def get_building_generation(self):
+		return self.redis.get_value(f"{self.index_name}:building")
+
+	def get_index_name(self, generation):
+		return f"{self.index_name}_v{generation}" if generation else self.index_name
+
+	def get_prefix(self, generation):
+		return f"{self.prefix}_v{generation}" if generation else self.prefix
+
 	def add_document(self, id, doc, payload=None):
+		for generation in self._get_write_generations():
+			doc_id = self.redis.make_key(f"{self.get_prefix(generation)}:{id}").decode()
+			self.redis.ft(self.get_index_name(generation)).add_document(
+				doc_id, payload=json.dumps(payload), replace=True, **self.get_mapping(doc)
+			)
+
+	def add_documents(self, documents, generation, chunk_size=500):
+		"""Add an iterable of (id, doc, payload) tuples to a generation and return how many were added.
+
+		Documents are sent in pipelines of `chunk_size` commands, so adding many of them takes one
+		round trip per chunk instead of one per document.
+		"""
+		indexer = self.redis.ft(self.get_index_name(generation)).batch_indexer(chunk_size=chunk_size)
+		count = 0
+		for id, doc, payload in documents:
+			doc_id = self.redis.make_key(f"{self.get_prefix(generation)}:{id}").decode()
+			indexer.add_document(doc_id, payload=json.dumps(payload), replace=True, **self.get_mapping(doc))
+			count += 1
+		indexer.commit()
+		return count
+
+	def get_mapping(self, doc):
 		doc = frappe._dict(doc)
-		doc_id = self.redis.make_key(f"{self.prefix}:{id}").decode()
 		mapping = {}
 		for field in self.schema:
 			if field.name in doc:
 				mapping[field.name] = cstr(doc[field.name])
-		if self.index_exists():
-			self.redis.ft(self.index_name).add_document(
-				doc_id, payload=json.dumps(payload), replace=True, **mapping
-			)
+		return mapping
 
 	def remove_document(self, id):
-		key = self.redis.make_key(f"{self.prefix}:{id}").decode()
-		if self.index_exists():
-			self.redis.ft(self.index_name).delete_document(key)
+		for generation in self._get_write_generations():
+			key = self.redis.make_key(f"{self.get_prefix(generation)}:{id}").decode()
+			self.redis.ft(self.get_index_name(generation)).delete_document(key)
+
+	def get_document_ids(self, chunk_size=1000):
+		"""Yield the ids of the documents in the generation searches use, scanning their keys."""
+		prefix = self.redis.make_key(f"{self.get_prefix(self.get_generation())}:")
+		for key in self.redis.scan_iter(match=prefix + b"*", count=chunk_size):
+			yield key[len(prefix) :].decode()
+
+	def count_documents(self):
+		"""Number of documents in the generation searches use."""
+		return int(self.redis.ft(self.index_name).info()["num_docs"])
+
+	def get_documents(self, ids):
+		"""Fields of the given documents in the generation searches use, for those that are in it."""
+		prefix = self.get_prefix(self.get_generation())
+		pipe = self.redis.pipeline()
+		for id in ids:
+			pipe.hgetall(self.redis.make_key(f"{prefix}:{id}"))
+
+		documents = {}
+		for id, fields in zip(ids, pipe.execute(), strict=True):
+			if fields:
+				documents[id] = {key.decode(): value.decode() for key, value in fields.items()}
+		return documents
+
+	def _get_write_generations(self):
+		"""Generations documents are written to: the one searched and the one being built, if any."""
+		generations = []
+		generation = self.get_generation()
+		if generation is not None or self.index_exists():
+			generations.append(generation)
+		building = self.get_building_generation()
+		if building and building != generation:
+			generations.append(building)
+		return generations
 
 	def search(self, query, start=0, page_length=50, sort_by=None, highlight=False, with_payloads=False):
 		query = Query(query).paging(start, page_length)
@@ -84,8 +225,20 @@ class Search:
 		return self.redis.ft(self.index_name).spellcheck(query, **kwargs)
 
 	def drop_index(self):
-		if self.index_exists():
-			self.redis.ft(self.index_name).dropindex(delete_documents=True)
+		"""Drop all generations of the index along with their documents."""
+		if self.get_generation() is None and self.index_exists():
+			self._drop_generation(None)
+		for generation in {self.get_generation(), self.get_building_generation()} - {None}:
+			self._drop_generation(generation)
+		self.redis.delete_value([f"{self.index_name}:generation", f"{self.index_name}:building"])
+		self._index_exists = False
+
+	def _drop_generation(self, generation):
+		try:
+			self.redis.ft(self.get_index_name(generation)).dropindex(delete_documents=True)
+		except ResponseError:
+			# Already dropped
+			pass
 
 	def index_exists(self):
 		self._index_exists = getattr(self, "_index_exists", None)
@@ -0,0 +1,202 @@
+# Copyright (c) 2025, Frappe Technologies Pvt Ltd and Contributors
+# See license.txt
+
+import os
+import random
+import shutil
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from gameplan.utils import fts as fts_module
+from gameplan.utils.fts import FullTextSearch
+
+WORDS = (
+	"project deploy server release meeting design review bug feature customer invoice payment report "
+	"dashboard search index query performance latency memory worker queue database comment task page "
+	"team roadmap sprint planning budget the and is"
+).split()
+
+
+class TestFullTextSearch(FrappeTestCase):
+	redis_prefix = "test_fts:"
+
+	def setUp(self):
+		self.clear_index()
+		rnd = random.Random(42)
+		documents = []
+		for i in range(1000):
+			documents.append(
+				{
+					"id": f"GP Discussion:{i}",
+					"title": " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(2, 6))),
+					"content": " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(5, 80))),
+					"timestamp": 1700000000 + rnd.randint(0, 10**7),
+					"attributes": {"project": str(i % 3)},
+				}
+			)
+		self.get_fts().index_documents(documents)
+
+		self.queries = ["the", "xyzzy"]
+		for _ in range(50):
+			self.queries.append(" ".join(rnd.choice(WORDS) for _ in range(rnd.randint(1, 4))))
+
+	def tearDown(self):
+		self.clear_index()
+
+	def clear_index(self):
+		frappe.cache().delete_keys(self.redis_prefix)
+		shutil.rmtree(self.get_fts()._get_snapshot_dir(), ignore_errors=True)
+
+	def get_fts(self, max_results=200):
+		fts = FullTextSearch(max_results=max_results)
+		fts.redis_prefix = self.redis_prefix
+		return fts
+
+	def test_top_k_ranking_matches_exhaustive_ranking(self):
+		for max_results in (1, 10, 200):
+			fts = self.get_fts(max_results)
+			fts._load_index_from_redis()
+			for query in self.queries:
+				words = query.split()
+				for title_only in (False, True):
+					self.assertEqual(
+						fts._rank_top_k(words, words, title_only, count_matches=True),
+						fts._rank_exhaustive(words, words, title_only),
+						msg=f"{query=} {title_only=} {max_results=}",
+					)
+
+	def test_misspelled_words_are_corrected(self):
+		fts = self.get_fts()
+		summary = fts.search("deplyo dashbord")["summary"]
+		self.assertEqual(summary["corrected_words"], {"deplyo": "deploy", "dashbord": "dashboard"})
+		self.assertIsNone(fts.search("deploy xyzzy")["summary"]["corrected_words"])
+
+	def test_phrase_query_only_matches_exact_phrase(self):
+		fts = self.get_fts()
+		results = fts.search('"deploy server"')["results"]
+		self.assertTrue(results)
+		contents = fts._get_contents([result["id"] for result in results])
+		for content in contents:
+			self.assertIn("deploy server", f"{content['title']} | {content['content']}")
+
+	def test_matched_words_are_highlighted_in_snippets(self):
+		fts = self.get_fts()
+		for result in fts.search("deploy dashboard")["results"]:
+			text = f"{result['title']} {result['content']}".lower()
+			self.assertRegex(text, r"<mark>(deploy|dashboard)</mark>")
+			self.assertNotRegex(text, r"<mark>(?!deploy</mark>|dashboard</mark>)")
+
+	def test_snippets_keep_the_punctuation_after_their_last_word(self):
+		fts = self.get_fts()
+		fts.index_document(
+			{
+				"id": "GP Page:1",
+				"title": "",
+				"content": "<p>quokka six seven eight nine https://example.com more words</p>",
+				"timestamp": 1,
+			}
+		)
+		content = fts.search("quokka")["results"][0]["content"]
+		self.assertEqual(content, "...<mark>quokka</mark> six seven eight nine [link]...")
+
+	def test_search_is_restricted_to_given_projects(self):
+		fts = self.get_fts(max_results=10)
+		results = fts.search("deploy", projects=["1"])["results"]
+		self.assertEqual(len(results), 10)
+		self.assertEqual({result["attributes"]["project"] for result in results}, {"1"})
+
+		# The estimated number of matches only counts documents in the project too
+		summary = fts.search("the", projects=["1"])["summary"]
+		self.assertTrue(summary["total_matches_estimated"])
+		self.assertLessEqual(summary["total_matches"], 333)
+		exact = fts.search("the", projects=["1"], count_matches=True)["summary"]["total_matches"]
+		self.assertLessEqual(exact, 333)
+
+	def test_change_log_is_compacted_into_a_new_snapshot(self):
+		fts = self.get_fts()
+		fts.index_document(
+			{"id": "GP Discussion:new", "title": "kubernetes rollout", "content": "deploy", "timestamp": 1}
+		)
+		fts.remove_document("GP Discussion:0")
+		old_snapshot = fts._get_snapshot_path(frappe.cache().mget(fts._key("version"))[0].decode())
+
+		for compacted in (False, True):
+			if compacted:
+				fts.compact_change_log()
+				self.assertEqual(fts.pending_updates(), 0)
+			fts = self.get_fts()
+			result = fts.search("kubernetes")["results"][0]
+			self.assertEqual(result["id"], "GP Discussion:new")
+			self.assertEqual(result["title"], "<mark>kubernetes</mark> rollout")
+			self.assertNotIn("GP Discussion:0", fts.doc_numbers)
+			self.assertEqual(fts.document_count, 1000)
+
+		self.assertTrue(fts.index_exists())
+		self.assertTrue(os.path.exists(old_snapshot))
+
+	def test_documents_are_counted_by_id_prefix(self):
+		fts = self.get_fts()
+		for doc_id in ("GP Comment:1", "GP Comment:2", "GP Discussion:5"):
+			fts.index_document({"id": doc_id, "title": "", "content": "quokka sighting", "timestamp": 1})
+		fts.remove_document("GP Comment:2")
+		fts.remove_document("GP Discussion:0")
+
+		fts = self.get_fts()
+		self.assertEqual(fts.count_documents("GP Discussion:"), 999)
+		self.assertEqual(fts.count_documents("GP Comment:"), 1)
+		self.assertEqual(fts.count_documents("GP Page:"), 0)
+
+	def test_concurrent_updates_are_not_lost(self):
+		writers = [self.get_fts() for _ in range(2)]
+		for writer in writers:
+			writer._load_index_from_redis()
+		for i, writer in enumerate(writers):
+			writer.index_document(
+				{"id": f"GP Comment:{i}", "title": "", "content": "quokka sighting", "timestamp": 1}
+			)
+		writers[1].remove_document("GP Discussion:1")
+
+		for fts in (writers[0], self.get_fts()):
+			fts._index_loaded = False
+			results = fts.search("quokka")["results"]
+			self.assertEqual({result["id"] for result in results}, {"GP Comment:0", "GP Comment:1"})
+			self.assertNotIn("GP Discussion:1", fts.doc_numbers)
+
+	def test_instances_sharing_the_cached_index_keep_its_counters(self):
+		writers = [self.get_fts() for _ in range(2)]
+		for writer in writers:
+			writer._load_index_from_redis()
+		for i, writer in enumerate(writers):
+			writer.index_document(
+				{
+					"id": f"GP Comment:{i}",
+					"title": "",
+					"content": "quokka sighting " * (i + 1),
+					"timestamp": 1,
+				}
+			)
+		writers[0].remove_document("GP Discussion:1")
+		writers[1].compact_change_log()
+
+		# Read from the snapshot and the change log again, without the cached copy
+		fts_module._index_cache.clear()
+		fresh = self.get_fts()
+		fresh._load_index_from_redis()
+		self.assertEqual(fresh.document_count, 1001)
+		self.assertEqual(fresh.total_length, sum(fresh.doc_lengths))
+		for writer in writers:
+			writer._apply_change_log()
+			self.assertEqual(writer.total_length, fresh.total_length)
+			self.assertEqual(writer.avg_doc_length, fresh.avg_doc_length)
+
+	def test_summary_has_phase_timings_and_counters(self):
+		summary = self.get_fts(max_results=10).search('deplyo "deploy server"', projects=["1"])["summary"]
+		self.assertLessEqual(
+			{"load", "constraints", "permissions", "fuzzy", "bm25", "proximity", "snippets"},
+			set(summary["timings"]),
+		)
+		counters = summary["counters"]
+		self.assertEqual(counters["matches"], summary["total_matches"])
+		self.assertGreaterEqual(counters["postings"], counters["candidates"])
+		self.assertGreaterEqual(counters["candidates"], counters["scored"])